@@ -180,7 +180,7 @@ def ss(*cargs):
     subsystems.append(subsystem(*cargs))
     
 # autopilot dependencies (required): RTIMULIB2 python3-serial libpython3-dev python3-numpy python3-scipy swig
-#                        (recommended): python3-ujson python3-pyudev python3-zeroconf
+#                        (recommended): python3-orjson python3-ujson python3-pyudev python3-zeroconf
 
 ss('dependencies', 'dependency script dependencies',
    [py_dep('importlib_metadata')])
@@ -190,7 +190,7 @@ ss('autopilot', 'core autopilot or imu-only mode',
 
 # dependencies not required but reduce cpu usage considerably
 ss('optimize', '(recommended) core autopilot operations',
-   [py_dep('ujson'), py_dep('pyudev'), py_dep('inotify')])
+   [py_dep('orjson'), py_dep('ujson'), py_dep('pyudev'), py_dep('inotify')])
 
 # signalk dependencies: python3-zerconf python3-requests python3-websocket
 ss('signalk', 'communicate with signalk-node-server distributed with openploter',
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# asyncio client for the pypilot server
+#
+# many sessions can share one event loop and are woken as soon as data arrives
+# rather than polling.  The connection is maintained by a background task which
+# reconnects and restores all watches if the server restarts
+#
+#    client = AsyncPypilotClient('192.168.14.1')
+#    heading = await client.get('ap.heading')
+#    async for name, value in client.watch('imu.heading', .1):
+#        print(name, value)
+
+import asyncio, os, sys, time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import gettext_loader
+import pyjson
+from client import DEFAULT_PORT, local_hosts, unix_socket_name
+
+reconnect_period = 1 # seconds between connection attempts
+watch_queue_size = 64 # oldest values are dropped for slow consumers
+line_limit = 1 << 24 # longest line, the values list of a large server is over 64KB
+
+class AsyncWatch(object):
+    def __init__(self, client, name, period):
+        self.client = client
+        self.name = name
+        self.period = period
+        self.queue = asyncio.Queue(watch_queue_size)
+        self.next_time = {} # name -> earliest time of next value
+        self.pending = {} # values held back by the period
+        self.timer = False
+
+    def matches(self, name):
+        if self.name.endswith('*'):
+            return name.startswith(self.name[:-1])
+        return name == self.name
+
+    # the server sends at the fastest period of all subscriptions to a name
+    # so slower subscriptions only get the latest value once per period
+    def put(self, name, value):
+        if self.period:
+            t = time.monotonic()
+            next_time = self.next_time.get(name, 0)
+            if t < next_time:
+                self.pending[name] = value
+                if not self.timer:
+                    self.timer = asyncio.get_running_loop().call_later(next_time - t, self.flush)
+                return
+            self.next_time[name] = t + self.period
+        self.enqueue(name, value)
+
+    def flush(self):
+        self.timer = False
+        t = time.monotonic()
+        wait = False
+        for name, value in list(self.pending.items()):
+            dt = self.next_time[name] - t
+            if dt > 0:
+                wait = dt if wait is False else min(wait, dt)
+                continue
+            del self.pending[name]
+            self.next_time[name] = t + self.period
+            self.enqueue(name, value)
+        if wait is not False:
+            self.timer = asyncio.get_running_loop().call_later(wait, self.flush)
+
+    def enqueue(self, name, value):
+        if self.queue.full():
+            self.queue.get_nowait() # drop oldest
+        self.queue.put_nowait((name, value))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.client:
+            msg = await self.queue.get()
+            if msg[0] is not None:
+                return msg
+        raise StopAsyncIteration # closed
+
+    def close(self):
+        if self.client:
+            self.client.unwatch(self)
+            self.finish()
+
+    def finish(self):
+        self.client = False
+        if self.timer:
+            self.timer.cancel()
+        self.enqueue(None, None)
+
+class AsyncPypilotClient(object):
+    def __init__(self, host=False, port=DEFAULT_PORT):
+        if not host:
+            host = 'localhost'
+        if ':' in host:
+            host, port = host.split(':', 1)
+        self.host, self.port = host, int(port)
+        self.unix_socket_path = os.getenv('HOME', '') + '/.pypilot/' + unix_socket_name(self.port)
+        self.writer = False
+        self.connected = asyncio.Event()
+        self.task = False
+        self.subscriptions = [] # AsyncWatch instances
+        self.watches = {} # name -> period requested from the server
+        self.getters = {} # name -> futures waiting for a value
+        self.values = {} # last received value of each watched name
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = False
+        if self.writer:
+            self.writer.close()
+            self.writer = False
+        for watch in self.subscriptions:
+            watch.finish()
+        self.subscriptions = []
+
+    async def open(self):
+        if self.host in local_hosts and os.path.exists(self.unix_socket_path):
+            try:
+                return await asyncio.open_unix_connection(self.unix_socket_path, limit=line_limit)
+            except OSError:
+                pass # server without unix socket, use tcp
+        return await asyncio.open_connection(self.host, self.port, limit=line_limit)
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await self.open()
+            except OSError:
+                await asyncio.sleep(reconnect_period)
+                continue
+
+            self.writer = writer
+            if self.watches: # restore watches after reconnecting
+                self.send('watch=' + pyjson.dumps(self.watches) + '\n')
+            for name in self.getters:
+                if not self.watching(name):
+                    self.send('watch=' + pyjson.dumps({name: True}) + '\n')
+            self.connected.set()
+
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.receive_line(line.decode())
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e: # eg: a line over the limit, start again with a new connection
+                print(_('async client error, reconnecting'), e)
+
+            self.connected.clear()
+            self.writer = False
+            writer.close()
+            await asyncio.sleep(reconnect_period)
+
+    def receive_line(self, line):
+        try:
+            name, data = line.rstrip().split('=', 1)
+            if name == 'error': # plain text
+                print('server error:', data)
+                return
+            value = pyjson.loads(data)
+        except ValueError as e:
+            print('async client value error:', line, e)
+            return
+
+        self.values[name] = value
+        futures = self.getters.pop(name, False)
+        if futures:
+            for future in futures:
+                if not future.done():
+                    future.set_result(value)
+            if not self.watching(name): # only watched to get the value
+                self.send('watch=' + pyjson.dumps({name: False}) + '\n')
+
+        for watch in self.subscriptions:
+            if watch.matches(name):
+                watch.put(name, value)
+
+    def send(self, msg):
+        if self.writer:
+            self.writer.write(msg.encode())
+
+    async def wait_connected(self, timeout=None):
+        self.start()
+        await asyncio.wait_for(self.connected.wait(), timeout)
+
+    async def get(self, name, timeout=None):
+        self.start()
+        watching = self.watching(name)
+        if watching and name in self.values: # kept current by the watch
+            return self.values[name]
+        future = asyncio.get_running_loop().create_future()
+        if not name in self.getters:
+            self.getters[name] = []
+            if not watching:
+                # server replies to a new watch with the current value
+                self.send('watch=' + pyjson.dumps({name: True}) + '\n')
+            else: # watched before the value existed, ask for it once
+                self.send('get=' + pyjson.dumps([name]) + '\n')
+        self.getters[name].append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if name in self.getters and future in self.getters[name]:
+                self.getters[name].remove(future)
+                if not self.getters[name]:
+                    del self.getters[name]
+                    if not self.watching(name): # timed out or cancelled, remove the watch for it
+                        self.send('watch=' + pyjson.dumps({name: False}) + '\n')
+
+    async def list_values(self, timeout=None):
+        return await self.get('values', timeout)
+
+    def set(self, name, value):
+        self.send(name + '=' + pyjson.dumps(value) + '\n')
+
+    def watch(self, name, period=0):
+        self.start()
+        watch = AsyncWatch(self, name, period)
+        self.subscriptions.append(watch)
+        self.update_watch(name)
+        return watch
+
+    def unwatch(self, watch):
+        self.subscriptions.remove(watch)
+        self.update_watch(watch.name)
+
+    def watching(self, name):
+        for watch in self.subscriptions:
+            if watch.matches(name):
+                return True
+        return False
+
+    # the server has one period per name, the fastest of our subscriptions
+    def update_watch(self, name):
+        period = False
+        for watch in self.subscriptions:
+            if watch.name == name and (period is False or watch.period < period):
+                period = watch.period
+        if period is False:
+            if not name in self.watches:
+                return
+            del self.watches[name]
+        else:
+            if name in self.watches and self.watches[name] == period:
+                return
+            self.watches[name] = period
+        watches = {name: period}
+        if name.endswith('*'):
+            # a prefix watch replaces the period of each matching value on this
+            # connection, so restore the values watched faster or by name only
+            for wname, wperiod in self.watches.items():
+                if wname.startswith(name[:-1]) and not wname.endswith('*') and \
+                   (period is False or wperiod < period):
+                    watches[wname] = wperiod
+        self.send('watch=' + pyjson.dumps(watches) + '\n')
+
+async def main():
+    args = list(sys.argv)[1:]
+    host = False
+    if '-s' in args:
+        i = args.index('-s')
+        host = args[i+1]
+        args = args[:i] + args[i+2:]
+
+    client = AsyncPypilotClient(host)
+    if not args:
+        print(sorted(await client.list_values()))
+        return
+    watches = [client.watch(name, .5) for name in args]
+    async def show(watch):
+        async for name, value in watch:
+            print(name, '=', value)
+    await asyncio.gather(*map(show, watches))
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -28,7 +28,8 @@ from resolv import *
 import tacking, servo
 from version import strversion
 from sensors import Sensors
-import pilots
+from histogram import RollingHistogram
+import pilots, tracing
 
 def minmax(value, r):
     return min(max(value, -r), r)
@@ -85,15 +86,69 @@ class TimedQueue(object):
       return self.data[0][0]
     return 0
         
+# tail latency of each phase of the autopilot iteration
+# published each second as [p50, p95, p99, max, overruns] in milliseconds
+class LoopTimings(object):
+    phases = ['server', 'sensors', 'wait', 'imu', 'pilot', 'servo', 'calibration']
+
+    def __init__(self, ap):
+        self.value = ap.register(JSONValue, 'loop_timings', {})
+        self.histograms = {}
+        for name in self.phases + ['iteration', 'jitter']:
+            self.histograms[name] = RollingHistogram()
+        self.overruns = dict.fromkeys(self.phases + ['iteration'], 0)
+        del self.overruns['wait'] # waiting for the imu is not an overrun
+        self.lastsample = False
+        self.publish_time = time.monotonic()
+
+    # times are the boundaries between phases, in standby the server phase
+    # also waits up to rdt for the client to receive which is not counted
+    def update(self, times, period, sample, rdt=0):
+        histograms, overruns = self.histograms, self.overruns
+        for i in range(len(self.phases)):
+            name, dt = self.phases[i], times[i+1] - times[i]
+            if i == 0:
+                dt = max(dt - rdt, 0)
+            histograms[name].add(dt)
+            if dt > period/2 and name in overruns:
+                overruns[name] += 1
+        # iteration excludes the waits
+        dt = max(times[-1] - times[0] - (times[3] - times[2]) - rdt, 0)
+        histograms['iteration'].add(dt)
+        if dt > period:
+            overruns['iteration'] += 1
+
+        if sample: # deviation of the interval between imu samples processed
+            if self.lastsample:
+                histograms['jitter'].add(abs(sample - self.lastsample - period))
+            self.lastsample = sample
+
+        t = times[-1]
+        if t - self.publish_time < 1:
+            return
+        self.publish_time = t
+        timings = {}
+        for name in histograms:
+            histogram = histograms[name]
+            histogram.rotate(t)
+            summary = histogram.summary()
+            if summary['count']:
+                timings[name] = [summary['p50'], summary['p95'], summary['p99'], summary['max']]
+                if name in overruns:
+                    timings[name].append(overruns[name])
+        self.value.set(timings)
+
 class Autopilot(object):
-    def __init__(self):
+    def __init__(self, replay=False):
         super(Autopilot, self).__init__()
         self.watchdog_device = False
+        tracing.start('autopilot')
 
+        # a replay runs no other processes and touches no hardware
         self.server = pypilotServer()
-        self.client = pypilotClient(self.server, use_udp=True)
-        self.boatimu = BoatIMU(self.client)
-        self.sensors = Sensors(self.client, self.boatimu)
+        self.client = pypilotClient(self.server, use_udp=not replay)
+        self.boatimu = BoatIMU(self.client, replay)
+        self.sensors = Sensors(self.client, self.boatimu, replay)
         self.servo = servo.Servo(self.client, self.sensors)
         self.version = self.register(Value, 'version', 'pypilot' + ' ' + strversion)
         self.timestamp = self.client.register(TimeStamp())
@@ -148,7 +203,14 @@ class Autopilot(object):
 
         self.runtime = self.register(TimeValue, 'runtime') #, persistent=True)
         self.timings = self.register(SensorValue, 'timings', False)
+        self.imu_latency = self.register(SensorValue, 'imu_latency')
+        self.loop_timings = LoopTimings(self)
+        self.trace = self.register(BooleanProperty, 'trace', False) # write traces when set
         self.last_heading_mode = False
+        self.lasttime = time.monotonic()
+        if replay:
+            self.childprocesses = []
+            return
 
         '''
         device = '/dev/watchdog0'
@@ -162,8 +224,6 @@ class Autopilot(object):
         self.server.poll() # setup process before we switch main process to realtime
         if os.system('sudo chrt -pf 1 %d 2>&1 > /dev/null' % os.getpid()):
             print(_('warning: failed to make autopilot process realtime'))
-    
-        self.lasttime = time.monotonic()
 
         # setup all processes to exit on any signal
         self.childprocesses = [self.boatimu.imu, self.boatimu.auto_cal,
@@ -202,6 +262,8 @@ class Autopilot(object):
         for s in range(1, 16):
             if s == 13:
                 signal.signal(s, printpipewarning)
+            elif s == tracing.trace_signal and tracing.tracer:
+                signal.signal(s, lambda signal_number, frame: self.dump_trace())
             elif s != 9:
                 signal.signal(s, cleanup)
 
@@ -221,6 +283,17 @@ class Autopilot(object):
     def register(self, _type, name, *args, **kwargs):
         return self.client.register(_type(*(['ap.' + name] + list(args)), **kwargs))
 
+    def dump_trace(self):
+        if not tracing.tracer:
+            print(_('tracing not enabled, run with PYPILOT_TRACE=1'))
+            return
+        tracing.dump()
+        for child in self.childprocesses: # each process writes its own trace
+            try:
+                os.kill(child.process.pid, tracing.trace_signal)
+            except Exception as e:
+                pass # not a separate process
+
     def adjust_mode(self, pilot):
         # if the mode must change
         newmode = pilot.best_mode(self.preferred_mode.value)
@@ -363,16 +436,22 @@ class Autopilot(object):
         if t2-t1 > period/2:
             print(_('sensors is running too _slowly_'), t2-t1)
 
-        sp = 0
-        for tries in range(14): # try 14 times to read from imu
-            timu = time.monotonic()
+        tw = t2
+        sp = 0 # time spent waiting for the imu
+        deadline = t2 + period*1.4
+        while True: # wait for the next imu sample
             t2 = time.monotonic()
             data = self.boatimu.read()
-            if data:
+            if data or t2 >= deadline:
                 break
-            pd10 = period/10
-            sp += pd10
-            time.sleep(pd10)
+            if self.boatimu.imu.multiprocessing:
+                # woken by the imu process so the pilot runs as soon as the sample arrives
+                self.boatimu.imu.ring.wait(deadline - t2)
+                sp += time.monotonic() - t2
+            else:
+                pd10 = period/10
+                sp += pd10
+                time.sleep(pd10)
 
             #if not data:
             #print('autopilot failed to read imu at time:', time.monotonic(), period)
@@ -471,12 +550,15 @@ class Autopilot(object):
 
         if self.enabled.value:
             self.servo.poll()
+            if data: # time from imu sample to servo command
+                self.imu_latency.set(time.monotonic() - data['timestamp'])
 
         if self.starttime > 30:
             # make gps position/velocity prediction from inertial sensors            
             self.sensors.gps.predict(self)
             self.sensors.water.compute(self) # calculate leeway and currents
 
+        tc = time.monotonic()
         self.boatimu.poll(not self.enabled.value) # after critical loop is done, only calibrate (avoid updating when underway)
         self.tack.poll()
 
@@ -491,16 +573,27 @@ class Autopilot(object):
             print(_('servo is running too _slowly_'), t5-t4)
 
         self.timings.set([t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, t5-t0])
+        times = [t0, t1, tw, t2, t3, t4, tc, t5]
+        self.loop_timings.update(times, period, data and t2, rdt)
+        if tracing.tracer:
+            for i in range(len(times)-1):
+                name = LoopTimings.phases[i]
+                if name != 'wait':
+                    tracing.span('ap.' + name, times[i], times[i+1])
+        if self.trace.value:
+            self.trace.set(False)
+            self.dump_trace()
         self.timestamp.set(t0-self.starttime)
           
         #if self.watchdog_device:
         #    self.watchdog_device.write('c')
 
         t6 = time.monotonic()
-        if t6-t0 > period and t0-self.starttime > 5 and self.enabled.value:
-            print(_('autopilot iteration running too slow'), t6-t0)
+        if t6-t0-sp > period and t0-self.starttime > 5 and self.enabled.value:
+            print(_('autopilot iteration running too slow'), t6-t0-sp)
 
-        while self.enabled.value:  # sleep remainder of period
+        # waiting on the imu process already paces the loop
+        while self.enabled.value and not self.boatimu.imu.multiprocessing:  # sleep remainder of period
             dt = period - (time.monotonic() - t0) + sp
             if dt >= period or dt <= 0:
                 break
@@ -514,6 +607,9 @@ def main():
     if os.geteuid() == 0:
         print(_('WARNING: running autopilot as root!!'))
     ap = Autopilot()
+    if '-r' in sys.argv: # record the inputs for pypilot_replay
+        import replay
+        replay.Recorder(ap, sys.argv[sys.argv.index('-r')+1])
     print('pypilot' + _('init complete'), time.monotonic())
     while True:
         ap.iteration()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# load generator for the server and client stack
+#
+# a server is started with synthetic values updated at a fixed rate,
+# each update carries its sequence number and the monotonic time it was
+# set so clients (in other processes) can measure end to end latency and
+# detect lost updates.  results are printed as json so runs can be compared
+#
+# the server listens on a free port and keeps no settings, run from main
+# the clients also keep their configuration in a temporary home
+
+import sys, os, time, json, socket
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import gettext_loader
+
+values_per_owner = 200 # registration of all values is one line limited by the linebuffer
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    return samples[min(int(p*len(samples)), len(samples)-1)]
+
+def latency_summary(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'p50': None, 'p99': None, 'max': None}
+    return {'p50': round(percentile(samples, .5)*1e3, 3),
+            'p99': round(percentile(samples, .99)*1e3, 3),
+            'max': round(samples[-1]*1e3, 3)} # milliseconds
+
+# cpu seconds used by a process, read from /proc so it works for the server process
+def cpu_time(pid=None):
+    if pid is None:
+        return time.process_time()
+    try:
+        f = open('/proc/%d/stat' % pid)
+        fields = f.read().rsplit(')', 1)[1].split()
+        f.close()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return None
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class BenchClient(object):
+    def __init__(self, name, client, names, period):
+        self.name = name
+        self.client = client
+        self.transport = 'pipe' # or the family of the connected socket
+        self.names = names
+        self.period = period
+        self.received = 0
+        self.latencies = []
+        self.last_seq = {} # used to detect missed updates when watching every update
+        self.missed = 0
+        self.cpu_start = self.cpu_end = 0
+        for name in names:
+            client.watch(name, period)
+
+    def poll(self, start, end, timeout=0):
+        self.client.poll(timeout)
+        t = time.monotonic()
+        while True:
+            msg = self.client.receive_single()
+            if not msg:
+                break
+            name, data = msg
+            seq, ts = data
+            if not start or ts < start or (end and ts > end):
+                continue # only measure updates sent during the run
+            self.received += 1
+            self.latencies.append(t - ts)
+            seq = int(seq)
+            if self.period == 0:
+                if name in self.last_seq:
+                    self.missed += max(seq - self.last_seq[name] - 1, 0)
+                self.last_seq[name] = seq
+
+    def result(self, duration):
+        cpu = self.cpu_end - self.cpu_start
+        result = {'name': self.name, 'transport': self.transport, 'period': self.period, 'received': self.received,
+                  'rate': round(self.received / duration, 1),
+                  'cpu': round(100*cpu/duration, 1)} # percent of one core
+        if self.period == 0:
+            result['missed'] = self.missed
+        result.update(latency_summary(self.latencies))
+        return result
+
+# run a client in its own process until the benchmark ends
+def run_client(bench, times, ready, results):
+    while not bench.client.connection:
+        bench.client.poll(.1)
+    family = bench.client.connection.socket.family
+    bench.transport = 'unix' if family == socket.AF_UNIX else 'tcp'
+    ready.put(bench.name)
+    while not times[0]:
+        bench.poll(0, 0, .05) # wait for the start
+    bench.cpu_start = cpu_time()
+    while not times[1]:
+        bench.poll(times[0], 0, .05)
+    bench.cpu_end = cpu_time()
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < .5: # receive updates still in flight
+        bench.poll(times[0], times[1], .05)
+    results.put(bench.result(times[1] - times[0]))
+
+def bench(nvalues=100, rate=10, socket_clients=4, pipe_clients=0, periods=[0, .1, .5],
+          duration=10, multiprocessing=True, transport='tcp'):
+    import multiprocessing as mp
+    import server
+    from client import pypilotClient
+    from values import SensorValue
+    server.use_multiprocessing = multiprocessing
+    pserver = server.pypilotServer(free_port(), persistent=False, unix=transport == 'unix')
+    owners, values = [], []
+    for i in range(nvalues):
+        if i % values_per_owner == 0:
+            owners.append(pypilotClient(pserver))
+        values.append(owners[-1].register(SensorValue('bench.value%d' % i, [0, 0], fmt='%.6f')))
+    names = [value.name for value in values]
+    owner = owners[0]
+    owner.watch('server.stats.connections', 1)
+
+    # direct pipe clients must be created before the server runs
+    clients = []
+    for i in range(pipe_clients):
+        name = 'pipe%d' % i
+        clients.append(BenchClient(name, pypilotClient(pserver), names, periods[i % len(periods)]))
+
+    pserver.poll() # start server
+    for i in range(socket_clients):
+        name = '%s%d' % (transport, i)
+        period = periods[(pipe_clients + i) % len(periods)]
+        host = 'localhost:%d' % pserver.port # the unix socket when the server listens on one
+        clients.append(BenchClient(name, pypilotClient(host), names, period))
+
+    # each client is in its own process unless pipes can not be shared
+    times = mp.Array('d', 2, lock=False) # start and end of measurement
+    ready, results = mp.Queue(), mp.Queue()
+    processes, local = [], []
+    for client in clients:
+        if not multiprocessing and client.name.startswith('pipe'):
+            local.append(client)
+            continue
+        process = mp.Process(target=run_client, args=(client, times, ready, results), daemon=True)
+        process.start()
+        processes.append(process)
+
+    def poll():
+        if not multiprocessing:
+            pserver.poll()
+        for client in local:
+            client.poll(times[0], times[1])
+        for client in owners:
+            client.poll()
+
+    # wait for clients to connect and subscribe
+    t0 = time.monotonic()
+    connected = 0
+    while connected < len(processes):
+        while not ready.empty():
+            ready.get()
+            connected += 1
+        if time.monotonic() - t0 > 10:
+            print(_('timeout waiting for clients'), connected, len(processes))
+            break
+        poll()
+        time.sleep(.01)
+
+    for i in range(int(rate)+1): # warm up so server watches are established
+        poll()
+        time.sleep(1/rate)
+
+    server_pid = pserver.process.pid if multiprocessing else os.getpid()
+    server_cpu = cpu_time(server_pid)
+    owner_cpu = cpu_time()
+    start = times[0] = time.monotonic()
+    for client in local:
+        client.cpu_start = owner_cpu
+    seq = 0
+    next_update = start
+    while True:
+        t = time.monotonic()
+        if t >= start + duration:
+            break
+        if t >= next_update:
+            seq += 1
+            for value in values:
+                value.set([seq, time.monotonic()])
+            next_update += 1/rate
+            if next_update < t:
+                next_update = t # can not keep up
+        poll()
+        dt = next_update - time.monotonic()
+        if dt > 0:
+            time.sleep(min(dt, .01))
+
+    end = times[1] = time.monotonic()
+    duration = end - start
+    server_cpu = cpu_time(server_pid) - server_cpu if server_cpu is not None else None
+    owner_cpu = cpu_time() - owner_cpu
+    for client in local:
+        client.cpu_end = cpu_time()
+
+    stats = {}
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < 1.2: # drain and collect server statistics
+        poll()
+        for name, value in owner.receive().items():
+            if name == 'server.stats.connections':
+                stats = value
+        time.sleep(.01)
+
+    client_results = [client.result(duration) for client in local]
+    for process in processes:
+        try:
+            client_results.append(results.get(timeout=5))
+        except Exception:
+            print(_('missing result from client process'))
+    for process in processes:
+        process.join(1)
+    if multiprocessing:
+        pserver.process.terminate()
+
+    dropped = coalesced = sendfails = 0
+    for name, connection in stats.items():
+        dropped += connection.get('dropped', 0)
+        coalesced += connection.get('coalesced', 0)
+        sendfails += connection.get('sendfails', 0)
+
+    # worst client of each watch period
+    by_period = {}
+    for result in client_results:
+        by_period.setdefault(result['period'], []).append(result)
+    latency = {}
+    for period, rs in by_period.items():
+        latency[str(period)] = {'clients': len(rs),
+                                'received': sum(r['received'] for r in rs),
+                                'p50': max(r['p50'] or 0 for r in rs),
+                                'p99': max(r['p99'] or 0 for r in rs)}
+
+    received = sum(r['received'] for r in client_results)
+    return {'config': {'values': nvalues, 'rate': rate, 'transport': transport,
+                       'socket_clients': socket_clients, 'pipe_clients': pipe_clients, 'periods': periods, 'duration': round(duration, 3),
+                       'multiprocessing': multiprocessing},
+            'updates': seq*nvalues,
+            'update_rate': round(seq*nvalues/duration, 1),
+            'delivered': received,
+            'delivered_rate': round(received/duration, 1),
+            'missed': sum(r.get('missed', 0) for r in client_results),
+            'server': {'cpu': round(100*server_cpu/duration, 1) if server_cpu is not None else None,
+                       'dropped': dropped, 'coalesced': coalesced, 'sendfails': sendfails},
+            'owners': {'count': len(owners), 'cpu': round(100*owner_cpu/duration, 1)},
+            'latency': latency,
+            'clients': sorted(client_results, key=lambda r: r['name'])}
+
+# client cost of parsing streamed updates, each line is split and its json
+# loaded like pypilotClient does, with every json library that is installed.
+# a binary framing with value ids and packed floats was measured against this
+# and was slower to decode in python than orjson reading the text lines
+def parse_benchmark(count=20000):
+    import pyjson
+    lines = ['imu.heading=%.4f\n' % 123.4567, 'imu.accel=[0.0123, -0.0456, 1.0012]\n',
+             'imu.fusionQPose=[0.9876543210, 0.0123456789, -0.0234567891, 0.1234567890]\n',
+             'ap.mode="compass"\n', 'servo.engaged=true\n', 'servo.current=%.4f\n' % 1.2345]
+    text = ''.join(lines)*count
+    result = {'messages': len(lines)*count, 'bytes': len(text)}
+    for codec in pyjson.codecs:
+        try:
+            loads = pyjson.codecs[codec]()[0]
+        except Exception:
+            continue # not installed
+        t0 = time.perf_counter()
+        for line in text.split('\n'):
+            if line:
+                name, data = line.rstrip().split('=', 1)
+                loads(data)
+        t = time.perf_counter() - t0
+        result[codec] = round(t*1e6/result['messages'], 3) # microseconds per message
+    return result
+
+def main():
+    if '--parse' in sys.argv:
+        print(json.dumps(parse_benchmark(), indent=2))
+        exit(0)
+
+    if '-h' in sys.argv:
+        print(_('usage'), sys.argv[0], '[-n VALUES] [-r RATE] [-c CLIENTS] [-p PIPE_CLIENTS] [-w PERIODS] [-t SECONDS] [-s] [--transport tcp|unix] [-o FILE] [--parse]')
+        print('eg:', sys.argv[0], '-n 200 -r 20 -c 8 -w 0,0.1,1')
+        print('-n', _('number of synthetic values'), '(100)')
+        print('-r', _('updates per second of each value'), '(10)')
+        print('-c', _('number of socket clients'), '(4)')
+        print('-p', _('number of direct pipe clients'), '(0)')
+        print('-w', _('comma separated watch periods assigned to clients in turn'), '(0,0.1,0.5)')
+        print('-t', _('seconds to measure'), '(10)')
+        print('-s', _('run the server in this process'))
+        print('--transport', _('socket clients connect over tcp or the unix socket'), '(tcp)')
+        print('-o', _('also write json result to file'))
+        print('--parse', _('only measure parsing received lines with each json library'))
+        print('-h', _('show this message'))
+        exit(0)
+
+    args = list(sys.argv)[1:]
+    def arg(flag, default):
+        if flag in args:
+            i = args.index(flag)
+            return args[i+1]
+        return default
+
+    transport = arg('--transport', 'tcp')
+    if not transport in ['tcp', 'unix']:
+        print(_('unknown transport'), transport)
+        exit(1)
+
+    # do not touch the settings of the real server or clients
+    import tempfile, shutil
+    home = tempfile.mkdtemp(prefix='pypilot_bench')
+    os.makedirs(home + '/.pypilot')
+    os.environ['HOME'] = home
+
+    periods = [float(p) for p in arg('-w', '0,0.1,0.5').split(',')]
+    try:
+        result = bench(int(arg('-n', 100)), float(arg('-r', 10)), int(arg('-c', 4)), int(arg('-p', 0)),
+                       periods, float(arg('-t', 10)), not '-s' in args, transport)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    output = json.dumps(result, indent=2)
+    filename = arg('-o', False)
+    if filename:
+        f = open(filename, 'w')
+        f.write(output + '\n')
+        f.close()
+    print(output)
+    sys.stdout.flush()
+    os._exit(0) # do not wait for client processes
+
+if __name__ == '__main__':
+    main()
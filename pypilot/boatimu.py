@@ -23,6 +23,8 @@ try:
     from values import *
 
     from nonblockingpipe import NonBlockingPipe
+    from imuring import IMURing
+    import tracing
 except:
     import failedimports
 
@@ -37,8 +39,8 @@ class IMU(object):
         self.client = pypilotClient(server)
         self.multiprocessing = server.multiprocessing
         if self.multiprocessing:
-            self.pipe, pipe = NonBlockingPipe('imu pipe', self.multiprocessing)
-            self.process = multiprocessing.Process(target=self.process, args=(pipe,), daemon=True)
+            self.ring = IMURing() # samples shared with the imu process
+            self.process = multiprocessing.Process(target=self.process, args=(self.ring,), daemon=True)
             self.process.start()
             return
         self.process = False
@@ -121,8 +123,9 @@ class IMU(object):
         self.last_axes = False
         self.error.set('IMU not initialized')
 
-    def process(self, pipe):
+    def process(self, ring):
         print('imu process', os.getpid())
+        tracing.start('imu')
         if not RTIMU:
             while True:
                 time.sleep(10) # do nothing
@@ -137,7 +140,8 @@ class IMU(object):
             t0 = time.monotonic()
             data = self.read()
             t1 = time.monotonic()
-            pipe.send(data, not data)
+            if data:
+                ring.write(data)
             t2 = time.monotonic()
 
             if not self.s.GyroBiasValid:
@@ -152,6 +156,9 @@ class IMU(object):
             
             self.poll()
             t3 = time.monotonic()
+            tracing.span('imu.read', t0, t1)
+            tracing.span('imu.write', t1, t2)
+            tracing.span('imu.poll', t2, t3)
             dt = time.monotonic() - t0
             period = 1/self.rate
             t = period - dt
@@ -303,6 +310,8 @@ class TimeValue(StringValue):
         return '"'+self.lastage+'"'
 
 class QuaternionValue(ResettableValue):
+    cache_msg = True
+
     def __init__(self, name, initial, **kwargs):
         super(QuaternionValue, self).__init__(name, initial, **kwargs)
 
@@ -326,6 +335,7 @@ def heading_filter(lp, a, b):
     return result
 
 def CalibrationProcess(cal_pipe, client):
+    tracing.start('calibration')
     if os.system('sudo chrt -po 0 %d 2> /dev/null > /dev/null' % os.getpid()):
         print(_('warning, failed to make calibration process other'))
     if os.system('sudo chrt -pi 0 %d 2> /dev/null > /dev/null' % os.getpid()):
@@ -383,7 +393,7 @@ class AutomaticCalibrationProcess():
 
 
 class BoatIMU(object):
-    def __init__(self, client):
+    def __init__(self, client, replay=False):
         self.client = client
 
         self.rate = self.register(EnumProperty, 'rate', 20, [10, 20], persistent=True)
@@ -401,7 +411,8 @@ class BoatIMU(object):
         self.uptime = self.register(TimeValue, 'uptime')
         self.warning = self.register(StringValue, 'warning', '')
         
-        self.auto_cal = AutomaticCalibrationProcess(client.server)
+        # a replay provides the imu data recorded, and does not calibrate
+        self.auto_cal = replay.auto_cal if replay else AutomaticCalibrationProcess(client.server)
 
         self.lasttimestamp = 0
 
@@ -424,7 +435,7 @@ class BoatIMU(object):
         #sensornames += ['fusionQPose']
         self.SensorValues['fusionQPose'] = self.register(SensorValue, 'fusionQPose', fmt='%.10f')
     
-        self.imu = IMU(client.server)
+        self.imu = replay.imu if replay else IMU(client.server)
 
         self.last_imuread = time.monotonic() + 4 # ignore failed readings at startup
         self.cal_data = False
@@ -449,12 +460,7 @@ class BoatIMU(object):
 
     def IMUread(self):
         if self.imu.multiprocessing:
-            lastdata = False
-            while True:
-                data = self.imu.pipe.recv()
-                if not data:
-                    return lastdata
-                lastdata = data
+            return self.imu.ring.read() # newest sample
         return self.imu.read()
 
     def read(self):
@@ -8,26 +8,57 @@
 # version 3 of the License, or (at your option) any later version.  
 
 import time, select, socket, os
+from collections import deque
+from itertools import islice
+
+max_pending = 4096 # most distinct values queued for a slow connection
+max_out_size = 65536 # bytes queued before a slow connection is closed
 
 try:
-  from pypilot.linebuffer import linebuffer
-  class LineBufferedNonBlockingSocket(object):
+    iov_max = os.sysconf('SC_IOV_MAX') # most buffers for a single sendmsg/writev
+except Exception:
+    iov_max = 16
+
+# output is queued as a deque of encoded chunks so partial sends
+# only advance a memoryview instead of copying the remaining data
+chunk_size = 16384
+def append_chunk(chunks, data):
+    if chunks:  # pack small messages together to keep the iovec short
+        last = chunks[-1]
+        if type(last) is bytearray:
+            if len(last) < chunk_size:
+                last += data
+                return
+        elif type(last) is bytes and len(last) < chunk_size:
+            chunks[-1] = bytearray(last) + data
+            return
+    chunks.append(data)
+
+def consume_chunks(chunks, count):
+    while count:
+        chunk = chunks[0]
+        if count < len(chunk):
+            chunks[0] = memoryview(chunk)[count:]
+            return
+        count -= len(chunk)
+        chunks.popleft()
+
+# output of both socket implementations: value updates streamed to watchers
+# may be coalesced, everything else is queued in order behind them
+class BufferedSocketOutput(object):
     def __init__(self, connection, address):
         connection.setblocking(0)
-        self.b = linebuffer.LineBuffer(connection.fileno())
-
         self.socket = connection
         self.address = address
-        self.out_buffer = ''
+        self.out_buffer = deque() # encoded chunks
+        self.out_size = 0
 
-        self.udp_port = False
-        self.udp_out_buffer = ''
-        self.udp_socket = False
-
-        self.pollout = select.poll()
-        self.pollout.register(connection, select.POLLOUT)
-        self.sendfail_msg = 1
-        self.sendfail_cnt = 0
+        # if set, unsent messages are replaced by newer messages for the same value
+        self.coalesce = False
+        self.pending = {}
+        self.coalesced = self.dropped = 0
+        self.msgs_out = self.bytes_out = self.sendfails = 0 # statistics
+        self.timestamps = False # updates carry the time the server received them
 
     def fileno(self):
         if self.socket:
@@ -38,6 +69,67 @@ try:
         if self.socket:
             self.socket.close()
             self.socket = False
+        self.dropped += len(self.pending)
+        self.pending = {}
+        self.out_buffer.clear() # never sent
+        self.out_size = 0
+
+    # encoded is the message already encoded, shared by every connection
+    def encode(self, data, encoded=None):
+        return encoded or data.encode()
+
+    def queue(self, data):
+        append_chunk(self.out_buffer, data)
+        self.out_size += len(data)
+
+    def queue_pending(self):
+        if self.pending: # send all queued values in one batch
+            data = b''.join(self.pending.values())
+            self.pending = {}
+            self.queue_bounded(data)
+
+    def write(self, data, udp=False, encoded=None):
+        if not self.socket:
+            return # closed
+        self.msgs_out += 1
+        if self.coalesce and udp: # only value updates streamed to watchers are replaced
+            name = data[:data.find('=')]
+            if name in self.pending:
+                self.pending[name] = self.encode(data, encoded)
+                self.coalesced += 1
+            elif len(self.pending) < max_pending:
+                self.pending[name] = self.encode(data, encoded)
+            else:
+                self.dropped += 1
+        else: # after the updates already pending so messages stay in order
+            self.queue_pending()
+            if self.socket:
+                self.queue_bounded(self.encode(data, encoded))
+
+    def queue_bounded(self, data):
+        self.queue(data)
+        if self.out_size > max_out_size:
+            print(_('overflow in pypilot socket'), self.address, self.out_size, os.getpid())
+            self.close()
+
+try:
+  from pypilot.linebuffer import linebuffer
+  class LineBufferedNonBlockingSocket(BufferedSocketOutput):
+    def __init__(self, connection, address):
+        super(LineBufferedNonBlockingSocket, self).__init__(connection, address)
+        self.b = linebuffer.LineBuffer(connection.fileno())
+
+        self.udp_port = False
+        self.udp_out_buffer = ''
+        self.udp_socket = False
+
+        self.pollout = select.poll()
+        self.pollout.register(connection, select.POLLOUT)
+        self.sendfail_msg = 1
+        self.sendfail_cnt = 0
+
+    def close(self):
+        super(LineBufferedNonBlockingSocket, self).close()
         if self.udp_socket:
             self.udp_socket.close()
             self.udp_socket = False
@@ -48,25 +140,26 @@ try:
     def readline(self):
         return self.b.line()
 
-    def write(self, data, udp=False):
-        if udp and self.udp_port:
-          self.udp_out_buffer += data
-          if len(self.udp_out_buffer) > 400:
-            print(_('overflow in pypilot udp socket'), self.address, len(self.udp_out_buffer))
-            self.udp_out_buffer = ''
+    def write(self, data, udp=False, encoded=None):
+        if udp and self.udp_port and self.socket:
+            self.msgs_out += 1
+            self.udp_out_buffer += data
+            if len(self.udp_out_buffer) > 400:
+                print(_('overflow in pypilot udp socket'), self.address, len(self.udp_out_buffer))
+                self.dropped += self.udp_out_buffer.count('\n')
+                self.udp_out_buffer = ''
         else:
-          self.out_buffer += data
-          if len(self.out_buffer) > 65536:
-            print(_('overflow in pypilot socket'), self.address, len(self.out_buffer), os.getpid())
-            self.out_buffer = ''
-            self.close()
+            super(LineBufferedNonBlockingSocket, self).write(data, udp, encoded)
     
     def flush(self):
+        if not self.socket:
+            return # closed
         if self.udp_out_buffer:
             try:
                 if not self.udp_socket:
                     self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 count = self.udp_socket.sendto(self.udp_out_buffer.encode(), (self.address[0], self.udp_port))
+                self.bytes_out += count
             except Exception as e:
                 print('udp socket failed to send', e)
                 count = 0
@@ -74,8 +167,9 @@ try:
             if count != len(self.udp_out_buffer):
                 print(_('failed to send udp packet'), self.address)
             self.udp_out_buffer = ''
-        
-        if not self.out_buffer:
+
+        self.queue_pending()
+        if not self.out_buffer: # or closed by overflow
             return
 
         try:
@@ -84,62 +178,51 @@ try:
                     print(_('pypilot socket failed to send to'), self.address, self.sendfail_cnt)
                     self.sendfail_msg *= 10
                 self.sendfail_cnt += 1
+                self.sendfails += 1
 
                 if self.sendfail_cnt > 100:
-                    self.socket.close()
-                    return
+                    self.close()
+                return # keep data until writable
   
             t0 = time.monotonic()
-            count = self.socket.send(self.out_buffer.encode())
+            count = self.socket.sendmsg(list(islice(self.out_buffer, iov_max)))
             #print('write', count, self.out_buffer, time.monotonic())
             t1 = time.monotonic()
 
             if t1-t0 > .1:
-                print(_('socket send took too long!?!?'), self.address, t1-t0, len(self.out_buffer))
-            if count < 0:
-                print(_('socket send error'), self.address, count)
-                self.socket.close()
-            self.out_buffer = self.out_buffer[count:]
+                print(_('socket send took too long!?!?'), self.address, t1-t0, self.out_size)
+            consume_chunks(self.out_buffer, count)
+            self.out_size -= count
+            self.bytes_out += count
+            self.sendfail_cnt = 0
         except Exception as e:
             print(_('pypilot socket exception'), self.address, e, os.getpid(), self.socket)
             self.close()
   
 except Exception as e:
   print(_('falling back to python nonblocking socket, will consume more cpu'), e)
-  class LineBufferedNonBlockingSocket(object):
+  class LineBufferedNonBlockingSocket(BufferedSocketOutput):
     def __init__(self, connection, address):
-        connection.setblocking(0)
-        self.socket = connection
-        self.address = address
+        super(LineBufferedNonBlockingSocket, self).__init__(connection, address)
         self.b = False # in python
         self.in_buffer = ''
         self.no_newline_pos = 0
-        self.out_buffer = ''
-
-    def close(self):
-        self.socket.close()
-        
-    def fileno(self):
-        return self.socket.fileno()
-
-    def write(self, data):
-        self.out_buffer += data
 
     def flush(self):
-        if not len(self.out_buffer):
+        if not self.socket:
+            return # closed
+        self.queue_pending()
+        if not self.out_buffer: # or closed by overflow
             return
         try:
-            count = self.socket.send(self.out_buffer.encode())
-            if count < 0:
-                print(_('socket send error in server flush'))
-                self.out_buffer = ''
-                self.socket.close()
-                return
-
-            self.out_buffer = self.out_buffer[count:]
+            count = self.socket.sendmsg(list(islice(self.out_buffer, iov_max)))
+            consume_chunks(self.out_buffer, count)
+            self.out_size -= count
+            self.bytes_out += count
+        except BlockingIOError:
+            self.sendfails += 1 # try again later
         except:
-            self.out_buffer = ''
-            self.socket.close()
+            self.close()
 
     def recvdata(self):
         size = 4096
@@ -9,7 +9,7 @@
 
 import sys, time, math, numpy, scipy.optimize
 import vector, resolv, quaternion
-import boatimu
+import boatimu, tracing
 resolv = resolv.resolv
 
 from values import *
@@ -765,7 +765,9 @@ def CalibrationProcess(cal_pipe, client):
             continue
 
         accel_points.RemoveOlder(10*60) # 10 minutes
+        t0 = time.monotonic()
         fit = FitAccel(debug('accel'), accel_points)
+        tracing.span('calibration.accel_fit', t0)
         if fit: # reset compass sigmapoints on accel cal
             dist = vector.dist(fit[0][:3], accel_calibration.value[0][:3])
             if dist > .01: # only update when bias changes more than this
@@ -778,7 +780,9 @@ def CalibrationProcess(cal_pipe, client):
                 debug('accel')('calibration distance too small ', dist)
 
         compass_points.RemoveOlder(20*60) # 20 minutes
+        t0 = time.monotonic()
         fit = FitCompass(debug('compass'), compass_points, compass_calibration.value[0], norm)
+        tracing.span('calibration.compass_fit', t0)
         if fit:
             # ignore decreasing compass coverage
             new_coverage = fit[1][2]
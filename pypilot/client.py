@@ -7,7 +7,7 @@
 # License as published by the Free Software Foundation; either
 # version 3 of the License, or (at your option) any later version.  
 
-import socket, select, sys, os, time
+import socket, select, sys, os, time, random
 
 import heapq
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -15,9 +15,18 @@ import pyjson
 import gettext_loader
 from bufferedsocket import LineBufferedNonBlockingSocket
 from values import Value
+from histogram import Histogram
 
 DEFAULT_PORT = 23322
 udp_control_port = 43822
+reconnect_min, reconnect_max = .25, 8 # seconds between connection attempts, doubled after each failure
+local_hosts = ['localhost', '127.0.0.1', '::1']
+
+# unix socket of a local server, other servers such as benchmarks add their port
+def unix_socket_name(port):
+    if str(port) == str(DEFAULT_PORT):
+        return 'pypilot.sock'
+    return 'pypilot%s.sock' % port
 
 try:
     IOError
@@ -52,10 +61,28 @@ class ClientWatch(Value):
                 if period is True:
                     period = 0
                 if not value.watch or value.watch.period > period:
-                    self.client.send(name + '=' + value.get_msg() + '\n') # initial send
+                    self.client.send(value.get_cached_msg()) # initial send
                 value.watch = Watch(value, period)
                 value.pwatch = True
 
+# latency from the server receiving a value to this client receiving it,
+# and the age each value reached before it was replaced.  Times are
+# compared using wall clocks, so they must be synchronized if the server
+# is on another host
+class ValueTrace(object):
+    def __init__(self):
+        self.latency = Histogram()
+        self.age = Histogram()
+        self.last_latency = None
+        self.time = None # wall time the server received the current value
+
+    def add(self, t, stamp):
+        self.last_latency = t - stamp
+        self.latency.add(self.last_latency)
+        if self.time is not None:
+            self.age.add(t - self.time)
+        self.time = stamp
+
 class ClientValues(Value):
     def __init__(self, client):
         self.value = False
@@ -80,7 +107,7 @@ class ClientValues(Value):
                 break # no more are ready
             t, i, watch = heapq.heappop(self.pqwatches) # pop first element
             if watch.value.watch == watch:
-                self.client.send(watch.value.name + '=' + watch.value.get_msg() + '\n')
+                self.client.send(watch.value.get_cached_msg())
                 watch.time += watch.period
                 if watch.time < t0:
                     watch.time = t0
@@ -106,7 +133,7 @@ class ClientValues(Value):
                 self.wvalues[name] = self.values[name].info
 
 class pypilotClient(object):
-    def __init__(self, host=False, use_udp=False):
+    def __init__(self, host=False, use_udp=False, use_timestamps=False):
         if sys.version_info[0] < 3:
             import failedimports
 
@@ -116,6 +143,19 @@ class pypilotClient(object):
         self.received = []
         self.last_values_list = False
         self.udp_socket = False
+        self.use_timestamps = use_timestamps # request server receive times for tracing
+        self.server_clock_offset = None # server wall clock minus its monotonic clock
+        self.traces = {}
+        self.session = None # token to resume watches after reconnecting
+        self.resuming = False
+        self.session_supported = True # older servers reply session is an unknown value
+        self.get_supported = True # older servers reply get is an unknown value
+        self.received_time = time.monotonic()
+        self.reconnect_delay = self.reconnect_time = 0
+        self.disconnect_time = time.monotonic()
+        self.connected_time = 0 # set by onconnected
+        self.connect_stats = {'attempts': 0, 'failed': 0, 'connects': 0, 'resumed': 0, 'disconnects': 0}
+        self.connect_times = Histogram() # from losing the connection until connected again
 
         if False:
             self.server = host
@@ -158,6 +198,7 @@ class pypilotClient(object):
             print('os not supported')
             configfilepath = '/.pypilot/'
         self.configfilename = configfilepath + 'pypilot_client.conf'
+        self.configfilepath = configfilepath
 
         try:
             file = open(self.configfilename)
@@ -172,7 +213,7 @@ class pypilotClient(object):
             if ':' in host:
                 i = host.index(':')
                 config['host'] = host[:i]
-                config['port'] = host[i+1:]
+                config['port'] = int(host[i+1:])
             else:
                 config['host'] = host
         
@@ -210,11 +251,55 @@ class pypilotClient(object):
         self.poller = select.poll()
         self.poller.register(self.connection.socket, select.POLLIN)
 
-        if self.watches:
-            self.connection.write('watch=' + pyjson.dumps(self.watches) + '\n')
-        self.wwatches = {}
+        if self.use_timestamps:
+            self.connection.write('timestamps=true\n')
+
+        if self.session: # the server may still have our watches
+            received = time.monotonic() - self.received_time
+            self.connection.write('session=' + pyjson.dumps({'token': self.session, 'received': received}) + '\n')
+            self.resuming = True # changed watches are sent after the server replies
+        else:
+            if self.session_supported:
+                self.connection.write('session=null\n')
+            if self.watches:
+                self.connection.write('watch=' + pyjson.dumps(self.watches) + '\n')
+            self.wwatches = {}
 
         self.values.onconnected()
+        self.connected_time = time.monotonic()
+        self.connect_stats['connects'] += 1
+        self.connect_times.add(self.connected_time - self.disconnect_time)
+        self.reconnect_delay = 0
+
+    # schedule the next connection attempt with jitter so clients do not retry together
+    def reconnect_backoff(self):
+        self.reconnect_delay = min(max(2*self.reconnect_delay, reconnect_min), reconnect_max)
+        self.reconnect_time = time.monotonic() + self.reconnect_delay*random.uniform(.5, 1)
+
+    def connection_stats(self):
+        stats = dict(self.connect_stats)
+        stats['connect_time'] = self.connect_times.summary()
+        return stats
+
+    def receive_session(self, session):
+        if self.resuming and not session['resumed']: # server no longer has our watches
+            if self.watches:
+                self.connection.write('watch=' + pyjson.dumps(self.watches) + '\n')
+            self.wwatches = {}
+        elif session['resumed']:
+            self.connect_stats['resumed'] += 1
+        self.session = session['token']
+        self.resuming = False
+
+    # watch again without a session, the server may also be older after reconnecting
+    def session_not_supported(self):
+        self.session_supported = False
+        self.session = None
+        if self.resuming:
+            if self.watches:
+                self.connection.write('watch=' + pyjson.dumps(self.watches) + '\n')
+            self.wwatches = {}
+            self.resuming = False
 
     def probe(self):
         if not self.can_probe:
@@ -269,18 +354,20 @@ class pypilotClient(object):
                         # hung hup
                         self.connection_in_progress.close()
                         self.connection_in_progress = False
+                        self.connect_stats['failed'] += 1
+                        self.reconnect_backoff()
                         self.probe()
                         return
 
                     self.onconnected()
                 return
             else:
-                if not self.connect(False):
+                if time.monotonic() < self.reconnect_time or not self.connect(False):
                     time.sleep(timeout)
                 return
             
         # inform server of any watches we have changed
-        if self.wwatches:
+        if self.wwatches and not self.resuming:
             self.connection.write('watch=' + pyjson.dumps(self.wwatches) + '\n')
             #print('client watch', self.wwatches, self.watches)
             self.wwatches = {}
@@ -288,6 +375,10 @@ class pypilotClient(object):
         # send any delayed watched values
         self.values.send_watches()
 
+        if isinstance(self.connection, LineBufferedNonBlockingSocket) and not self.connection.socket:
+            self.disconnect() # closed after failing to send
+            return
+
         if self.connection.fileno():
             # flush output
             self.connection.flush()
@@ -311,6 +402,7 @@ class pypilotClient(object):
             self.update_timeout()
             
             fd, flag = events.pop()
+            self.received_time = time.monotonic()
 
             if fd == self.connection.fileno():
                 if not (flag & select.POLLIN) or (self.connection and not self.connection.recvdata()):
@@ -352,9 +444,17 @@ class pypilotClient(object):
             try:
                 name, data = line.rstrip().split('=', 1)
                 if name == 'error':
+                    if data.startswith('invalid unknown value: session'):
+                        self.session_not_supported()
+                        continue
+                    if data.startswith('invalid unknown value: get'):
+                        self.get_supported = False
                     print('server error:', data)
                     continue
                 value = pyjson.loads(data)
+                if self.use_timestamps and '@' in name:
+                    name, stamp = name.split('@', 1)
+                    self.trace(name, float(stamp))
             except ValueError as e:
                 print('client value error:', line, e)
                 continue
@@ -363,16 +463,52 @@ class pypilotClient(object):
                 print(_('invalid message from server:'), line, e)
                 raise Exception()
 
-            if name in self.values.values: # did this client register this value
-                self.values.values[name].set(value)
-            else:
-                self.received.append((name, value)) # remote value
+            self.receive_value(name, value)
+
+    def receive_value(self, name, value):
+        if name == 'timestamps' and self.use_timestamps:
+            self.server_clock_offset = value
+            return
+        if name == 'session':
+            self.receive_session(value)
+            return
+        if name in self.values.values: # did this client register this value
+            self.values.values[name].set(value)
+        else:
+            self.received.append((name, value)) # remote value
+
+    def trace(self, name, stamp):
+        if self.server_clock_offset is None:
+            return
+        if not name in self.traces:
+            self.traces[name] = ValueTrace()
+        self.traces[name].add(time.time(), stamp + self.server_clock_offset)
+
+    # seconds since the server received the current value of name
+    def age(self, name):
+        trace = self.traces.get(name)
+        if not trace or trace.time is None:
+            return None
+        return time.time() - trace.time
+
+    # summary of latency and age histograms in milliseconds for each value
+    def latency(self, names=None):
+        ret = {}
+        for name, trace in self.traces.items():
+            if names is None or name in names:
+                ret[name] = {'latency': trace.latency.summary(), 'age': trace.age.summary()}
+        return ret
 
     # polls at least as long as timeout
     def disconnect(self):
         if self.connection:
             self.connection.close()
+            self.connect_stats['disconnects'] += 1
+            self.disconnect_time = time.monotonic()
+            if self.disconnect_time - self.connected_time < 1:
+                self.reconnect_backoff() # connection is not stable
         self.connection = False
+        self.resuming = False
 
     def probewait(self, timeout):
         t0 = time.monotonic()
@@ -382,10 +518,33 @@ class pypilotClient(object):
             time.sleep(.1)
         return False
 
+    # local server listens on a unix socket which avoids the tcp stack
+    def connect_unix(self):
+        if not self.config['host'] in local_hosts:
+            return False
+        path = self.configfilepath + unix_socket_name(self.config['port'])
+        if not os.path.exists(path):
+            return False
+        connection = False
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(path)
+        except Exception:
+            if connection:
+                connection.close()
+            return False # server without unix socket, use tcp
+        self.connection_in_progress = connection
+        self.onconnected()
+        return True
+
     def connect(self, verbose=True):
         if self.connection:
             print(_('warning, pypilot client aleady has connection'))
 
+        self.connect_stats['attempts'] += 1
+        if self.connect_unix():
+            return True
+
         try:
             host_port = self.config['host'], self.config['port']
             self.connection_in_progress = False
@@ -406,6 +565,8 @@ class pypilotClient(object):
             else:
                 print(_('connect failed to') + (' %s:%d' % host_port), e)
 
+            self.connect_stats['failed'] += 1
+            self.reconnect_backoff()
             self.probe()
             #time.sleep(.25)
                 
@@ -465,6 +626,47 @@ class pypilotClient(object):
         self.watches[name] = value
         self.wwatches[name] = value
 
+    # current values of names or prefixes such as 'servo.*' without watching them,
+    # returns False if the server did not answer
+    # returns None if the server does not support get
+    def get(self, names, timeout=10):
+        t0, sent = time.monotonic(), False
+        values = {}
+        while time.monotonic() - t0 < timeout:
+            if not self.get_supported:
+                return None
+            if not sent and self.connection:
+                self.send('get=' + pyjson.dumps(names) + '\n')
+                sent = True
+            self.poll(.1)
+            received = [] # messages for watches
+            for i in range(len(self.received)):
+                name, value = self.received[i]
+                if name == 'get' and value == names: # all values sent
+                    self.received = received + self.received[i+1:]
+                    return values
+                if name in names or any(n.endswith('*') and name.startswith(n[:-1]) for n in names):
+                    values[name] = value
+                    if not name in self.watches:
+                        continue
+                received.append((name, value))
+            self.received = received
+        return False
+
+    # retrieve values from a server without get by watching them until each is received
+    def get_watched(self, names, timeout=10):
+        if not names:
+            names = list(self.list_values(timeout) or [])
+        for name in names:
+            self.watch(name, timeout)
+        t0, values = time.monotonic(), {}
+        while len(values) < len(names) and time.monotonic() - t0 < timeout:
+            self.poll(.1)
+            values.update(self.receive())
+        for name in names:
+            self.watch(name, False)
+        return values
+
     def clear_watches(self):
         for name in self.watches:
             self.wwatches[name] = False
@@ -496,8 +698,8 @@ class pypilotClient(object):
     def info(self, name):
         return self.values.value[name]
 
-def pypilotClientFromArgs(values, period=True, host=False):
-    client = pypilotClient(host)
+def pypilotClientFromArgs(values, period=True, host=False, use_timestamps=False):
+    client = pypilotClient(host, use_timestamps=use_timestamps)
     if host:
         client.probed = True # dont probe
     if not client.connect(True):
@@ -558,17 +760,22 @@ def nice_str(value):
 # each value, printing them
 def main():
     import signal
+    clients = []
     def quit(sign, frame):
+        for client in clients: # latency summary
+            for name, trace in sorted(client.latency().items()):
+                print(name, 'latency', trace['latency'], 'age', trace['age'])
         exit(0)
     signal.signal(signal.SIGINT, quit)
 
     if '-h' in sys.argv:
-        print(_('usage'), sys.argv[0], '[-s host] -i -c -h [NAME[=VALUE]]...')
+        print(_('usage'), sys.argv[0], '[-s host] -i -c -l -h [NAME[=VALUE]]...')
         print('eg:', sys.argv[0], '-i imu.compass')
         print('   ', sys.argv[0], 'servo.max_slew_speed=10')
         print('-s', _('set the host or ip address'))
         print('-i', _('print info about each value type'))
         print('-c', _('continuous watch'))
+        print('-l', _('continuous watch showing the latency of each update and a summary at exit'))
         print('-h', _('show this message'))
         exit(0)
 
@@ -579,7 +786,8 @@ def main():
         host = args[i+1]
         args = args[:i+1] + args[i+2:]
 
-    continuous = '-c' in args
+    latency = '-l' in args
+    continuous = '-c' in args or latency
     info = '-i' in args
 
     watches = []
@@ -587,36 +795,20 @@ def main():
         if arg[0] != '-':
             watches.append(arg)
 
-    period = True if continuous else 10
-    client = pypilotClientFromArgs(watches, period, host)
-    if client.watches: # retrieve all values
-        watches = list(client.watches)
+    if not continuous: # one shot, no watches needed
+        client = pypilotClientFromArgs(watches, False, host)
+        names = [watch.split('=', 1)[0] for watch in watches]
+        values = client.get(names if names else ['*'], 10)
+        if values is None:
+            values = client.get_watched(names, 10)
+        if values is False:
+            print(_('timeout retrieving values'))
+            exit(1)
         if info:
             client.list_values(10)
-    else:
-        watches = list(client.list_values(10))
-        if not watches:
-            print(_('failed to retrieve value list!'))
-            exit(1)
-        for name in watches:
-            client.watch(name, period)
-
-    if not continuous:
-        values = {}
-        t0 = time.monotonic()
-        while len(values) < len(watches):
-            dt = time.monotonic() - t0
-            if dt > 10:
-                print(_('timeout retrieving'), len(watches) - len(values), 'values')
-                for name in watches:
-                    if not name in values:
-                        print(_('missing'), name)
-                break
-                    
-            client.poll(.1)
-            msgs = client.receive()
-            for name in msgs:
-                values[name] = msgs[name]
+        for name in names:
+            if not name.endswith('*') and not name in values:
+                print(_('missing'), name)
 
         names = sorted(values)
         for name in names:
@@ -629,12 +821,31 @@ def main():
                     result = result[:maxlen] + ' ...'
                 print(result)
     else:
+        client = pypilotClientFromArgs(watches, True, host, latency)
+        if latency:
+            clients.append(client)
+        if client.watches:
+            if info:
+                client.list_values(10)
+        else:
+            values = client.list_values(10)
+            if not values:
+                print(_('failed to retrieve value list!'))
+                exit(1)
+            # each name, not a prefix watch which older servers lack,
+            # and server stats are only computed when asked for
+            for name in values:
+                if not name.startswith('server.stats.'):
+                    client.watch(name, True)
+
         while True:
             client.poll(1)
             msg = client.receive_single()
             while msg:
                 name, data = msg
                 data = nice_str(data)
+                if latency and name in client.traces:
+                    data += '  (%.3fms)' % (client.traces[name].last_latency*1000)
                 if info:
                     print(name, client.info(name), '=', data)
                 else:
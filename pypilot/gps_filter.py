@@ -23,6 +23,7 @@ from client import pypilotClient
 from nonblockingpipe import NonBlockingPipe
 import vector
 import quaternion
+import tracing
 
 try:
     import wmm2020
@@ -77,9 +78,11 @@ class GPSFilterProcess(multiprocessing.Process):
                 pass
             time.sleep(20)
         print('gps filter process', os.getpid())
+        tracing.start('gps filter')
 
         f = GPSFilter(self.client)
         while True:
+            t0 = time.monotonic()
             while True:
                 inp = pipe.recv()
                 if not inp:
@@ -89,6 +92,7 @@ class GPSFilterProcess(multiprocessing.Process):
                     f.predict(*args)
                 elif cmd == 'update':
                     f.update(*args)
+            tracing.span('gps_filter.filter', t0)
 
             msgs = self.client.receive(.1)
             for msg in msgs:
@@ -12,7 +12,7 @@ import multiprocessing, time, socket, select
 from nonblockingpipe import NonBlockingPipe
 from bufferedsocket import LineBufferedNonBlockingSocket
 from values import *
-import serialprobe, pyjson
+import serialprobe, pyjson, tracing
 
 def gps_json_loads(line):
     try:
@@ -148,6 +148,7 @@ class gpsProcess(multiprocessing.Process):
             
     def gps_process(self, pipe):
         print('gps process', os.getpid())
+        tracing.start('gpsd')
         self.gpsd_socket = False
         self.poller = select.poll()
         self.baud_boot_device_hint = ''
@@ -166,6 +167,7 @@ class gpsProcess(multiprocessing.Process):
                 continue
 
             self.gpsconnecttime = False
+            t0 = time.monotonic()
             fd, flag = events.pop()
             if flag & select.POLLIN and self.gpsd_socket.recvdata():
                 while True:
@@ -180,6 +182,7 @@ class gpsProcess(multiprocessing.Process):
             else: # gpsd connection lost
                 self.disconnect()
                 pipe.send({'devices': self.devices})                    
+            tracing.span('gpsd.read', t0)
 
 class gpsd(object):
     def __init__(self, sensors):
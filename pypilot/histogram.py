@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# samples are counted in fixed buckets so adding one is cheap and memory
+# does not grow, percentiles are accurate to the bucket spacing of 19%
+
+import bisect, time
+
+default_bounds = [1e-5 * 2**(i/4) for i in range(80)] # 10us to 10s
+
+class Histogram(object):
+    def __init__(self, bounds=default_bounds):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0]*(len(self.bounds) + 1)
+        self.count = 0
+        self.max = 0
+
+    def add(self, x):
+        self.counts[bisect.bisect_left(self.bounds, x)] += 1
+        self.count += 1
+        if x > self.max:
+            self.max = x
+
+    # upper bound of the bucket holding the sample at fraction p
+    def percentile(self, p):
+        if not self.count:
+            return None
+        n, total = p*self.count, 0
+        for i in range(len(self.bounds)):
+            total += self.counts[i]
+            if total >= n:
+                return min(self.bounds[i], self.max)
+        return self.max
+
+    def summary(self, scale=1000): # milliseconds by default
+        if not self.count:
+            return {'count': 0}
+        summary = {'count': self.count}
+        for p in [50, 95, 99]:
+            summary['p%d' % p] = round(self.percentile(p/100)*scale, 3)
+        summary['max'] = round(self.max*scale, 3)
+        return summary
+
+# recent samples only, a window is kept in two halves so the counts
+# cover between period and twice period seconds
+class RollingHistogram(object):
+    def __init__(self, period=30, bounds=default_bounds):
+        self.period = period
+        self.current, self.previous = Histogram(bounds), Histogram(bounds)
+        self.merged = Histogram(bounds)
+        self.time = time.monotonic()
+
+    def add(self, x):
+        self.current.add(x)
+
+    def rotate(self, t):
+        if t - self.time > self.period:
+            self.current, self.previous = self.previous, self.current
+            self.current.reset()
+            self.time = t
+
+    def summary(self, scale=1000):
+        merged, current, previous = self.merged, self.current, self.previous
+        merged.counts = list(map(lambda a, b: a + b, current.counts, previous.counts))
+        merged.count = current.count + previous.count
+        merged.max = max(current.max, previous.max)
+        return merged.summary(scale)
+
+if __name__ == '__main__':
+    import random
+    h = Histogram()
+    samples = [random.expovariate(1000) for i in range(100000)]
+    t0 = time.monotonic()
+    for x in samples:
+        h.add(x)
+    dt = time.monotonic() - t0
+    samples.sort()
+    print('add %.2fus' % (dt*1e6/len(samples)))
+    print('histogram', h.summary())
+    print('exact     ', {'p50': round(samples[50000]*1000, 3), 'p95': round(samples[95000]*1000, 3),
+                         'p99': round(samples[99000]*1000, 3), 'max': round(samples[-1]*1000, 3)})
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# shared memory ring of imu samples written by the imu process
+# and read by the autopilot without any serialization
+
+# the memory is named shared memory, a forked imu process inherits it
+# and a process started with spawn or forkserver attaches to it by name
+# when the ring is unpickled.  There is a single writer, each slot has
+# a sequence number which is odd while the slot is being written so
+# the reader can detect a sample that was overwritten as it was read
+
+# each sample also signals an eventfd (a pipe without eventfd) so the
+# reader can block until a sample arrives instead of polling
+
+import struct, os, select, atexit
+from multiprocessing import shared_memory, reduction
+
+ring_header = struct.Struct('<QQ') # samples written, compass calibration updates
+# seq, timestamp, accel, gyro, compass, fusionQPose, accel.residuals, flags
+ring_slot = struct.Struct('<Qd3d3d3d4d3dQ')
+ring_seq = struct.Struct('<Q')
+event_one = struct.pack('=Q', 1) # eventfd counter increment
+
+FLAG_COMPASS_CALIBRATION_UPDATED = 1
+
+class IMURing(object):
+    def __init__(self, size=32):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=ring_header.size + size*ring_slot.size)
+        self.owner = True # removes the memory at exit
+        atexit.register(self.close)
+        self.init()
+
+        if hasattr(os, 'eventfd'):
+            self.event_r = self.event_w = os.eventfd(0, os.EFD_NONBLOCK)
+        else:
+            self.event_r, self.event_w = os.pipe()
+            os.set_blocking(self.event_r, False)
+            os.set_blocking(self.event_w, False)
+
+    def init(self):
+        self.mem = self.shm.buf
+        self.count = 0 # samples written (writer) or read (reader)
+        self.calibration_updates = 0
+        self.overruns = 0 # samples overwritten before the reader got them
+
+    # only used when the process is not forked, the new process gets the
+    # name of the memory and duplicates of the event descriptors
+    def __getstate__(self):
+        event_r = reduction.DupFd(self.event_r)
+        event_w = event_r if self.event_w == self.event_r else reduction.DupFd(self.event_w)
+        return {'size': self.size, 'name': self.shm.name, 'event_r': event_r, 'event_w': event_w}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.owner = False
+        self.init()
+        self.event_r = state['event_r'].detach()
+        self.event_w = self.event_r if state['event_w'] is state['event_r'] else state['event_w'].detach()
+
+    def close(self):
+        if not self.shm:
+            return
+        self.mem = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = False
+
+    def slot(self, index):
+        return ring_header.size + (index % self.size)*ring_slot.size
+
+    def write(self, data):
+        count = self.count
+        offset = self.slot(count)
+        flags = 0
+        if data.get('compass_calibration_updated'):
+            flags = FLAG_COMPASS_CALIBRATION_UPDATED
+            self.calibration_updates += 1
+        ring_seq.pack_into(self.mem, offset, 2*count+1) # slot being written
+        ring_slot.pack_into(self.mem, offset, 2*count+1, data['timestamp'],
+                            *data['accel'], *data['gyro'], *data['compass'],
+                            *data['fusionQPose'], *data['accel.residuals'], flags)
+        ring_seq.pack_into(self.mem, offset, 2*count+2)
+        self.count = count + 1
+        ring_header.pack_into(self.mem, 0, self.count, self.calibration_updates)
+        try:
+            os.write(self.event_w, event_one)
+        except BlockingIOError: # pipe full, reader is already signaled
+            pass
+
+    def unpack(self, index):
+        offset = self.slot(index)
+        values = ring_slot.unpack_from(self.mem, offset)
+        if values[0] != 2*index+2 or ring_seq.unpack_from(self.mem, offset)[0] != values[0]:
+            return False # overwritten while reading
+        data = {'timestamp': values[1],
+                'accel': values[2:5],
+                'gyro': values[5:8],
+                'compass': values[8:11],
+                'fusionQPose': values[11:15],
+                'accel.residuals': values[15:18]}
+        if values[18] & FLAG_COMPASS_CALIBRATION_UPDATED:
+            data['compass_calibration_updated'] = True
+        return data
+
+    def written(self):
+        return ring_header.unpack_from(self.mem, 0)[0]
+
+    def fileno(self):
+        return self.event_r
+
+    # block until a sample is written that was not read, or timeout
+    def wait(self, timeout):
+        if self.written() != self.count:
+            return True
+        if not select.select([self.event_r], [], [], timeout)[0]:
+            return False
+        try:
+            os.read(self.event_r, 4096) # clear the signal
+        except BlockingIOError:
+            pass
+        return True
+
+    # newest sample if any arrived since the last read, otherwise False
+    def read(self):
+        count, calibration_updates = ring_header.unpack_from(self.mem, 0)
+        if count == self.count:
+            return False
+        self.count = count
+        data = self.unpack(count-1)
+        if data and calibration_updates != self.calibration_updates:
+            # flag may have been on a skipped sample
+            self.calibration_updates = calibration_updates
+            data['compass_calibration_updated'] = True
+        return data
+
+    # all unread samples oldest first
+    def read_batch(self):
+        count = self.written()
+        start = self.count
+        if count - start > self.size - 1: # writer may be in the oldest slot
+            self.overruns += count - start - (self.size - 1)
+            start = count - (self.size - 1)
+        self.count = count
+        batch = []
+        for index in range(start, count):
+            data = self.unpack(index)
+            if data:
+                batch.append(data)
+            else:
+                self.overruns += 1
+        return batch
+
+if __name__ == '__main__':
+    # per sample cost of the ring compared with sending the dict over a pipe
+    import os, sys, time
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import gettext_loader
+    from nonblockingpipe import NonBlockingPipe
+
+    data = {'timestamp': 1234.5678,
+            'accel': (0.0123, -0.0456, 1.0012),
+            'gyro': (0.0012, -0.0034, 0.0056),
+            'compass': (12.345, -23.456, 34.567),
+            'fusionQPose': (0.9876543210, 0.0123456789, -0.0234567891, 0.1234567890),
+            'accel.residuals': [0.001, 0.002, 0.003],
+            'fusionPoseValid': True, 'fusionQPoseValid': True, 'gyroValid': True,
+            'accelValid': True, 'compassValid': True, 'pressureValid': False,
+            'fusionPose': (0.01, 0.02, 1.57), 'pressure': 0.0,
+            'temperatureValid': False, 'temperature': 0.0,
+            'humidityValid': False, 'humidity': 0.0}
+    count = 20000
+
+    # as the imu runs at 10-20hz each sample is read once
+    ring = IMURing()
+    reader = IMURing()
+    reader.mem = ring.mem
+    t0 = time.monotonic()
+    for i in range(count):
+        ring.write(data)
+        reader.read()
+    t1 = time.monotonic()
+
+    w, r = NonBlockingPipe('bench', True)
+    t2 = time.monotonic()
+    for i in range(count):
+        r.send(data)
+        w.recv()
+    t3 = time.monotonic()
+    print('ring %.2fus/sample' % ((t1-t0)*1e6/count))
+    print('pipe %.2fus/sample' % ((t3-t2)*1e6/count))
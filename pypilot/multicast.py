@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# multicast telemetry on the boat network
+#
+# the server publishes the values listed in its multicast value, eg:
+#    pypilot_client multicast='["imu.*", "ap.heading_error", "servo.*"]'
+# any number of displays can receive them without a connection to the server.
+# updates are text lines as on a tcp connection, packed into datagrams up to
+# the mtu, each datagram starts with a sequence number so losses are counted:
+#    seq=1234
+#    imu.heading=123.4
+#    ...
+
+import sys, os, socket, struct, time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import gettext_loader
+import pyjson
+
+multicast_group = '239.192.23.22' # organization local scope
+multicast_port = 23324
+multicast_ttl = 1 # do not leave the boat network
+multicast_mtu = 1472 # ethernet mtu less ip and udp headers
+max_seq_len = 16 # room for the sequence line
+
+class MulticastPublisher(object):
+    def __init__(self, group=multicast_group, port=multicast_port):
+        self.address = group, port
+        self.socket = False
+        self.seq = 0
+        self.lines = []
+        self.size = 0
+        self.timestamps = False # server connections may trace latency, datagrams do not
+        self.msgs_out = self.bytes_out = self.sendfails = self.datagrams = 0 # statistics
+
+    def open(self):
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+            self.socket.setblocking(0)
+        except Exception as e:
+            print(_('failed to open multicast socket'), e)
+            self.close()
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = False
+        self.lines = []
+        self.size = 0
+
+    # same interface as the server connections watching values
+    def write(self, data, udp=False, encoded=None):
+        if data.startswith('error='):
+            print(_('multicast'), data.rstrip())
+            return
+        if not self.socket:
+            return
+        data = encoded or data.encode()
+        if self.size + len(data) > multicast_mtu - max_seq_len:
+            self.flush()
+        self.lines.append(data)
+        self.size += len(data)
+        self.msgs_out += 1
+
+    def flush(self):
+        if not self.lines:
+            return
+        self.seq += 1
+        datagram = b'seq=%d\n' % self.seq + b''.join(self.lines)
+        self.lines = []
+        self.size = 0
+        try:
+            self.bytes_out += self.socket.sendto(datagram, self.address)
+            self.datagrams += 1
+        except OSError as e: # not connected to a network
+            self.sendfails += 1
+            if self.sendfails == 1:
+                print(_('failed to send multicast'), e)
+
+class MulticastReceiver(object):
+    def __init__(self, group=multicast_group, port=multicast_port):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'): # several displays on one host
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(('', port))
+        mreq = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        self.socket.setblocking(0)
+        self.seq = None
+        self.datagrams = self.lost = 0
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def close(self):
+        self.socket.close()
+
+    # list of (name, value) from all datagrams received
+    def receive(self):
+        received = []
+        while True:
+            try:
+                datagram = self.socket.recv(65536)
+            except BlockingIOError:
+                return received
+            lines = datagram.split(b'\n')
+            try:
+                name, seq = lines[0].split(b'=', 1)
+                seq = int(seq)
+            except ValueError:
+                print(_('invalid multicast datagram'), lines[0])
+                continue
+            self.datagrams += 1
+            if self.seq is not None and seq > self.seq:
+                self.lost += seq - self.seq - 1
+            self.seq = seq # a lower sequence is a restarted server
+
+            for line in lines[1:]:
+                if not line:
+                    continue
+                try:
+                    name, data = line.split(b'=', 1)
+                    received.append((name.decode(), pyjson.loads_bytes(data)))
+                except ValueError as e:
+                    print(_('invalid multicast message'), line, e)
+
+def main():
+    if '-h' in sys.argv:
+        print(_('usage'), sys.argv[0], '[-g group] [-p port] [NAME]...')
+        print('-g', _('multicast group'), '(%s)' % multicast_group)
+        print('-p', _('multicast port'), '(%d)' % multicast_port)
+        print('-h', _('show this message'))
+        exit(0)
+
+    args = list(sys.argv)[1:]
+    group, port = multicast_group, multicast_port
+    if '-g' in args:
+        i = args.index('-g')
+        group = args[i+1]
+        args = args[:i] + args[i+2:]
+    if '-p' in args:
+        i = args.index('-p')
+        port = int(args[i+1])
+        args = args[:i] + args[i+2:]
+
+    import select
+    receiver = MulticastReceiver(group, port)
+    t0 = time.monotonic()
+    while True:
+        select.select([receiver], [], [], 1)
+        for name, value in receiver.receive():
+            if not args or name in args:
+                print(name, '=', value)
+        t = time.monotonic()
+        if t - t0 > 10:
+            t0 = t
+            print(_('datagrams'), receiver.datagrams, _('lost'), receiver.lost)
+
+if __name__ == '__main__':
+    main()
@@ -31,7 +31,7 @@ from values import *
 from nonblockingpipe import NonBlockingPipe
 from bufferedsocket import LineBufferedNonBlockingSocket
 from sensors import source_priority
-import serialprobe
+import serialprobe, tracing
 
 import fcntl
 # these are not defined in python module
@@ -790,6 +790,7 @@ class nmeaBridge(object):
         
     def nmea_process(self):
         print('nmea process', os.getpid())
+        tracing.start('nmea')
         self.setup()
         while True:
             t0 = time.monotonic()
@@ -904,6 +905,7 @@ class nmeaBridge(object):
         self.connect_client()
                                 
         t6 = time.monotonic()
+        tracing.span('nmea.poll', t1, t6)
 
         if t6-t1 > .1:
             print(_('nmea process loop too slow:'), t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, t6-t5)
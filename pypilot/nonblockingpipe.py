@@ -8,6 +8,8 @@
 # version 3 of the License, or (at your option) any later version.  
 
 import select, time, os
+from collections import deque
+from itertools import islice
 import pyjson
 
 class NonBlockingPipeEnd(object):
@@ -48,7 +50,7 @@ class NonBlockingPipeEnd(object):
     def readline(self):
         return self.recv() # pipe has complete lines if used for text
 
-    def write(self, value, udp=False):
+    def write(self, value, udp=False, encoded=None):
         self.send(value)
     
     def send(self, value, block=False):
@@ -71,7 +73,7 @@ class NonBlockingPipeEnd(object):
         return False
 
 
-from bufferedsocket import LineBufferedNonBlockingSocket
+from bufferedsocket import LineBufferedNonBlockingSocket, append_chunk, consume_chunks, iov_max
 class SocketNonBlockingPipeEnd(LineBufferedNonBlockingSocket):
     def __init__(self, socket, name, recvfailok, sendfailok):
         self.name = name
@@ -117,6 +119,9 @@ class PipeNonBlockingPipeEnd(object):
         self.b = linebuffer.LineBuffer(r)
         self.pollout = select.poll()
         self.pollout.register(self.w, select.POLLOUT)
+        self.out_buffer = deque() # chunks not yet accepted by the pipe
+        self.out_size = 0
+        self.msgs_out = self.bytes_out = self.sendfails = 0 # statistics
         self.recvfailok = recvfailok
         self.sendfailok = sendfailok
         self.sendfail_time = 0
@@ -148,17 +153,46 @@ class PipeNonBlockingPipeEnd(object):
         return False
 
     def flush(self):
-        pass
+        if not self.out_buffer:
+            return
+        try:
+            count = os.writev(self.w, list(islice(self.out_buffer, iov_max)))
+        except BlockingIOError:
+            self.sendfails += 1
+            return
+        consume_chunks(self.out_buffer, count)
+        self.out_size -= count
+        self.bytes_out += count
+
+    def write(self, data, udp=False, encoded=None):
+        data = encoded or data.encode()
+        self.msgs_out += 1
+        if self.out_buffer:
+            self.flush()
+        if self.out_buffer: # keep ordering behind data already queued
+            if self.out_size + len(data) > 65536:
+                # drop whole lines until the pipe drains, the queued head may be partly sent
+                self.sendfails += 1
+                if not self.sendfailok:
+                    print(_('failed write'), self.name, self.out_size)
+                return
+            append_chunk(self.out_buffer, data)
+            self.out_size += len(data)
+            return
 
-    def write(self, data, udp=False):
-        if not self.pollout.poll(0):
-            if not self.sendfailok:
-                print(_('failed write'), self.name)
         t0 = time.time()
-        os.write(self.w, data.encode())
+        try:
+            count = os.write(self.w, data)
+        except BlockingIOError:
+            count = 0
+            self.sendfails += 1
+        self.bytes_out += count
         t1 = time.time()
         if t1-t0 > .04:
             print('too long write pipe', t1-t0, self.name, len(data))
+        if count < len(data): # pipe full, keep the remainder for flush
+            self.out_buffer.append(memoryview(data)[count:])
+            self.out_size = len(data) - count
 
     def send(self, value, block=False, maxdt=.025):
         if 0:
@@ -167,10 +201,16 @@ class PipeNonBlockingPipeEnd(object):
                     print('failed poll send', self.name)
         t0 = time.monotonic()
         try:
-            data = pyjson.dumps(value) + '\n'
-            data = data.encode()
+            data = pyjson.dumps_bytes(value) + b'\n'
             t1 = time.monotonic()
-            os.write(self.w, data)
+            if self.out_buffer: # partial line still pending
+                self.flush()
+                if self.out_buffer:
+                    raise BlockingIOError
+            count = os.write(self.w, data)
+            if count < len(data): # never leave a partial line behind
+                self.out_buffer.append(memoryview(data)[count:])
+                self.out_size = len(data) - count
             t2 = time.monotonic()
             if t2-t0 > maxdt:
                 print('too long send nonblocking pipe', t1-t0, t2-t1, self.name, len(data))
@@ -189,6 +229,7 @@ class NoMPLineBufferedPipeEnd(object):
     def __init__(self, name):
         self.name = name
         self.lines = []
+        self.msgs_out = self.bytes_out = self.sendfails = 0 # statistics
 
     def fileno(self):
         return 0
@@ -199,8 +240,11 @@ class NoMPLineBufferedPipeEnd(object):
     def close(self):
         pass
 
-    def write(self, data, udp=False):
-        self.send(data)
+    def write(self, data, udp=False, encoded=None):
+        self.msgs_out += 1
+        self.bytes_out += len(data)
+        if not self.send(data):
+            self.sendfails += 1
     
     def recv(self, timeout=0):
         return self.readline()
@@ -5,12 +5,105 @@
 # This Program is free software; you can redistribute it and/or
 # modify it under the terms of the GNU General Public
 # License as published by the Free Software Foundation; either
-# version 3 of the License, or (at your option) any later version.  
+# version 3 of the License, or (at your option) any later version.
 
-try:
+# use the fastest json library available
+# loads_bytes and dumps_bytes avoid converting to and from str for data
+# that is read from or written to pipes and sockets
+
+# nan and infinity are written as NaN and Infinity like python json and ujson
+# so values are the same whichever library each end of a connection uses
+def use_orjson():
+    import orjson, json, math
+    options = orjson.OPT_NON_STR_KEYS
+    def default(value): # float subclasses like numpy.float64 from the gps filter
+        if isinstance(value, float):
+            return float(value)
+        raise TypeError
+    def finite(value):
+        if isinstance(value, float):
+            return math.isfinite(value)
+        if isinstance(value, (list, tuple)):
+            return all(map(finite, value))
+        if isinstance(value, dict):
+            return all(map(finite, value.values()))
+        return True
+    def dumps_bytes(value):
+        data = orjson.dumps(value, default=default, option=options)
+        # orjson writes nan and inf as null, only look for them when it did
+        if b'null' in data and not finite(value):
+            return json.dumps(value, separators=(',', ':')).encode()
+        return data
+    def dumps(value):
+        return dumps_bytes(value).decode()
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except ValueError: # orjson does not read NaN or Infinity
+            return json.loads(data)
+    return loads, dumps, loads, dumps_bytes
+
+def use_ujson():
     import ujson
-    loads, dumps = ujson.loads, ujson.dumps
-except Exception as e:
-    print(_('WARNING: python ujson library failed, parsing will consume more cpu'), e)
+    def dumps_bytes(value):
+        return ujson.dumps(value).encode()
+    return ujson.loads, ujson.dumps, ujson.loads, dumps_bytes
+
+def use_json():
     import json
-    loads, dumps = json.loads, json.dumps
+    def loads_bytes(data):
+        return json.loads(data.decode()) # faster than detecting the encoding
+    def dumps_bytes(value):
+        return json.dumps(value).encode()
+    return json.loads, json.dumps, loads_bytes, dumps_bytes
+
+codecs = {'orjson': use_orjson, 'ujson': use_ujson, 'json': use_json}
+
+for codec in codecs:
+    try:
+        loads, dumps, loads_bytes, dumps_bytes = codecs[codec]()
+        break
+    except Exception as e:
+        if codec == 'ujson':
+            print(_('WARNING: python ujson library failed, parsing will consume more cpu'), e)
+
+if __name__ == '__main__':
+    # time each available codec on typical pypilot messages
+    import time
+    messages = {'imu': {'timestamp': 1234.5678, 'accel': [0.0123, -0.0456, 1.0012],
+                        'gyro': [0.0012, -0.0034, 0.0056], 'compass': [12.345, -23.456, 34.567],
+                        'fusionQPose': [0.9876543210, 0.0123456789, -0.0234567891, 0.1234567890],
+                        'fusionPose': [0.01, 0.02, 1.57], 'fusionPoseValid': True},
+                'heading': 123.4567,
+                'watch': {'ap.heading': 0.5, 'ap.heading_command': True, 'servo.current': 0.25},
+                'values': {'ap.heading': {'type': 'SensorValue', 'writable': False},
+                           'ap.mode': {'type': 'EnumProperty', 'writable': True, 'persistent': True,
+                                       'choices': ['compass', 'gps', 'nav', 'wind', 'true wind']},
+                           'servo.max_current': {'type': 'RangeSetting', 'min': 0, 'max': 60, 'units': 'amps'}}}
+    count = 20000
+    for c in codecs:
+        try:
+            cloads, cdumps, cloads_bytes, cdumps_bytes = codecs[c]()
+        except Exception as e:
+            print(c, 'unavailable', e)
+            continue
+        for name, value in messages.items():
+            s, b = cdumps(value), cdumps_bytes(value)
+            timings = []
+            for f, arg in ((cdumps, value), (cdumps_bytes, value), (cloads, s), (cloads_bytes, b)):
+                t0 = time.perf_counter()
+                for i in range(count):
+                    f(arg)
+                timings.append((time.perf_counter() - t0)*1e6/count)
+            # what callers did before the bytes api
+            t0 = time.perf_counter()
+            for i in range(count):
+                cdumps(value).encode()
+            encode = (time.perf_counter() - t0)*1e6/count
+            t0 = time.perf_counter()
+            for i in range(count):
+                cloads(b.decode())
+            decode = (time.perf_counter() - t0)*1e6/count
+            print('%-6s %-8s dumps %5.2fus dumps().encode() %5.2fus dumps_bytes %5.2fus  loads %5.2fus loads(decode()) %5.2fus loads_bytes %5.2fus' %
+                  (c, name, timings[0], encode, timings[1], timings[2], decode, timings[3]))
+    print('using', codec)
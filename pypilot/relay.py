@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# relay remote clients (web, hat, tablets, opencpn) through a separate process
+#
+# the relay runs its own server on another port and owns every upstream value
+# through a direct pipe.  The relay server does the per client watch and period
+# bookkeeping, and the watch period it requests from the owner of each value is
+# already the fastest of all downstream watches, so it is forwarded upstream as is.
+# The autopilot server then only sees a single client no matter how many viewers
+
+import sys, os, select
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pyjson
+import gettext_loader
+import server
+from server import pypilotServer, DEFAULT_PORT
+from client import pypilotClient
+
+relay_port = DEFAULT_PORT + 1
+
+class pypilotRelay(object):
+    def __init__(self, host=False, port=relay_port):
+        server.use_multiprocessing = False # the pipe is polled in this process
+        self.server = pypilotServer(port, persistent=False)
+        self.pipe = self.server.pipe() # values owned by the relay
+        self.owner = self.server.pipes[-1] # server end of the pipe
+        if not host:
+            host = 'localhost'
+        if not ':' in host: # not the port from pypilot_client.conf which may be this relay
+            host += ':%d' % DEFAULT_PORT
+        self.upstream = pypilotClient(host)
+        self.upstream.watch('values')
+        self.registered = {}
+        self.values_count = 0
+        self.reserved = False # names of values held by the relay server itself
+
+    def poll(self, timeout=0):
+        # wait for either upstream data or downstream clients
+        if self.server.initialized and timeout:
+            fds = []
+            if hasattr(self.server.poller, 'fileno'): # epoll
+                fds.append(self.server.poller.fileno())
+            else:
+                timeout = min(timeout, .01) # can not wait on downstream clients
+            if self.upstream.connection:
+                fds.append(self.upstream.connection.fileno())
+            sleep = self.server.values.sleep_time()
+            if sleep is not None:
+                timeout = min(timeout, max(sleep, 0))
+            select.select(fds, [], [], timeout)
+
+        self.server.poll(0)
+        if not self.reserved:
+            self.reserved = set(self.server.values.values)
+
+        # watches and sets from downstream clients
+        while True:
+            line = self.pipe.readline()
+            if not line:
+                break
+            name, data = line.split('=', 1)
+            if name == 'watch':
+                for name, period in pyjson.loads(data).items():
+                    if name != 'values': # the relay registers values itself
+                        self.upstream.watch(name, period)
+            elif name == 'error':
+                print('relay error:', data.rstrip())
+            else:
+                self.upstream.send(line)
+
+        self.upstream.poll(0)
+        values = self.upstream.get_values()
+        if len(values) != self.values_count:
+            self.values_count = len(values)
+            self.register(values)
+
+        # updates from upstream go directly to the relay server
+        handle = self.server.values.HandleRequest
+        for name, value in self.upstream.received:
+            if name in self.registered:
+                handle(name + '=' + pyjson.dumps(value) + '\n', self.owner)
+        self.upstream.received = []
+
+    def register(self, values):
+        new = {}
+        for name, info in values.items():
+            if name in self.registered or name in self.reserved:
+                continue # relay has its own server.stats
+            new[name] = info
+            self.registered[name] = info
+        if new:
+            self.server.values.HandleRequest('values=' + pyjson.dumps(new) + '\n', self.owner)
+
+def main():
+    if '-h' in sys.argv:
+        print(_('usage'), sys.argv[0], '[-s host] [-p port]')
+        print('-s', _('set the host or ip address of the pypilot server'))
+        print('-p', _('port to serve clients on'), '(%d)' % relay_port)
+        print('-h', _('show this message'))
+        exit(0)
+
+    args = list(sys.argv)[1:]
+    host, port = False, relay_port
+    if '-s' in args:
+        host = args[args.index('-s')+1]
+    if '-p' in args:
+        port = int(args[args.index('-p')+1])
+
+    relay = pypilotRelay(host, port)
+    while True:
+        relay.poll(.4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# record the inputs of the autopilot and replay them faster than realtime
+#
+#    pypilot -r sail.log.gz
+# records every iteration: imu samples, sensor data, values set by clients
+# (mode, heading command, gains...) and servo telemetry.  Then
+#    pypilot_replay sail.log.gz ap.pilot=simple
+# runs the autopilot on the same inputs with a virtual clock as fast as
+# possible so pilots can be compared on hours of real data in seconds
+#
+# the replay is open loop: the recorded boat does not respond to a different
+# servo command, so compare the commands of pilots rather than heading errors
+#
+# the log is binary records of kind, monotonic time and data:
+#   imu samples are packed doubles, other records are length prefixed json
+
+import sys, os, time, struct, gzip
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import gettext_loader
+import pyjson
+
+log_magic = b'pypilot log 1\n'
+record_header = struct.Struct('<cd') # kind, time
+record_length = struct.Struct('<I')
+# timestamp, accel, gyro, compass, fusionQPose, accel.residuals, compass calibration updated
+imu_sample = struct.Struct('<d3d3d3d4d3d?')
+
+TICK = b'T' # start of an iteration
+VALUE = b'V' # value received from the server
+SENSOR = b'S' # sensor data from nmea, signalk or gpsd
+SERVO_SENSOR = b'R' # sensor data from the servo (rudder)
+TELEMETRY = b'X' # servo values changed by polling the servo
+IMU = b'I'
+
+# servo values the pilots or sensors may depend on
+telemetry_names = ['voltage', 'current', 'controller_temp', 'motor_temp', 'engaged', 'flags',
+                   'position', 'state', 'controller', 'duty', 'speed', 'raw_command', 'watts',
+                   'faults', 'amp_hours']
+telemetry_names = list(map(lambda name : 'servo.' + name, telemetry_names))
+
+# values written for each iteration of a replay with -o
+output_names = ['ap.enabled', 'ap.mode', 'ap.pilot', 'ap.heading', 'ap.heading_command',
+                'ap.heading_error', 'servo.command']
+
+# messages between the client and server rather than values of the autopilot,
+# watch names values the server wants, which differ between recording and replay
+internal_names = ['values', 'watch', 'error']
+
+def open_log(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+class Recorder(object):
+    def __init__(self, ap, filename):
+        self.ap = ap
+        self.values = ap.client.values.values
+        self.file = open_log(filename, 'wb')
+        self.file.write(log_magic)
+        self.flushtime = time.monotonic()
+        self.servo_polling = False
+        self.telemetry = {}
+        print(_('recording to'), filename)
+
+        # starting state: settings, calibrations and commands
+        for name, value in self.values.items():
+            if name in internal_names:
+                continue
+            if 'writable' in value.info or 'persistent' in value.info:
+                self.write_json(VALUE, [name, value.value])
+
+        # attach to the autopilot where it takes its inputs
+        self.iteration, ap.iteration = ap.iteration, self.record_iteration
+        self.receive_value, ap.client.receive_value = ap.client.receive_value, self.record_value
+        self.sensors_write, ap.sensors.write = ap.sensors.write, self.record_sensor
+        self.IMUread, ap.boatimu.IMUread = ap.boatimu.IMUread, self.record_imu
+        self.servo_poll, ap.servo.poll = ap.servo.poll, self.record_servo
+
+        import atexit
+        atexit.register(self.close)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = False
+
+    def write(self, kind, data=b''):
+        if self.file:
+            self.file.write(record_header.pack(kind, time.monotonic()) + data)
+
+    def write_json(self, kind, data):
+        data = pyjson.dumps_bytes(data)
+        self.write(kind, record_length.pack(len(data)) + data)
+
+    def record_iteration(self):
+        t = time.monotonic()
+        self.write(TICK)
+        if t - self.flushtime > 1: # lose at most a second if killed
+            self.flushtime = t
+            self.file.flush()
+        self.iteration()
+
+    def record_value(self, name, value):
+        if name in self.values and not name in internal_names:
+            self.write_json(VALUE, [name, value])
+        self.receive_value(name, value)
+
+    def record_sensor(self, sensor, data, source):
+        self.write_json(SERVO_SENSOR if self.servo_polling else SENSOR, [sensor, data, source])
+        return self.sensors_write(sensor, data, source)
+
+    def record_imu(self):
+        data = self.IMUread()
+        if data:
+            self.write(IMU, imu_sample.pack(data['timestamp'], *data['accel'], *data['gyro'],
+                                            *data['compass'], *data['fusionQPose'],
+                                            *data['accel.residuals'],
+                                            bool(data.get('compass_calibration_updated'))))
+        return data
+
+    def record_servo(self):
+        self.servo_polling = True
+        self.servo_poll()
+        self.servo_polling = False
+        changed = {}
+        for name in telemetry_names:
+            value = self.values[name].value
+            if self.telemetry.get(name) != value:
+                changed[name] = value
+        if changed:
+            self.telemetry.update(changed)
+            self.write_json(TELEMETRY, changed)
+
+def read_log(filename):
+    f = open_log(filename, 'rb')
+    if f.read(len(log_magic)) != log_magic:
+        print(_('not a pypilot log'), filename)
+        return
+    while True:
+        header = f.read(record_header.size)
+        if len(header) < record_header.size:
+            break
+        kind, t = record_header.unpack(header)
+        if kind == TICK:
+            yield kind, t, None
+            continue
+        if kind == IMU:
+            size = imu_sample.size
+        else:
+            length = f.read(record_length.size)
+            if len(length) < record_length.size:
+                break
+            size = record_length.unpack(length)[0]
+        data = f.read(size)
+        if len(data) < size:
+            break # truncated when the recording was killed
+
+        if kind == IMU:
+            v = imu_sample.unpack(data)
+            data = {'timestamp': v[0], 'accel': list(v[1:4]), 'gyro': list(v[4:7]),
+                    'compass': list(v[7:10]), 'fusionQPose': list(v[10:14]),
+                    'accel.residuals': list(v[14:17])}
+            if v[17]:
+                data['compass_calibration_updated'] = True
+        else:
+            data = pyjson.loads_bytes(data)
+        yield kind, t, data
+    f.close()
+
+# stand ins for the processes of the autopilot
+class ReplayIMU(object):
+    multiprocessing = False
+    process = False
+    def __init__(self, player):
+        self.player = player
+
+    def poll(self):
+        pass
+
+    def read(self):
+        return self.player.apply(IMU)
+
+class ReplayCalibration(object): # calibrations are in the values recorded
+    process = False
+    def calibration_ready(self):
+        return False
+
+    def get_warnings(self):
+        return ''
+
+class ReplayGPSFilter(object):
+    process = False
+    def predict(self, accel, fusionQPose, t):
+        pass
+
+    def update(self, data, t):
+        pass
+
+class ReplaySensors(object):
+    process = False
+    def __init__(self, player):
+        self.player = player
+
+    def poll(self):
+        self.player.apply(SENSOR)
+
+class Player(object):
+    def __init__(self, filename, overrides={}):
+        self.records = read_log(filename)
+        self.overrides = overrides
+        self.pending = {}
+        self.unknown = [] # recorded names this autopilot does not have
+        # the starting state is recorded before the first iteration, apply it with the first
+        self.load()
+        self.clock = min([records[0][0] for records in self.pending.values()] + [self.nexttick])
+        self.saved_clock = []
+
+        self.imu = ReplayIMU(self)
+        self.auto_cal = ReplayCalibration()
+        self.gps_filter = ReplayGPSFilter()
+        self.sensors = ReplaySensors(self)
+
+        from autopilot import Autopilot
+        with self:
+            ap = self.ap = Autopilot(self)
+        self.values = ap.client.values.values
+        self.receive_value = ap.client.receive_value
+        self.sensors_write = ap.sensors.write
+        ap.server.poll = lambda : None
+        ap.client.receive = self.receive
+        ap.servo.poll = self.servo_poll
+
+        with self:
+            for name, value in overrides.items():
+                self.receive_value(name, value)
+
+    # the autopilot reads the virtual clock through the time module, which
+    # is only replaced while it runs and is restored for the rest of the process
+    def __enter__(self):
+        self.saved_clock.append((time.monotonic, time.sleep))
+        time.monotonic, time.sleep = self.monotonic, self.sleep
+        return self
+
+    def __exit__(self, *exc):
+        time.monotonic, time.sleep = self.saved_clock.pop()
+
+    def monotonic(self):
+        return self.clock
+
+    def sleep(self, dt):
+        if dt > 0:
+            self.clock += dt
+
+    # apply the next record of this kind recorded in the iteration
+    def apply(self, kind):
+        records = self.pending.get(kind)
+        if not records:
+            return False
+        t, data = records.pop(0)
+        self.clock = max(self.clock, t)
+        if kind == VALUE:
+            name, value = data
+            if name in internal_names or name in self.overrides:
+                pass
+            elif name in self.values:
+                self.receive_value(name, value)
+            elif not name in self.unknown:
+                print(_('ignoring unknown value'), name)
+                self.unknown.append(name)
+        elif kind == SENSOR or kind == SERVO_SENSOR:
+            self.sensors_write(*data)
+        elif kind == TELEMETRY:
+            for name in data:
+                self.values[name].set(data[name])
+        return data
+
+    def receive(self, timeout=0):
+        while self.apply(VALUE):
+            pass
+        return {}
+
+    def servo_poll(self):
+        while self.apply(SERVO_SENSOR):
+            pass
+        while self.apply(TELEMETRY):
+            pass
+
+    # records until the next iteration
+    def load(self):
+        self.nexttick = False
+        for kind, t, data in self.records:
+            if kind == TICK:
+                self.nexttick = t
+                break
+            if not kind in self.pending:
+                self.pending[kind] = []
+            self.pending[kind].append((t, data))
+
+    def step(self):
+        if self.nexttick is False:
+            return False
+        self.clock = max(self.clock, self.nexttick)
+        self.load()
+        with self:
+            self.ap.iteration()
+        self.pending = {} # not used by this iteration
+        return True
+
+def main():
+    if '-h' in sys.argv or len(sys.argv) < 2:
+        print(_('usage'), sys.argv[0], '[-o output] LOG [NAME=VALUE]...')
+        print(_('run the autopilot as fast as possible on inputs recorded with'), 'pypilot -r LOG')
+        print(_('values given override the values recorded, eg:'), 'ap.pilot=simple')
+        print('-o', _('write the pilot output of each iteration as json lines'))
+        print('-h', _('show this message'))
+        exit(0)
+
+    args = list(sys.argv)[1:]
+    output = False
+    if '-o' in args:
+        i = args.index('-o')
+        output = open(args[i+1], 'w')
+        args = args[:i] + args[i+2:]
+
+    filename = args[0]
+    overrides = {}
+    for arg in args[1:]:
+        name, value = arg.split('=', 1)
+        try:
+            overrides[name] = pyjson.loads(value)
+        except Exception as e:
+            overrides[name] = value # unquoted string
+
+    # settings written by the autopilot during the replay do not touch the real ones
+    import tempfile, shutil
+    home = tempfile.mkdtemp(prefix='pypilot_replay')
+    os.makedirs(home + '/.pypilot')
+    os.environ['HOME'] = home
+
+    t0 = time.perf_counter()
+    iterations = engaged = 0
+    error2 = command = travel = 0
+    lastcommand = 0
+    try:
+        player = Player(filename, overrides)
+        values = player.values
+        start = player.clock
+        while player.step():
+            iterations += 1
+            if output:
+                line = {'time': round(player.clock - start, 3)}
+                for name in output_names:
+                    line[name] = values[name].value
+                output.write(pyjson.dumps(line) + '\n')
+            if values['ap.enabled'].value:
+                engaged += 1
+                error2 += values['ap.heading_error'].value**2
+                c = values['servo.command'].value
+                command += abs(c)
+                travel += abs(c - lastcommand)
+                lastcommand = c
+    finally:
+        shutil.rmtree(home)
+    wall = time.perf_counter() - t0
+    duration = player.clock - start
+
+    print(_('replayed'), iterations, _('iterations'), '%.1f' % duration, _('seconds in'),
+          '%.2f' % wall, _('seconds'), '(%.0fx)' % (duration / wall))
+    if engaged:
+        print(_('engaged'), engaged, _('iterations'), _('heading error rms'), '%.3f' % (error2/engaged)**.5,
+              _('servo command mean'), '%.4f' % (command/engaged), _('travel'), '%.3f' % travel)
+
+if __name__ == '__main__':
+    main()
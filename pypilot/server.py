@@ -8,14 +8,17 @@
 # version 3 of the License, or (at your option) any later version.  
 
 import select, socket, time
-import sys, os, heapq
+import sys, os, heapq, threading
 
 import numbers
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import gettext_loader
 import pyjson
 from bufferedsocket import LineBufferedNonBlockingSocket
-from nonblockingpipe import NonBlockingPipe
+from nonblockingpipe import NonBlockingPipe, NoMPLineBufferedPipeEnd
+from client import unix_socket_name
+from multicast import MulticastPublisher
+import tracing
 
 DEFAULT_PORT = 23322
 from zeroconf_service import zeroconf
@@ -24,6 +27,9 @@ configfilepath = os.getenv('HOME') + '/.pypilot/'
 configfilename = 'pypilot.conf'
 server_persistent_period = 60 # store data every 60 seconds
 use_multiprocessing = True # run server in a separate process
+stats_period = 1 # seconds between updates of server.stats values
+session_grace_period = 60 # seconds the watches of a disconnected client are kept to resume
+writable_timeout = 10 # seconds a socket that is not reading is kept
 
 class Watch(object):
     def __init__(self, value, connection, period):
@@ -37,31 +43,63 @@ class pypilotValue(object):
         self.server_values = values
         self.name = name
         self.info = info
-        self.lasttime = time.monotonic()
+        self.lasttime = time.monotonic() # when the server received msg
         self.connection = connection
         self.watching = False # is False, or the period, so 0 rather than True
 
         self.awatches = [] # all watches
         self.pwatches = [] # periodic watches limited in period
         self.msg = msg
+        self.encoded_msg = self.encoded = None
+        self.stamped_msg = self.stamped = None
+        self.updates = 0 # count of updates from owner for statistics
+        self.gets = [] # get requests waiting for the owner to send the value
+        self.batched = None # sent to watchers by a batch before the owner replied
 
     def get_msg(self):
         return self.msg
-        
+
+    # encode each distinct message once no matter how many connections watch it
+    def get_encoded(self, msg):
+        if msg is not self.encoded_msg:
+            self.encoded_msg = msg
+            self.encoded = msg.encode()
+        return self.encoded
+
+    # connections tracing latency get the time the server received the value
+    # after the name, eg: imu.heading@5421.123456=123.4
+    def get_stamped(self, msg):
+        if msg is not self.stamped_msg:
+            self.stamped_msg = msg
+            i = len(self.name)
+            self.stamped = (msg[:i] + '@%.6f' % self.lasttime + msg[i:]).encode()
+        return self.stamped
+
     def set(self, msg, connection):
         t0 = time.monotonic()
         if self.connection == connection:
+            if self.batched:
+                batched, self.batched = self.batched, None
+                if msg == batched: # owner accepted the value, watchers already have it
+                    self.msg = msg
+                    return
+
             # received new value from owner, inform watchers
             self.msg = msg
+            self.lasttime = t0
+            self.updates += 1
+            if self.gets:
+                self.answer_gets(msg)
 
             if self.awatches:
                 watch = self.awatches[0]
                 if watch.period == 0:
+                    encoded = self.get_encoded(msg)
                     for connection in watch.connections:
                         if not connection:
                             print('connection FALSE', self.name)
                             continue
-                        connection.write(msg, True)
+                        connection.write(msg, True, self.get_stamped(msg) if connection.timestamps else encoded)
 
                 for watch in self.pwatches:
                     if t0 >= watch.time:
@@ -82,6 +120,26 @@ class pypilotValue(object):
             else: # inform key can not be set arbitrarily
                 connection.write('error='+self.name+' is not writable\n')
 
+    # the owner only sends the value once if nobody is watching it
+    def get(self, request):
+        if not self.gets and self.watching is False:
+            self.connection.cwatches[self.name] = True
+        self.gets.append(request)
+
+    def answer_gets(self, msg):
+        encoded = self.get_encoded(msg)
+        for request in self.gets:
+            request.answer(msg, encoded)
+        self.gets = []
+        if self.watching is False:
+            self.connection.cwatches[self.name] = False
+            self.msg = None # server no longer tracking value
+
+    def cancel_gets(self, connection):
+        self.gets = [request for request in self.gets if request.connection != connection]
+        if not self.gets and self.watching is False and self.connection:
+            self.connection.cwatches[self.name] = False
+
     def remove_watches(self, connection):
         for watch in self.awatches:
             if connection in watch.connections:
@@ -94,7 +152,7 @@ class pypilotValue(object):
     def calculate_watch_period(self):
         # find minimum watch period from all watches
         watching = False
-        if 'persistent' in self.info and self.info['persistent']:
+        if 'persistent' in self.info and self.info['persistent'] and self.server_values.persistent:
             watching = server_persistent_period
         for watch in self.awatches:
             if len(watch.connections) == 0:
@@ -111,6 +169,12 @@ class pypilotValue(object):
                 if watching is False:
                     self.msg = None # server no longer tracking value
 
+    def watched_by(self, connection):
+        for watch in self.awatches:
+            if connection in watch.connections:
+                return True
+        return False
+
     def unwatch(self, connection, recalc):
         for watch in self.awatches:
             if connection in watch.connections:
@@ -122,7 +186,7 @@ class pypilotValue(object):
                 return True
         return False
             
-    def watch(self, connection, period):
+    def watch(self, connection, period, initial=True):
         if connection == self.connection:
             connection.write('error=can not add watch for own value: ' + self.name + '\n')
             return
@@ -138,8 +202,9 @@ class pypilotValue(object):
 
         # unwatch by removing
         watching = self.unwatch(connection, False) # or for server values (self.connection is False)
-        if not watching and self.msg and (period >= self.watching or self.connection is False):
-            connection.write(self.get_msg()) # initial retrieval
+        if initial and not watching and self.msg and (period >= self.watching or self.connection is False):
+            msg = self.get_msg()
+            connection.write(msg, False, self.get_stamped(msg) if connection.timestamps else self.get_encoded(msg)) # initial retrieval
 
         for watch in self.awatches:
             if watch.period == period: # already watching at this rate, add connection
@@ -168,11 +233,66 @@ class ServerWatch(pypilotValue):
         watches = pyjson.loads(data)
         values = self.server_values.values
         for name in watches:
+            if name.endswith('*'): # watch all values starting with prefix
+                self.server_values.watch_prefix(name[:-1], connection, watches[name])
+                continue
+            added = self.server_values.prefix_added.get(connection)
+            if added: # watched by name from now on
+                for names in added.values():
+                    names.discard(name)
             if not name in values:
                 # watching value not yet registered, add it so we can watch it
                 values[name] = pypilotValue(self.server_values, name)
             values[name].watch(connection, watches[name])
 
+class GetRequest(object):
+    def __init__(self, connection, names):
+        self.connection = connection
+        self.names = names
+        self.waiting = 0 # values the owner has not sent yet
+
+    def answer(self, msg, encoded):
+        self.connection.write(msg, False, encoded)
+        self.skip()
+
+    def skip(self): # also when the owner disconnects without sending the value
+        self.waiting -= 1
+        if not self.waiting:
+            self.done()
+
+    def done(self): # repeat the request so the client knows all values were sent
+        self.connection.write('get=' + pyjson.dumps(self.names) + '\n')
+
+# special server value to retrieve values or prefixes once without watching them
+class ServerGet(pypilotValue):
+    def __init__(self, values):
+        super(ServerGet, self).__init__(values, 'get')
+
+    def set(self, msg, connection):
+        name, data = msg.rstrip().split('=', 1)
+        names = pyjson.loads(data)
+        values = self.server_values.values
+        matches = {}
+        for name in names:
+            if name.endswith('*'):
+                prefix = name[:-1]
+                for vname, value in values.items():
+                    if vname.startswith(prefix) and value.info:
+                        matches[vname] = value
+            elif name in values and values[name].info:
+                matches[name] = values[name]
+
+        request = GetRequest(connection, names)
+        for value in matches.values():
+            msg = value.get_msg()
+            if msg:
+                connection.write(msg, False, value.get_encoded(msg))
+            elif value.connection and value.connection != connection:
+                request.waiting += 1
+                value.get(request)
+        if not request.waiting:
+            request.done()
+
 # special server value a client can set to specify udp data port to use
 class ServerUDP(pypilotValue):
     def __init__(self, values, server):
@@ -205,6 +325,179 @@ class ServerUDP(pypilotValue):
                 c.udp_socket.close()
                 c.udp_port = False
 
+# special server value a client can set to true to receive the time
+# the server received each update, replies with the offset from
+# the server's monotonic clock to its wall clock
+class ServerTimestamps(pypilotValue):
+    def __init__(self, values):
+        super(ServerTimestamps, self).__init__(values, 'timestamps')
+        self.connections = []
+        self.offset = time.time() - time.monotonic()
+        self.check_time = 0
+
+    def get_msg(self):
+        return 'timestamps=%.6f\n' % self.offset
+
+    def set(self, msg, connection):
+        name, data = msg.rstrip().split('=', 1)
+        try:
+            enabled = pyjson.loads(data)
+            if enabled is not True and enabled is not False:
+                raise Exception('must be true or false')
+            if not isinstance(connection, LineBufferedNonBlockingSocket):
+                raise Exception('only supported for sockets')
+        except Exception as e:
+            connection.write('error=invalid timestamps: ' + data + ' ' + str(e) + '\n')
+            return
+
+        connection.timestamps = enabled
+        if connection in self.connections:
+            self.connections.remove(connection)
+        if enabled:
+            self.connections.append(connection)
+            connection.write(self.get_msg())
+
+    # the wall clock may be set later, eg: from gps
+    def check_offset(self, t0):
+        if not self.connections or t0 < self.check_time:
+            return
+        self.check_time = t0 + 1
+        offset = time.time() - time.monotonic()
+        if abs(offset - self.offset) > .001:
+            self.offset = offset
+            for connection in self.connections:
+                connection.write(self.get_msg())
+
+# names and prefixes of values the server publishes by multicast, eg: ["imu.*", "servo.*"]
+class ServerMulticast(pypilotValue):
+    def __init__(self, values):
+        super(ServerMulticast, self).__init__(values, 'multicast', info = {'type': 'Value', 'persistent': True, 'writable': True})
+        self.names = []
+        self.publisher = MulticastPublisher()
+        self.msg = 'multicast=[]\n'
+
+    def set(self, msg, connection):
+        n, data = msg.rstrip().split('=', 1)
+        try:
+            names = pyjson.loads(data)
+            if type(names) != type([]) or not all(type(name) == type('') for name in names):
+                raise Exception('must be a list of names')
+        except Exception as e:
+            if connection:
+                connection.write('error=invalid multicast: ' + data + ' ' + str(e) + '\n')
+            return
+
+        if names and not self.publisher.socket:
+            self.publisher.open()
+        # the publisher watches the values like a connection
+        watches = {}
+        for name in self.names:
+            if not name in names:
+                watches[name] = False
+        for name in names:
+            if not name in self.names:
+                watches[name] = 0
+        if watches:
+            self.server_values.values['watch'].set('watch=' + pyjson.dumps(watches) + '\n', self.publisher)
+        self.names = names
+        if not names:
+            self.publisher.close()
+        super(ServerMulticast, self).set('multicast=' + pyjson.dumps(names) + '\n', False) # inform any clients watching this value
+
+# holds the watches of a disconnected client in place of its connection
+# so the server keeps tracking the values it was watching
+class Session(object):
+    def __init__(self):
+        self.time = time.monotonic() # disconnected
+        self.timestamps = False
+
+    def write(self, data, udp=False, encoded=None):
+        pass # not connected
+
+# special server value a client sets to null for a new session, or to resume
+#    session={"token": "...", "received": seconds since it last received data}
+# The watches of a disconnected client are kept for a while so when it
+# reconnects it does not need to send them, and only receives the values
+# that changed since it last received data
+class ServerSessions(pypilotValue):
+    def __init__(self, values, server):
+        super(ServerSessions, self).__init__(values, 'session')
+        self.server = server
+        self.sessions = {} # token -> Session
+        self.expire_time = 0
+        self.resumed = self.expired = 0 # statistics
+
+    def set(self, msg, connection):
+        name, data = msg.rstrip().split('=', 1)
+        try:
+            request = pyjson.loads(data)
+            token, received = None, 0
+            if request is not None:
+                token, received = str(request['token']), float(request['received'])
+            if not isinstance(connection, LineBufferedNonBlockingSocket):
+                raise Exception('only supported for sockets')
+        except Exception as e:
+            connection.write('error=invalid session: ' + data + ' ' + str(e) + '\n')
+            return
+
+        if token:
+            # the old connection may not have timed out yet
+            for socket in self.server.sockets:
+                if socket.session == token and socket != connection:
+                    self.server.RemoveSocket(socket)
+                    break
+        session = self.sessions.pop(token, None) if token else None
+        if session:
+            connection.session = token
+            self.resumed += 1
+        else:
+            connection.session = os.urandom(8).hex()
+        connection.write('session=' + pyjson.dumps({'token': connection.session, 'resumed': bool(session)}) + '\n')
+        if session: # allow a second for data that was in flight
+            self.restore(session, connection, time.monotonic() - received - 1)
+
+    def retain(self, connection):
+        session = Session()
+        self.replace(connection, session)
+        self.sessions[connection.session] = session
+        if len(self.sessions) > max_connections: # forget the oldest
+            self.remove(min(self.sessions, key=lambda token: self.sessions[token].time))
+
+    def replace(self, connection, replacement):
+        for value in self.server_values.values.values():
+            for watch in value.awatches:
+                if connection in watch.connections:
+                    watch.connections[watch.connections.index(connection)] = replacement
+                    break
+        for connections in self.server_values.prefix_watches.values():
+            if connection in connections:
+                connections[replacement] = connections.pop(connection)
+        added = self.server_values.prefix_added
+        if connection in added:
+            added[replacement] = added.pop(connection)
+
+    def restore(self, session, connection, since):
+        self.replace(session, connection)
+        for value in self.server_values.values.values():
+            for watch in value.awatches:
+                if connection in watch.connections:
+                    msg = value.get_msg()
+                    if msg and value.lasttime >= since: # changed after the client last received data
+                        connection.write(msg, False, value.get_stamped(msg) if connection.timestamps else value.get_encoded(msg))
+                    break
+
+    def remove(self, token):
+        self.server_values.remove(self.sessions.pop(token))
+        self.expired += 1
+
+    def expire(self, t0):
+        if not self.sessions or t0 < self.expire_time:
+            return
+        self.expire_time = t0 + 1
+        for token in list(self.sessions):
+            if t0 - self.sessions[token].time > session_grace_period:
+                self.remove(token)
+
 class ServerProfiles(pypilotValue):
     def __init__(self, values):
         super(ServerProfiles, self).__init__(values, 'profiles', info = {'type': 'Value', 'persistent': True, 'writable': True})
@@ -275,7 +568,8 @@ class ServerProfile(pypilotValue):
 
         self.server_values.values['profiles'].add(strprofile)
 
-        persistent_values = self.server_values.persistent_values
+        t0 = time.monotonic()
+        profiled_values = self.server_values.profiled_values
         persistent_data = self.server_values.persistent_data
 
         if not self.profile in persistent_data:
@@ -284,14 +578,12 @@ class ServerProfile(pypilotValue):
         if not strprofile in persistent_data:
             persistent_data[strprofile] = {}
         data = persistent_data[strprofile]
-        for name, value in persistent_values.items():
-            if not value.info.get('profiled'):
-                continue
+        updates = []
+        for name, value in profiled_values.items():
             #print("set profile", name, value, value.msg, prev[name])
             if value.msg:  # the msg may still be invalidated from a previous set
                 if not name in prev or prev[name] != value.msg:
                     prev[name] = value.msg
-                self.server_values.need_store = True # ensure we store c
 
             if not name in data:
                 vmsg = value.get_msg()  # add this value to profile copying it from previous profile
@@ -300,25 +592,260 @@ class ServerProfile(pypilotValue):
                 else:
                     print("PROFILED DATA WITHOUT MSG?  is not tracked?", name)
             elif data[name] != value.msg:
-                value.set(data[name], False)  # only inform clients of the updated value from profile change if it really did change
+                updates.append((value, data[name]))  # only inform clients of values that really did change
+
+        connections = self.server_values.set_batch(updates)
+        self.server_values.profile_switch = {'profile': strprofile, 'values': len(profiled_values),
+                                             'changed': len(updates), 'connections': connections,
+                                             'time': round((time.monotonic() - t0)*1000, 3)}
         self.msg = 'new' # invalidate
         self.profile = strprofile
         super(ServerProfile, self).set(msg, False) # inform any clients watching this value
 
+def config_file_data(persistent_data):
+    lines = list(persistent_data[None].values())
+    for profile, data in persistent_data.items():
+        if profile is None:
+            continue
+        lines.append('[profile="' + profile + '"]\n')
+        for name, value in data.items():
+            if value:
+                lines.append(value)
+    return ''.join(lines)
+
+# replace the file atomically so it is never left partially written
+def write_config_file(filename, persistent_data):
+    tmpfilename = filename + '.tmp'
+    file = open(tmpfilename, 'w')
+    file.write(config_file_data(persistent_data))
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.rename(tmpfilename, filename)
+    fd = os.open(os.path.dirname(filename) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd) # make the rename durable
+    finally:
+        os.close(fd)
+
+# read pypilot.conf or its journal into persistent_data, load is called
+# with each value in the order of the file
+def read_config_lines(filename, lines, persistent_data, journal=False, load=None):
+    profile = None
+    linei=0
+    for line in lines:
+        linei+=1
+        if journal and line[-1] != '\n':
+            print('ignoring incomplete journal line', linei)
+            break
+        try:
+            name, data = line.rstrip().split('=', 1)
+        except Exception as e:
+            print('failed to split ' + filename + ' line ', linei)
+            continue
+        if name[0] == '[' and data[-1] == ']': # new section
+            if name[1:] != 'profile':
+                print('loading pypilot.conf, unrecognized section', name)
+                continue
+
+            if data == 'null]': # journal returns to values without a profile
+                profile = None
+                continue
+
+            if data[0] != '"' or data[-2] != '"':
+                print('loading pypilot.conf, unrecognized profile', data)
+                continue
+            
+            profile = data[1:-2].replace('"', '')
+            if not profile in persistent_data:
+                persistent_data[profile] = {}
+            continue
+
+        if not data: # removed by the journal
+            if name in persistent_data[profile]:
+                del persistent_data[profile][name]
+            continue
+
+        persistent_data[profile][name] = line
+        if load:
+            load(profile, name, line)
+
+# changes are appended to a journal which is replayed after loading pypilot.conf,
+# once it grows past this size it is compacted by rewriting pypilot.conf
+journal_max_size = 65536
+
+def journal_record(changes):
+    lines = []
+    for profile, data in changes.items():
+        if profile is None:
+            lines.append('[profile=null]\n')
+        else:
+            lines.append('[profile="' + profile + '"]\n')
+        for name, line in data.items():
+            lines.append(name + '=\n' if line is None else line)
+    return ''.join(lines)
+
+# writes pypilot.conf from a thread so the server loop never waits on the disk
+class PersistentWriter(object):
+    def __init__(self, filename, persistent_data):
+        self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.journal_size = 0
+        if os.path.exists(self.journal_filename) or not os.path.exists(filename):
+            # compact at first store, so the journal is never appended after a torn record
+            self.journal_size = journal_max_size
+        self.data = {}
+        for profile, data in persistent_data.items():
+            self.data[profile] = dict(data)
+        self.changes = {}
+        self.reload_requested = False
+        self.reloaded = False # text of pypilot.conf edited by hand, for the server to apply
+        self.busy = False
+        self.written = False # inode and modification time of the last file written
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # changes is {profile: {name: line or None to remove}} and is not modified after
+    def store(self, changes):
+        with self.condition:
+            for profile, data in changes.items():
+                if not profile in self.changes:
+                    self.changes[profile] = {}
+                self.changes[profile].update(data)
+            self.condition.notify_all()
+
+    def flush(self):
+        with self.condition:
+            while self.changes or self.reload_requested or self.busy:
+                self.condition.wait()
+
+    # pypilot.conf was edited by hand, read it from the thread
+    def reload(self):
+        with self.condition:
+            self.reload_requested = True
+            self.condition.notify_all()
+
+    def take_reloaded(self):
+        with self.condition:
+            text, self.reloaded = self.reloaded, False
+            return text
+
+    # the edited file replaces the data and the journal of older changes
+    def reload_file(self):
+        try:
+            f = open(self.filename)
+            text = f.read()
+            f.close()
+        except Exception as e:
+            print(_('failed to load'), self.filename, e)
+            return
+        data = {None : {}, 'default' : {}}
+        read_config_lines(self.filename, text.splitlines(True), data)
+        self.data = data
+        try:
+            if os.path.exists(self.journal_filename):
+                os.unlink(self.journal_filename)
+            self.journal_size = 0
+        except Exception as e:
+            print(_('failed to remove'), self.journal_filename, e)
+            self.journal_size = journal_max_size # rewrite pypilot.conf at next store
+        with self.condition:
+            self.reloaded = text
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.changes and not self.reload_requested:
+                    self.condition.wait()
+                changes, self.changes = self.changes, {}
+                reload, self.reload_requested = self.reload_requested, False
+                self.busy = True
+
+            if reload: # changes stored meanwhile are journaled on top of the edited file
+                self.reload_file()
+                if not changes:
+                    with self.condition:
+                        self.busy = False
+                        self.condition.notify_all()
+                    continue
+
+            for profile, data in changes.items():
+                if not profile in self.data:
+                    self.data[profile] = {}
+                pdata = self.data[profile]
+                for name, line in data.items():
+                    if line is None:
+                        if name in pdata:
+                            del pdata[name]
+                    else:
+                        pdata[name] = line
+
+            t0 = time.monotonic()
+            record = journal_record(changes).encode()
+            if self.journal_size + len(record) <= journal_max_size:
+                try:
+                    fd = os.open(self.journal_filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    try:
+                        os.write(fd, record)
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    self.journal_size += len(record)
+                except Exception as e:
+                    print(_('failed to write'), self.journal_filename, e)
+                    self.journal_size = journal_max_size # rewrite pypilot.conf instead
+            else:
+                print('store_file', self.filename, '%.3f'%t0)
+                try:
+                    write_config_file(self.filename, self.data)
+                    stat = os.stat(self.filename)
+                    self.written = stat.st_ino, stat.st_mtime_ns
+                    if os.path.exists(self.journal_filename):
+                        os.unlink(self.journal_filename) # replaying it again is harmless
+                    self.journal_size = 0
+                except Exception as e:
+                    print(_('failed to write'), self.filename, e)
+            dt = time.monotonic() - t0
+            if dt > .1:
+                print(_('persistent store took too long!'), dt)
+
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+def write_lines(connection, msgs):
+    if len(msgs) == 1 or isinstance(connection, NoMPLineBufferedPipeEnd):
+        # in process pipes only hold single lines
+        for msg in msgs:
+            connection.write(msg)
+    else:
+        connection.write(''.join(msgs))
+
 class ServerValues(pypilotValue):
     def __init__(self, server):
         super(ServerValues, self).__init__(self, 'values')
-        profile = ServerProfile(self)
-        profiles = ServerProfiles(self)
-        
-        self.persistent_values = {'profile': profile, 'profiles': profiles}
-        self.values = {'values': self, 'watch': ServerWatch(self), 'udp_port': ServerUDP(self, server)}
-        self.values.update(self.persistent_values)
+        self.values = {'values': self, 'watch': ServerWatch(self), 'get': ServerGet(self),
+                       'udp_port': ServerUDP(self, server),
+                       'timestamps': ServerTimestamps(self), 'session': ServerSessions(self, server)}
         self.pipevalues = {}
+        self.prefix_watches = {} # prefix -> {connection: period}
+        self.prefix_added = {} # connection -> {prefix: names of the values it watches}
         self.msg = 'new'
-        self.persistent_timeout = time.monotonic() + server_persistent_period
-        self.need_store = False
-        self.load()
+        self.persistent = server.persistent
+        self.persistent_values = {}
+        self.profiled_values = {} # registered values stored separately for each profile
+        self.profile_switch = False # statistics of the last profile change
+        if self.persistent:
+            self.persistent_values = {'profile': ServerProfile(self), 'profiles': ServerProfiles(self),
+                                      'multicast': ServerMulticast(self)}
+            self.values.update(self.persistent_values)
+            self.persistent_timeout = time.monotonic() + server_persistent_period
+            self.load()
+        else: # relay, values are stored by the upstream server
+            self.persistent_timeout = float('inf')
+            self.persistent_data = {None : {}, 'default' : {}}
+            self.inotify = self.writer = None
         self.pqwatches = [] # priority queue of watches
         self.last_send_watches = 0
 
@@ -335,6 +862,7 @@ class ServerValues(pypilotValue):
                 msg += '"' + name + '":' + pyjson.dumps(info)
                 notsingle = True
             self.msg = msg + '}\n'
+            self.lasttime = time.monotonic()
             #print('values len', len(self.msg))
         return self.msg
 
@@ -354,8 +882,9 @@ class ServerValues(pypilotValue):
                 continue # forget this watch
             msg = watch.value.get_msg()
             if msg:
+                encoded = watch.value.get_encoded(msg)
                 for connection in watch.connections:
-                    connection.write(msg, True)
+                    connection.write(msg, True, watch.value.get_stamped(msg) if connection.timestamps else encoded)
 
             watch.time += watch.period
             if watch.time < t0:
@@ -365,13 +894,104 @@ class ServerValues(pypilotValue):
     def insert_watch(self, watch):
         heapq.heappush(self.pqwatches, (watch.time, time.monotonic(), watch))
 
+    # set values not coming from their owners, eg: switching profile
+    # each owner and each watching connection gets all of its updates in one write
+    def set_batch(self, updates):
+        batches, t0 = {}, time.monotonic()
+        for value, msg in updates:
+            if value.connection: # owner is informed, and watchers are not sent its reply
+                batches.setdefault(value.connection, []).append(msg)
+                value.batched = msg
+            value.msg = msg
+            value.lasttime = t0
+            value.updates += 1
+            if value.gets:
+                value.answer_gets(msg)
+            for watch in value.awatches:
+                for connection in watch.connections:
+                    batches.setdefault(connection, []).append(msg)
+
+        for connection, msgs in batches.items():
+            write_lines(connection, msgs)
+        return len(batches)
+
     def remove(self, connection):
+        if getattr(connection, 'session', False):
+            self.values['session'].retain(connection)
+
         for name in self.values:
             value = self.values[name]
             if value.connection == connection:
                 value.connection = False
+                for request in value.gets:
+                    request.skip()
+                value.gets = []
                 continue
             value.remove_watches(connection)
+            if value.gets:
+                value.cancel_gets(connection)
+
+        timestamps = self.values['timestamps']
+        if connection in timestamps.connections:
+            timestamps.connections.remove(connection)
+
+        for prefix in list(self.prefix_watches):
+            connections = self.prefix_watches[prefix]
+            if connection in connections:
+                del connections[connection]
+                if not connections:
+                    del self.prefix_watches[prefix]
+        if connection in self.prefix_added:
+            del self.prefix_added[connection]
+
+    def watch_prefix(self, prefix, connection, period, initial=True):
+        connections = self.prefix_watches.setdefault(prefix, {})
+        added = self.prefix_added.setdefault(connection, {})
+        if period is False:
+            if connection in connections:
+                del connections[connection]
+            if not connections:
+                del self.prefix_watches[prefix]
+            # only the watches this prefix added, not those made by name
+            for name in added.pop(prefix, []):
+                other = self.connection_prefix(name, connection)
+                if other is not None: # still covered by another prefix
+                    added.setdefault(other, set()).add(name)
+                elif name in self.values:
+                    self.values[name].unwatch(connection, True)
+            if not added:
+                del self.prefix_added[connection]
+            return
+
+        connections[connection] = period
+        names = added.setdefault(prefix, set())
+        # only registered values, not placeholders or special server values
+        for name, value in list(self.values.items()):
+            if not name.startswith(prefix) or not value.info or value.connection == connection:
+                continue
+            if name in names or not value.watched_by(connection):
+                names.add(name)
+                value.watch(connection, period, initial)
+
+    # a remaining prefix watch of the connection covering name
+    def connection_prefix(self, name, connection):
+        for prefix, connections in self.prefix_watches.items():
+            if connection in connections and name.startswith(prefix):
+                return prefix
+        return None
+
+    # a newly registered value gets the watches of each matching prefix
+    def watch_prefixes(self, value):
+        name = value.name
+        for i in range(len(name)+1):
+            prefix = name[:i]
+            connections = self.prefix_watches.get(prefix)
+            if not connections:
+                continue
+            for connection, period in connections.items():
+                if connection != value.connection and not value.watched_by(connection):
+                    value.watch(connection, period)
+                    self.prefix_added.setdefault(connection, {}).setdefault(prefix, set()).add(name)
             
     def set(self, msg, connection):
         if isinstance(connection, LineBufferedNonBlockingSocket):
@@ -404,9 +1024,13 @@ class ServerValues(pypilotValue):
                     self.persistent_values[name] = value
 
             if info.get('profiled'):
+                self.profiled_values[name] = value
                 if name in self.persistent_data[None]:
                     del self.persistent_data[None][name]
 
+            if self.prefix_watches:
+                self.watch_prefixes(value)
+
             self.msg = 'new'
 
         msg = False # inform watching clients of updated values
@@ -429,55 +1053,35 @@ class ServerValues(pypilotValue):
         self.values[name].set(msg, connection)
 
     def load_file(self, filename):
-        profile = None
         self.persistent_data = {None : {}, 'default' : {}}
+        self.load_lines(filename)
+        if os.path.exists(filename + '.journal'): # changes stored since the file was written
+            self.load_lines(filename + '.journal', True)
+
+    def load_lines(self, filename, journal=False):
         print("load file",filename)
         f = open(filename)
-        linei=0
-        while True:
-            linei+=1
-            line = f.readline()
-            if not line:
-                break
-            try:
-                name, data = line.rstrip().split('=', 1)
-            except Exception as e:
-                print('failed to split ' + filename + ' line ', linei)
-                continue
-            if name[0] == '[' and data[-1] == ']': # new section
-                if name[1:] != 'profile':
-                    print('loading pypilot.conf, unrecognized section', name)
-                    continue
-
-                if data[0] != '"' or data[-2] != '"':
-                    print('loading pypilot.conf, unrecognized profile', data)
-                    continue
-                
-                profile = data[1:-2].replace('"', '')
-                if not profile in self.persistent_data:
-                    self.persistent_data[profile] = {}
-                continue
-
-            self.persistent_data[profile][name] = line
-            if name in self.values:
-                # loading file while running
-                value = self.values[name]
-                if name != value.name:
-                    print("ERROR with values!", name, value.name)
-                if value.msg != line:
-                    if profile is None or self.values['profile'].profile == profile:
-                        self.values[name].set(line, False)
-            else:   
-                self.values[name] = pypilotValue(self, name, msg=line)
-                self.persistent_values[name] = self.values[name]
-
+        read_config_lines(filename, f, self.persistent_data, journal, self.load_line)
         f.close()
+
+    def load_line(self, profile, name, line):
+        if name in self.values:
+            # loading file while running
+            value = self.values[name]
+            if name != value.name:
+                print("ERROR with values!", name, value.name)
+            if value.msg != line:
+                if profile is None or self.values['profile'].profile == profile:
+                    self.values[name].set(line, False)
+        else:   
+            self.values[name] = pypilotValue(self, name, msg=line)
+            self.persistent_values[name] = self.values[name]
         
     def load(self):
         try:
             import inotify.adapters
             self.inotify = inotify.adapters.Inotify(block_duration_s=0)
-            self.inotify.add_watch(configfilepath + configfilename)
+            self.inotify.add_watch(configfilepath) # file is replaced by rename
             self.inotify_time = time.monotonic()
         except Exception as e:
             self.inotify = None
@@ -500,56 +1104,54 @@ class ServerValues(pypilotValue):
 
             try:
                 self.load_file(configfilepath + configfilename + '.bak')
-                return
             except Exception as e:
                 print(_('backup data failed as well'), e)
-            return
+        else:
+            # backup persistent_data if it loaded with success
+            try:
+                write_config_file(configfilepath + configfilename + '.bak', self.persistent_data)
+            except Exception as e:
+                print(_('failed to write'), configfilename + '.bak', e)
 
-        # backup persistent_data if it loaded with success
-        self.store_file(configfilepath + configfilename + '.bak')
+        self.stored_data = {} # persistent data handed to the writer
+        for profile, data in self.persistent_data.items():
+            self.stored_data[profile] = dict(data)
+        self.writer = PersistentWriter(configfilepath + configfilename, self.persistent_data)
 
     def poll_config(self, t0):
-        if not self.inotify or t0 - self.inotify_time < 5:
+        if not self.inotify:
+            return
+
+        text = self.writer.take_reloaded()
+        if text is not False: # read by the writer thread after an edit
+            self.persistent_data = {None : {}, 'default' : {}}
+            read_config_lines(configfilename, text.splitlines(True), self.persistent_data, False, self.load_line)
+            self.stored_data = {}
+            for profile, data in self.persistent_data.items():
+                self.stored_data[profile] = dict(data)
+
+        if t0 - self.inotify_time < 5:
             return
-        
         self.inotify_time = t0
         loaded = False
         for event in self.inotify.event_gen(timeout_s=0):
             try:
-                if event[1][0] == 'IN_CLOSE_WRITE':
+                if event[3] != configfilename:
+                    continue
+                if 'IN_CLOSE_WRITE' in event[1] or 'IN_MOVED_TO' in event[1]:
+                    stat = os.stat(configfilepath + configfilename)
+                    if (stat.st_ino, stat.st_mtime_ns) == self.writer.written:
+                        continue # written by this server
                     if not loaded:
                         print('detected configuration file updated: reloading', configfilename)
-                        self.load_file(configfilepath + configfilename)
+                        # the journal holds changes older than the edit, replaying it would revert them
+                        self.writer.reload()
                         loaded = True
             except Exception as e:
                 print('pypilot server failed to detect or load config change', e)
                 #print('pypilot server will now overwrite config file')
                 #self.store_file(configfilepath + configfilename)
 
-    def store_file(self, filename):
-        if self.inotify:
-            try:
-                self.inotify.remove_watch(configfilepath + configfilename)
-            except Exception as e:
-                print("failed to remove watch", e)
-                
-        print('store_file', filename, '%.3f'%time.monotonic(), self.need_store)
-        file = open(filename, 'w')
-        for name, value in self.persistent_data[None].items():
-            file.write(value)
-        for profile, data in self.persistent_data.items():
-            if profile is None:
-                continue
-            profile.replace('"', '')
-            file.write('[profile="' + profile + '"]\n')
-            for name, value in data.items():
-                if value:
-                    file.write(value)
-        file.close()
-
-        if self.inotify:
-            self.inotify.add_watch(configfilepath + configfilename)
-
     def store(self):
         self.persistent_timeout = time.monotonic() + server_persistent_period
         for name in self.persistent_values:
@@ -568,17 +1170,117 @@ class ServerValues(pypilotValue):
             if msg and (not name in data or msg != data[name]):
                 #print("need store, changed", name, data[name].rstrip(), msg.rstrip())
                 data[name] = msg
-                self.need_store = name
 
-        if self.need_store:
-            try:
-                self.store_file(configfilepath + configfilename)
-                self.need_store = False
-            except Exception as e:
-                print(_('failed to write'), configfilename, e)
+        # only hand the entries that changed since the last store to the writer
+        changes = {}
+        for profile, data in self.persistent_data.items():
+            if not profile in self.stored_data:
+                self.stored_data[profile] = {}
+            stored = self.stored_data[profile]
+            pchanges = {}
+            for name, line in data.items():
+                if stored.get(name) != line:
+                    pchanges[name] = stored[name] = line
+            for name in list(stored):
+                if not name in data:
+                    pchanges[name] = None
+                    del stored[name]
+            if pchanges:
+                changes[profile] = pchanges
+
+        if changes:
+            self.writer.store(changes)
+
+# read only values describing the load on the server,
+# only computed while a client is watching them
+class ServerStats(object):
+    def __init__(self, server):
+        self.server = server
+        self.connections = self.register('connections')
+        self.values = self.register('values')
+        self.poll = self.register('poll')
+        self.profile = self.register('profile')
+        self.phases = {'store': 0, 'accept': 0, 'read': 0, 'watches': 0, 'flush': 0}
+        self.polls = 0
+        self.value_updates = {}
+        self.time = time.monotonic()
+
+    def register(self, name):
+        value = pypilotValue(self.server.values, 'server.stats.' + name, info={'type': 'Value'})
+        self.server.values.values[value.name] = value
+        self.server.values.msg = 'new'
+        return value
+
+    def publish(self, value, data):
+        value.set(value.name + '=' + pyjson.dumps(data) + '\n', False)
+
+    def update(self, t0):
+        dt = t0 - self.time
+        if dt < stats_period:
+            return
+        self.time = t0
+
+        if self.connections.awatches:
+            connections = {}
+            for connection in self.server.sockets:
+                address = connection.address
+                if address[1] == 'unix':
+                    name = 'unix:%d' % connection.fileno()
+                else:
+                    name = '%s:%d' % address
+                connections[name] = {'msgs_in': connection.msgs_in, 'bytes_in': connection.bytes_in,
+                                     'msgs_out': connection.msgs_out, 'bytes_out': connection.bytes_out,
+                                     'queued_bytes': connection.out_size, 'pending': len(connection.pending),
+                                     'sendfails': connection.sendfails,
+                                     'coalesced': connection.coalesced, 'dropped': connection.dropped}
+            for pipe in self.server.pipes:
+                connections[pipe.name] = {'msgs_in': pipe.msgs_in, 'bytes_in': pipe.bytes_in,
+                                          'msgs_out': pipe.msgs_out, 'bytes_out': pipe.bytes_out,
+                                          'queued_bytes': getattr(pipe, 'out_size', 0),
+                                          'sendfails': pipe.sendfails}
+            sessions = self.server.values.values['session']
+            connections['sessions'] = {'retained': len(sessions.sessions), 'resumed': sessions.resumed,
+                                       'expired': sessions.expired}
+            if self.server.persistent:
+                publisher = self.server.values.values['multicast'].publisher
+                if publisher.socket:
+                    connections['multicast'] = {'msgs_out': publisher.msgs_out, 'bytes_out': publisher.bytes_out,
+                                                'datagrams': publisher.datagrams, 'sendfails': publisher.sendfails}
+            self.publish(self.connections, connections)
+
+        if self.values.awatches:
+            values = {}
+            for name, value in self.server.values.values.items():
+                updates = value.updates - self.value_updates.get(name, 0)
+                self.value_updates[name] = value.updates
+                watchers = 0
+                for watch in value.awatches:
+                    watchers += len(watch.connections)
+                if updates or watchers:
+                    values[name] = {'rate': round(updates / dt, 2), 'watchers': watchers}
+            self.publish(self.values, values)
+
+        if self.poll.awatches:
+            poll = {'rate': round(self.polls / dt, 2)}
+            for phase, t in self.phases.items():
+                poll[phase] = round(t * 1000 / dt, 3) # milliseconds per second
+            self.publish(self.poll, poll)
+
+        if self.server.values.profile_switch: # rare, so published even if not watched
+            self.publish(self.profile, self.server.values.profile_switch)
+            self.server.values.profile_switch = False
+
+        self.polls = 0
+        for phase in self.phases:
+            self.phases[phase] = 0
 
 class pypilotServer(object):
-    def __init__(self):
+    def __init__(self, port=DEFAULT_PORT, persistent=True, unix=None):
+        self.port = port
+        self.persistent = persistent # load and store pypilot.conf
+        # local clients avoid tcp, by default only for the autopilot on the default port
+        self.unix = port == DEFAULT_PORT if unix is None else unix
+        self.unix_socket_path = configfilepath + unix_socket_name(port)
         self.pipes = []
         self.multiprocessing = use_multiprocessing
         self.initialized = False
@@ -595,6 +1297,7 @@ class pypilotServer(object):
         
     def run(self):
         print('pypilotServer process', os.getpid())
+        tracing.start('server')
         # if server is in a separate process
         self.init()
         while True:
@@ -621,7 +1324,6 @@ class pypilotServer(object):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setblocking(0)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.port = DEFAULT_PORT
         self.sockets = []
         self.fd_to_pipe = {}
         self.values = ServerValues(self)
@@ -638,9 +1340,18 @@ class pypilotServer(object):
         self.server_socket.listen(5)
         fd = self.server_socket.fileno()
         self.fd_to_connection = {fd: self.server_socket}
-        self.poller = select.poll()
+        try:
+            self.poller = select.epoll()
+            self.poll_scale = 1 # epoll timeout is in seconds
+        except AttributeError:
+            self.poller = select.poll() # not linux
+            self.poll_scale = 1000
         self.poller.register(fd, select.POLLIN)
 
+        self.unix_socket = False
+        if self.unix:
+            self.listen_unix()
+
         # setup direct pipe clients
         print('server setup has', len(self.pipes), 'pipes')
         for pipe in self.pipes:
@@ -650,29 +1361,63 @@ class pypilotServer(object):
                 self.fd_to_connection[fd] = pipe
                 self.fd_to_pipe[fd] = pipe
             pipe.cwatches = {'values': True} # server always watches client values
+            pipe.timestamps = False
+            pipe.msgs_in = pipe.bytes_in = 0
+        self.stats = ServerStats(self)
         self.initialized = True
-        self.zeroconf = zeroconf()
-        self.zeroconf.start()
+        if self.port == DEFAULT_PORT: # zeroconf advertises the default port
+            self.zeroconf = zeroconf()
+            self.zeroconf.start()
             
+    # listen for local clients on a unix socket, an existing socket file is stale
+    # since this server now holds the tcp port
+    def listen_unix(self):
+        try:
+            if os.path.exists(self.unix_socket_path):
+                os.unlink(self.unix_socket_path) # left from previous server
+            self.unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.unix_socket.setblocking(0)
+            self.unix_socket.bind(self.unix_socket_path)
+            self.unix_socket.listen(5)
+            fd = self.unix_socket.fileno()
+            self.fd_to_connection[fd] = self.unix_socket
+            self.poller.register(fd, select.POLLIN)
+        except Exception as e:
+            print(_('pypilot_server: failed to listen on'), self.unix_socket_path, e)
+            if self.unix_socket:
+                self.unix_socket.close()
+            self.unix_socket = False
+
     def __del__(self):
         if not self.initialized:
             return
-        self.values.store()
+        if self.persistent:
+            self.values.store()
+            self.values.writer.flush()
         self.server_socket.close()
+        if self.unix_socket:
+            self.unix_socket.close()
+            try:
+                os.unlink(self.unix_socket_path)
+            except Exception:
+                pass
         for socket in self.sockets:
             socket.close()
         for pipe in self.pipes:
             pipe.close()
 
     def RemoveSocket(self, socket):
-        print('server remove socket', socket.address)
+        print('server remove socket', socket.address, 'coalesced', socket.coalesced, 'dropped', socket.dropped)
         self.sockets.remove(socket)
 
         found = False
         for fd in self.fd_to_connection:
             if socket == self.fd_to_connection[fd]:
                 del self.fd_to_connection[fd]
-                self.poller.unregister(fd)
+                try:
+                    self.poller.unregister(fd)
+                except Exception as e:
+                    pass # already closed, epoll removes closed descriptors
                 found = True
                 break
 
@@ -699,37 +1444,35 @@ class pypilotServer(object):
 
         # if config file is edited externally
         self.values.poll_config(t0)
-        if not timeout:
-            timeout = 400
-        else:
-            timeout *= 1000 # milliseconds
-
-        # sleep between 50 and 400 milliseconds
-        timeout = max(min(int(timeout), 400), 50)
-
-        #timeout = 10
-        events = self.poller.poll(timeout)
-
-        while events:
-            event = events.pop()
-            fd, flag = event
-                                    
-            connection = self.fd_to_connection[fd]
-            if connection == self.server_socket:
-                connection, address = connection.accept()
-                if len(self.sockets) == max_connections:
-                    print('pypilot server: ' + _('max connections reached') + '!!!', len(self.sockets))
-                    self.RemoveSocket(self.sockets[0]) # dump first socket??
-                socket = LineBufferedNonBlockingSocket(connection, address)
-                print(_('server add socket'), socket.address)
-
-                self.sockets.append(socket)
-                fd = socket.fileno()
-                socket.cwatches = {} # {'values': True} # server always watches client values
-
-                self.fd_to_connection[fd] = socket
-                self.poller.register(fd, select.POLLIN)
-            elif flag & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+        stats = self.stats
+        stats.polls += 1
+        t1 = time.monotonic()
+        stats.phases['store'] += t1 - t0
+
+        # sleep until woken by data or the next periodic watch, at most 400 milliseconds
+        if timeout is None:
+            timeout = .4
+        timeout = min(max(timeout, 0), .4)
+        events = self.poller.poll(timeout*self.poll_scale)
+        t1 = time.monotonic()
+        accept_time = 0
+
+        for fd, flag in events:
+            connection = self.fd_to_connection.get(fd)
+            if not connection:
+                continue # removed while handling an earlier event
+            if connection == self.server_socket or connection == self.unix_socket:
+                ta = time.monotonic()
+                self.accept(connection)
+                accept_time += time.monotonic() - ta
+                continue
+
+            if flag & select.POLLOUT:
+                # output can be sent again, flush below
+                connection.waiting_writable = False
+                self.poller.modify(fd, select.POLLIN)
+
+            if flag & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
                 if not connection in self.sockets:
                     print(_('internal pipe closed, server exiting'))
                     exit(0)
@@ -740,6 +1483,8 @@ class pypilotServer(object):
                         continue
                     line = connection.readline() # shortcut since poll indicates data is ready
                     while line:
+                        connection.msgs_in += 1
+                        connection.bytes_in += len(line)
                         self.values.HandleRequest(line, connection)                        
                         line = connection.readline()
                     continue
@@ -750,6 +1495,8 @@ class pypilotServer(object):
                     line = connection.readline()
                     if not line:
                         break
+                    connection.msgs_in += 1
+                    connection.bytes_in += len(line)
                     try:
                         self.values.HandleRequest(line, connection)                        
                     except Exception as e:
@@ -768,33 +1515,120 @@ class pypilotServer(object):
                     line = pipe.readline()
                     if not line:
                         break
+                    pipe.msgs_in += 1
+                    pipe.bytes_in += len(line)
                     self.values.HandleRequest(line, pipe)
-                        
+
+        t2 = time.monotonic()
+        stats.phases['accept'] += accept_time
+        stats.phases['read'] += t2 - t1 - accept_time
+        tracing.span('server.read', t1, t2)
+
         # send periodic watches
         self.values.send_watches()
+        self.values.values['timestamps'].check_offset(t2)
+        self.values.values['session'].expire(t2)
 
-        # send watches
-        for connection in self.sockets + self.pipes:
-            if connection.cwatches:
-                connection.write('watch=' + pyjson.dumps(connection.cwatches) + '\n')
-                connection.cwatches = {}
-
-        # flush all sockets
+        # send watches, only pipes can own values
+        for pipe in self.pipes:
+            if pipe.cwatches:
+                pipe.write('watch=' + pyjson.dumps(pipe.cwatches) + '\n')
+                pipe.cwatches = {}
+
+        # update statistics before flushing so watchers get them this poll
+        stats.update(t2)
+        t3 = time.monotonic()
+        stats.phases['watches'] += t3 - t2
+        tracing.span('server.watches', t2, t3)
+
+        # flush sockets with pending output unless they are waiting to become writable
+        closed = []
         for socket in self.sockets:
-            socket.flush()
-        while True:
-            for socket in self.sockets:
-                if not socket.socket:
-                    print(_('server socket closed from flush!!'))
-                    self.RemoveSocket(socket)
-                    break
-            else:
-                break
+            if socket.waiting_writable:
+                if t3 - socket.waiting_writable > writable_timeout:
+                    print(_('pypilot socket not writable, closing'), socket.address)
+                    socket.close()
+            elif socket.out_buffer or socket.pending:
+                socket.flush()
+                if socket.socket and socket.out_buffer: # incomplete, wait for POLLOUT
+                    socket.waiting_writable = t3 # since
+                    self.poller.modify(socket.fileno(), select.POLLIN | select.POLLOUT)
+            if not socket.socket:
+                closed.append(socket)
+
+        for socket in closed:
+            print(_('server socket closed from flush!!'))
+            self.RemoveSocket(socket)
                 
         for pipe in self.pipes:
             pipe.flush()
+        if self.persistent:
+            self.values.values['multicast'].publisher.flush()
+        t4 = time.monotonic()
+        stats.phases['flush'] += t4 - t3
+        tracing.span('server.flush', t3, t4)
+
+    def accept(self, server_socket):
+        # accept all pending connections
+        while True:
+            try:
+                connection, address = server_socket.accept()
+            except OSError:
+                return # no more
+            if server_socket == self.unix_socket:
+                address = ('127.0.0.1', 'unix') # udp streams still go to localhost
+            if len(self.sockets) == max_connections:
+                print('pypilot server: ' + _('max connections reached') + '!!!', len(self.sockets))
+                self.RemoveSocket(self.sockets[0]) # dump first socket??
+            socket = LineBufferedNonBlockingSocket(connection, address)
+            print(_('server add socket'), socket.address)
+
+            self.sockets.append(socket)
+            fd = socket.fileno()
+            socket.cwatches = {} # {'values': True} # server always watches client values
+            socket.session = False # token if the client can resume after reconnecting
+            socket.msgs_in = socket.bytes_in = 0
+            socket.waiting_writable = False # or when it began waiting
+            socket.coalesce = True # slow clients only get the latest values
+
+            self.fd_to_connection[fd] = socket
+            self.poller.register(fd, select.POLLIN)
+
+# time to deliver one update to many watching sockets
+def fanout_benchmark(count=10000):
+    for watchers in [1, 10, 30]:
+        owner = NonBlockingPipe('bench', False)[0]
+        owner.cwatches = {}
+        value = pypilotValue(None, 'imu.fusionQPose', connection=owner)
+        pairs = [socket.socketpair() for i in range(watchers)]
+        connections = []
+        for a, b in pairs:
+            connection = LineBufferedNonBlockingSocket(a, 'bench')
+            b.setblocking(False)
+            value.watch(connection, 0)
+            connections.append(connection)
+
+        dt = 1e9
+        for r in range(3): # take the best run
+            t0 = time.monotonic()
+            for i in range(count):
+                q = .001*i
+                value.set('imu.fusionQPose=[%.8f, %.8f, %.8f, %.8f]\n' % (1-q, q, -q, q/2), owner)
+                if i % 100 == 99: # flush as a server poll would
+                    for connection in connections:
+                        connection.flush()
+                    for a, b in pairs:
+                        b.recv(65536)
+            dt = min(dt, time.monotonic() - t0)
+        print('%2d watchers: %.2fus/update' % (watchers, dt*1e6/count))
+        for a, b in pairs:
+            a.close()
+            b.close()
 
 if __name__  == '__main__':
+    if 'bench' in sys.argv:
+        fanout_benchmark()
+        exit(0)
     server = pypilotServer()
     from client import pypilotClient
     from values import *
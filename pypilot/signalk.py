@@ -9,7 +9,7 @@
 
 import time, socket, multiprocessing, os
 from nonblockingpipe import NonBlockingPipe
-import pyjson
+import pyjson, tracing
 from client import pypilotClient
 from values import Property, RangeProperty
 from sensors import source_priority
@@ -303,6 +303,7 @@ class signalk(object):
     def process(self):
         time.sleep(6) # let other stuff load
         print('signalk process', os.getpid())
+        tracing.start('signalk')
         self.process = False
         while True:
             time.sleep(.1)
@@ -459,6 +460,7 @@ class signalk(object):
                     else:
                         debug('signalk ' + _('received'), sensor, data)
                     break
+        tracing.span('signalk.poll', t1)
         #print('sigktimes', t1-t0, t2-t1, t3-t2, t4-t3, t5-t4)
 
     def send_signalk(self):
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# software in the loop simulation of a boat and servo
+#
+#    pypilot_sim -r 50 -t 60 ap.pilot=simple
+# runs the autopilot with all of its processes on a plain linux computer.
+# A boat model stands in for the RTIMU library, so the imu process, the imu
+# ring and the autopilot are unchanged, and an in process driver with the
+# interface of ArduinoServo stands in for the servo controller.  The
+# rudder angle is shared with the boat model in the imu process.
+#
+# every 10 seconds the closed loop latency from imu sample to servo command,
+# cpu use of all processes and the heading error are printed
+
+import sys, os, time, math, random, multiprocessing
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import gettext_loader
+import pyjson, quaternion
+from histogram import Histogram
+
+# boat
+yaw_time_constant = 2.0 # seconds for the turn rate to follow the rudder (inertia)
+rudder_effectiveness = .3 # degrees/s of turn for each degree of rudder
+wave_yaw = 3 # degrees/s of turn rate from waves
+wave_roll = 8 # degrees
+wave_period = 7 # seconds
+wind_direction = 60 # degrees true the wind is from
+wind_helm = 2 # degrees/s of turn into the wind when beam reaching
+wind_heel = 12 # degrees when beam reaching
+sensor_noise = .002 # radians/s of gyro noise
+
+# servo
+rudder_speed = 8 # degrees/s of rudder at full command
+servo_current = 3 # amps at full command
+servo_voltage = 12.6
+
+# shared between the imu process with the boat and the autopilot process with the servo
+RUDDER, HEADING, TIMESTAMP = range(3)
+
+class BoatModel(object):
+    def __init__(self, state, heading=90):
+        self.state = state
+        self.heading = heading
+        self.rate = 0 # degrees/s
+        self.roll = self.pitch = 0
+        self.rollrate = 0
+        self.time = False
+        self.random = random.Random(1)
+
+    def step(self, t):
+        dt = t - self.time if self.time else 0
+        self.time = t
+
+        # turn rate follows the rudder, disturbed by irregular waves and weather helm
+        rudder = self.state[RUDDER]
+        w = 2*math.pi*t/wave_period
+        wave = math.sin(w) + .6*math.sin(w*1.73 + 1) + .3*math.sin(w*.57 + 2)
+        apparent = math.radians(wind_direction - self.heading)
+        rate = -rudder_effectiveness*rudder + wave_yaw*wave + wind_helm*math.sin(apparent)
+        self.rate += (rate - self.rate)*min(dt/yaw_time_constant, 1)
+        self.heading = (self.heading + self.rate*dt) % 360
+
+        roll = wind_heel*math.sin(apparent) + wave_roll*math.sin(w*1.1)
+        if dt:
+            self.rollrate = (roll - self.roll)/dt
+        self.roll = roll
+        self.pitch = 2*math.sin(w*1.3)
+        self.state[HEADING] = self.heading
+        self.state[TIMESTAMP] = t
+
+    def sample(self):
+        q = quaternion.multiply(quaternion.angvec2quat(math.radians(self.heading), [0, 0, 1]),
+                                quaternion.multiply(quaternion.angvec2quat(math.radians(self.pitch), [0, 1, 0]),
+                                                    quaternion.angvec2quat(math.radians(self.roll), [1, 0, 0])))
+        rates = [math.radians(self.rollrate), 0, math.radians(self.rate)]
+        gyro = quaternion.rotvecquat(rates, quaternion.conjugate(q)) # sensor frame
+        gyro = list(map(lambda x : x + self.random.gauss(0, sensor_noise), gyro))
+        accel = quaternion.rotvecquat([0, 0, 1], quaternion.conjugate(q))
+        compass = quaternion.rotvecquat([30, 0, 40], quaternion.conjugate(q))
+        return {'accel': accel, 'gyro': gyro, 'compass': compass, 'fusionQPose': q}
+
+# stands in for the RTIMU library in the imu process
+class SimulatedRTIMU(object):
+    def __init__(self, boat):
+        self.boat = boat
+
+    class Settings(object):
+        def __init__(self, filename):
+            pass
+
+    def RTIMU(self, settings):
+        settings.IMUType = 1 # detected
+        return SimulatedIMUSensor(self.boat)
+
+class SimulatedIMUSensor(object):
+    def __init__(self, boat):
+        self.boat = boat
+
+    def IMUName(self):
+        return 'Simulated IMU'
+
+    def IMUInit(self):
+        return True
+
+    def setSlerpPower(self, power):
+        pass
+
+    def setGyroEnable(self, enable):
+        pass
+
+    def setAccelEnable(self, enable):
+        pass
+
+    def setCompassEnable(self, enable):
+        pass
+
+    def resetFusion(self):
+        pass
+
+    def IMURead(self):
+        self.boat.step(time.monotonic())
+        return True
+
+    def getIMUData(self):
+        return self.boat.sample()
+
+    def getAccelResiduals(self):
+        return [0, 0, 0]
+
+# in process driver for the servo with the interface of ArduinoServo
+class SimulatedServo(object):
+    path = 'simulator'
+    def __init__(self, state):
+        self.state = state
+        self.voltage = servo_voltage
+        self.current = 0
+        self.controller_temp = self.motor_temp = 25
+        self.rudder = 0 # raw, degrees/100 with the default rudder calibration
+        self.rudder_min, self.rudder_max = -.5, .5
+        self.flags = ServoFlags.SYNC
+        self.speed = 0
+        self.time = time.monotonic()
+        self.latency = Histogram()
+
+    def command(self, command):
+        self.speed = min(max(command, -1), 1)
+        self.flags |= ServoFlags.ENGAGED
+        # closed loop latency: boat motion sampled until the rudder is commanded
+        self.latency.add(time.monotonic() - self.state[TIMESTAMP])
+
+    def disengage(self):
+        self.speed = 0
+        self.flags &= ~ServoFlags.ENGAGED
+
+    def reset(self):
+        self.flags &= ~(ServoFlags.MIN_RUDDER_FAULT | ServoFlags.MAX_RUDDER_FAULT)
+
+    def params(self, raw_max_current, rudder_min, rudder_max, *args):
+        self.rudder_min, self.rudder_max = rudder_min, rudder_max
+
+    def fault(self):
+        return False
+
+    def poll(self):
+        t = time.monotonic()
+        dt, self.time = t - self.time, t
+        rudder = self.rudder + self.speed*rudder_speed/100*dt
+        self.flags &= ~(ServoFlags.MIN_RUDDER_FAULT | ServoFlags.MAX_RUDDER_FAULT)
+        if rudder <= self.rudder_min:
+            rudder = self.rudder_min
+            self.flags |= ServoFlags.MIN_RUDDER_FAULT
+        elif rudder >= self.rudder_max:
+            rudder = self.rudder_max
+            self.flags |= ServoFlags.MAX_RUDDER_FAULT
+        self.rudder = rudder
+        self.state[RUDDER] = rudder*100
+        self.current = servo_current*abs(self.speed)
+        return ServoTelemetry.FLAGS | ServoTelemetry.CURRENT | ServoTelemetry.VOLTAGE | ServoTelemetry.RUDDER
+
+# user and system cpu seconds of this process and its children
+def cpu_times():
+    pids = [os.getpid()]
+    for pid in os.listdir('/proc'):
+        try:
+            f = open('/proc/%s/stat' % pid)
+            stat = f.read()
+            f.close()
+        except Exception as e:
+            continue # not a process, or exited
+        if int(stat.rsplit(')', 1)[1].split()[1]) == os.getpid():
+            pids.append(int(pid))
+
+    times = {}
+    for pid in pids:
+        try:
+            f = open('/proc/%d/stat' % pid)
+            fields = f.read().rsplit(')', 1)[1].split()
+            f.close()
+            times[pid] = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except Exception as e:
+            pass
+    return times
+
+def main():
+    if '-h' in sys.argv:
+        print(_('usage'), sys.argv[0], '[-r rate] [-t seconds] [-s] [NAME=VALUE]...')
+        print(_('run the autopilot on a simulated boat and servo'))
+        print(_('values given are set at the start, eg:'), 'ap.pilot=simple')
+        print('-r', _('imu rate in hz'), '(20)')
+        print('-t', _('stop after this many seconds'))
+        print('-s', _('stay in standby, otherwise the autopilot is engaged on the initial heading'))
+        print('-h', _('show this message'))
+        exit(0)
+
+    args = list(sys.argv)[1:]
+    rate, duration = 20, False
+    if '-r' in args:
+        i = args.index('-r')
+        rate = int(args[i+1])
+        args = args[:i] + args[i+2:]
+    if '-t' in args:
+        i = args.index('-t')
+        duration = float(args[i+1])
+        args = args[:i] + args[i+2:]
+    standby = '-s' in args
+    if standby:
+        args.remove('-s')
+
+    settings = {}
+    for arg in args:
+        name, value = arg.split('=', 1)
+        try:
+            settings[name] = pyjson.loads(value)
+        except Exception as e:
+            settings[name] = value # unquoted string
+
+    # do not touch the settings or serial devices found of the real boat
+    import tempfile, shutil, atexit
+    home = tempfile.mkdtemp(prefix='pypilot_sim')
+    os.makedirs(home + '/.pypilot')
+    os.environ['HOME'] = home
+    atexit.register(lambda : shutil.rmtree(home, ignore_errors=True))
+    # serialprobe and the servo calibration find their files in HOME when imported
+    global ServoFlags, ServoTelemetry
+    from servo import ServoFlags, ServoTelemetry
+
+    state = multiprocessing.Array('d', 3, lock=False)
+    boat = BoatModel(state)
+    import boatimu
+    boatimu.RTIMU = SimulatedRTIMU(boat) # before the imu process starts
+
+    from autopilot import Autopilot
+    ap = Autopilot()
+    driver = SimulatedServo(state)
+    ap.servo.driver = ap.servo.device = driver
+    ap.servo.controller.set('simulator')
+    ap.servo.send_driver_params()
+
+    if not rate in ap.boatimu.rate.choices:
+        ap.boatimu.rate.choices.append(rate) # allow faster rates than the imu hardware
+    values = ap.client.values.values
+    values['imu.rate'].set(rate)
+    for name in settings:
+        if name in values:
+            values[name].set(settings[name])
+        else:
+            print(_('unknown value'), name)
+
+    print(_('simulating at'), rate, 'hz')
+    t0 = lastreport = time.monotonic()
+    cpu = cpu_times()
+    iterations = engaged = 0
+    error2 = 0
+    while not duration or time.monotonic() - t0 < duration:
+        ap.iteration()
+        iterations += 1
+        t = time.monotonic()
+        if not standby and not ap.enabled.value and t - t0 > 3 and ap.boatimu.SensorValues['heading'].value:
+            ap.heading_command.set(round(ap.boatimu.SensorValues['heading'].value))
+            ap.enabled.set(True)
+            driver.latency.reset()
+        if ap.enabled.value:
+            engaged += 1
+            error2 += ap.heading_error.value**2
+
+        if t - lastreport >= 10 or (duration and t - t0 >= duration):
+            dt, lastreport = t - lastreport, t
+            lastcpu, cpu = cpu, cpu_times()
+            total = sum(map(lambda pid : cpu[pid] - lastcpu.get(pid, 0), cpu))
+            main = cpu[os.getpid()] - lastcpu[os.getpid()]
+            print(_('iterations'), '%.1f/s' % (iterations/dt),
+                  _('latency ms'), driver.latency.summary(),
+                  _('cpu'), '%.1f%%' % (100*total/dt), '(' + _('autopilot'), '%.1f%%)' % (100*main/dt),
+                  _('heading error rms'), '%.2f' % ((error2/engaged)**.5 if engaged else 0))
+            iterations = engaged = 0
+            error2 = 0
+            driver.latency.reset()
+
+    import signal
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) # children exit with the simulation
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2023 Sean D'Epagnier
+#
+# This Program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# opt-in tracing of where each pypilot process spends its time
+#
+# when started with PYPILOT_TRACE=1 in the environment, each process keeps
+# its most recent spans in a ring.  On SIGUSR1 to the autopilot, or
+#    pypilot_trace
+# every process writes its ring to ~/.pypilot/trace/ and the files are merged
+# into one chrome trace to open with ui.perfetto.dev or chrome://tracing
+#
+# spans are timed with time.monotonic which is shared by all processes
+
+import sys, os, time, signal
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import gettext_loader
+import pyjson
+
+trace_size = 8192 # spans kept per process
+trace_signal = signal.SIGUSR1
+trace_dir = os.getenv('HOME') + '/.pypilot/trace/'
+
+class Tracer(object):
+    def __init__(self, name, size=trace_size):
+        self.name = name
+        self.pid = os.getpid()
+        self.size = size
+        # fixed size arrays so adding a span does not allocate
+        self.names = [None]*size
+        self.starts = [0]*size
+        self.ends = [0]*size
+        self.count = 0
+
+    def span(self, name, start, end):
+        i = self.count % self.size
+        self.names[i] = name
+        self.starts[i] = start
+        self.ends[i] = end
+        self.count += 1
+
+    def events(self):
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': self.name}}]
+        for index in range(max(self.count - self.size, 0), self.count):
+            i = index % self.size
+            start = self.starts[i]
+            events.append({'name': self.names[i], 'ph': 'X', 'pid': self.pid, 'tid': self.pid,
+                           'ts': round(start*1e6, 1), 'dur': round((self.ends[i] - start)*1e6, 1)})
+        return events
+
+    def dump(self):
+        filename = trace_dir + '%s-%d.json' % (self.name.replace(' ', '_'), self.pid)
+        try:
+            os.makedirs(trace_dir, exist_ok=True)
+            f = open(filename + '.tmp', 'w')
+            f.write(pyjson.dumps(self.events()))
+            f.close()
+            os.rename(filename + '.tmp', filename) # merge never reads a partial file
+            print(_('wrote trace'), filename)
+        except Exception as e:
+            print(_('failed to write trace'), filename, e)
+
+tracer = False # this process is tracing
+
+def start(name):
+    global tracer
+    if not os.getenv('PYPILOT_TRACE'):
+        return
+    tracer = Tracer(name)
+    signal.signal(trace_signal, lambda signal_number, frame: dump())
+
+# record a span from start until end or now
+def span(name, start, end=None):
+    if tracer:
+        tracer.span(name, start, time.monotonic() if end is None else end)
+
+def dump():
+    if tracer and tracer.pid == os.getpid(): # not inherited from the parent process
+        tracer.dump()
+
+def merge(filenames, output):
+    events = []
+    for filename in filenames:
+        try:
+            f = open(filename)
+            events += pyjson.loads(f.read())
+            f.close()
+        except Exception as e:
+            print(_('failed to read trace'), filename, e)
+    f = open(output, 'w')
+    f.write(pyjson.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}))
+    f.close()
+    print(_('wrote'), output, len(events), _('events from'), len(filenames), _('processes'))
+
+def main():
+    if '-h' in sys.argv:
+        print(_('usage'), sys.argv[0], '[-m] [-o output]')
+        print(_('request the autopilot processes write their traces and merge them'))
+        print(_('the autopilot must run with PYPILOT_TRACE=1 in its environment'))
+        print('-m', _('only merge the traces already written'))
+        print('-o', _('output file'), '(pypilot-trace.json)')
+        print('-h', _('show this message'))
+        exit(0)
+
+    args = list(sys.argv)[1:]
+    output = 'pypilot-trace.json'
+    if '-o' in args:
+        i = args.index('-o')
+        output = args[i+1]
+        args = args[:i] + args[i+2:]
+
+    t0 = 0
+    if not '-m' in args:
+        from client import pypilotClient
+        client = pypilotClient('localhost') # traces are written on this host
+        if not client.connect(True):
+            print(_('failed to connect to'), 'localhost')
+            exit(1)
+        t0 = time.time()
+        client.set('ap.trace', True)
+        client.poll()
+        time.sleep(2) # give every process time to write
+
+    filenames = []
+    if os.path.isdir(trace_dir):
+        for name in os.listdir(trace_dir):
+            filename = trace_dir + name
+            if name.endswith('.json') and os.path.getmtime(filename) >= t0 - 1:
+                filenames.append(filename)
+    if not filenames:
+        print(_('no traces in'), trace_dir)
+        exit(1)
+    merge(sorted(filenames), output)
+
+if __name__ == '__main__':
+    main()
@@ -12,9 +12,20 @@ import pyjson
 from resolv import resolv
 
 class Value(object):
+    # the message is formatted once between sets.  A subclass that defines
+    # get_msg or set formats it every time, unless it also sets cache_msg
+    # because get_msg only depends on value and set calls Value.set
+    cache_msg = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not 'cache_msg' in cls.__dict__ and ('get_msg' in cls.__dict__ or 'set' in cls.__dict__):
+            cls.cache_msg = False
+
     def __init__(self, name, initial, **kwargs):
         self.name = name
         self.watch = False
+        self.msg = None # cached name=value line, cleared on set
         self.set(initial)
 
         self.info = {'type': 'Value'}
@@ -36,11 +47,20 @@ class Value(object):
             return 'true' if self.value else 'false'
         return str(self.value)
 
+    # format the message at most once for each set
+    def get_cached_msg(self):
+        if not self.cache_msg:
+            return self.name + '=' + self.get_msg() + '\n'
+        if self.msg is None:
+            self.msg = self.name + '=' + self.get_msg() + '\n'
+        return self.msg
+
     def set(self, value):
         self.value = value
+        self.msg = None
         if self.watch:
             if self.watch.period == 0: # and False:   # disable immediate
-                self.client.send(self.name+'='+self.get_msg()+'\n')
+                self.client.send(self.get_cached_msg())
 
             elif self.pwatch:
                 t0 = time.monotonic()
@@ -50,6 +70,8 @@ class Value(object):
                 self.pwatch = False
 
 class JSONValue(Value):
+    cache_msg = True
+
     def __init__(self, name, initial, **kwargs):
       super(JSONValue, self).__init__(name, initial, **kwargs)
 
@@ -76,6 +98,8 @@ def round_value(value, fmt):
         return str(e)
 
 class RoundedValue(Value):
+    cache_msg = True
+
     def __init__(self, name, initial, **kwargs):
         super(RoundedValue, self).__init__(name, initial, **kwargs)
       
@@ -83,6 +107,8 @@ class RoundedValue(Value):
         return round_value(self.value, '%.4f')
 
 class StringValue(Value):
+    cache_msg = True
+
     def __init__(self, name, initial, **kwargs):
         super(StringValue, self).__init__(name, initial, **kwargs)
 
@@ -94,6 +120,8 @@ class StringValue(Value):
         return strvalue
 
 class SensorValue(Value):
+    cache_msg = True
+
     def __init__(self, name, initial=False, fmt='%.4f', **kwargs):
         super(SensorValue, self).__init__(name, initial, **kwargs)
         self.directional = 'directional' in kwargs and kwargs['directional']
@@ -124,6 +152,8 @@ class Property(Value):
         self.info['writable'] = True
 
 class ResettableValue(Property):
+    cache_msg = True
+
     def __init__(self, name, initial, fmt=None, **kwargs):
         self.initial = initial
         super(ResettableValue, self).__init__(name, initial, **kwargs)
@@ -141,6 +171,8 @@ class ResettableValue(Property):
         super(ResettableValue, self).set(value)
 
 class RangeProperty(Property):
+    cache_msg = True
+
     def __init__(self, name, initial, min_value, max_value, **kwargs):
         self.min_value = min_value
         self.max_value = max_value
@@ -166,6 +198,7 @@ class RangeProperty(Property):
     def set_max(self, max_value):
         if self.value > max_value:
             self.value = max_value
+            self.msg = None
         self.max_value = max_value
 
 # a range property that is persistent and specifies the units
@@ -178,6 +211,8 @@ class RangeSetting(RangeProperty):
         self.info['units'] = self.units
 
 class EnumProperty(Property):
+    cache_msg = True
+
     def __init__(self, name, initial, choices, **kwargs):
         self.choices = choices
         super(EnumProperty, self).__init__(name, initial, **kwargs)
@@ -197,6 +232,8 @@ class EnumProperty(Property):
         print(_('invalid set'), self.name, '=', value)
 
 class BooleanValue(Value):
+    cache_msg = True
+
     def __init__(self, name, initial, **kwargs):
         super(BooleanValue, self).__init__(name, initial, **kwargs)
 
@@ -204,6 +241,8 @@ class BooleanValue(Value):
         return 'true' if self.value else 'false'
 
 class BooleanProperty(BooleanValue):
+    cache_msg = True
+
     def __init__(self, name, initial, **kwargs):
         super(BooleanProperty, self).__init__(name, initial, **kwargs)
         self.info['writable'] = True
@@ -134,6 +134,7 @@ setup (name = 'pypilot',
        package_dir=package_dirs,
        ext_modules = ext_modules,
        package_data=package_data,
+       extras_require={'optimize': ['orjson', 'ujson']}, # faster json, optional
        cmdclass={'install': build_ext_first},
        entry_points={
            'console_scripts': [
@@ -145,6 +146,12 @@ setup (name = 'pypilot',
                'pypilot_control=pypilot.ui.autopilot_control:main',
                'pypilot_calibration=pypilot.ui.autopilot_calibration:main',
                'pypilot_client=pypilot.client:main',
+               'pypilot_bench=pypilot.bench:main',
+               'pypilot_relay=pypilot.relay:main',
+               'pypilot_multicast=pypilot.multicast:main',
+               'pypilot_trace=pypilot.tracing:main',
+               'pypilot_replay=pypilot.replay:main',
+               'pypilot_sim=pypilot.simulator:main',
                'pypilot_scope=pypilot.ui.scope_wx:main',
                'pypilot_client_wx=pypilot.ui.client_wx:main'
                ]
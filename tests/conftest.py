@@ -0,0 +1,38 @@
+# the pypilot modules import each other by name, and keep their
+# settings in ~/.pypilot so the tests use a temporary home
+import os, sys, socket, tempfile, time
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='pypilot_test')
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'pypilot'))
+import gettext_loader
+
+import pytest
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+# poll clients until condition returns true
+def poll_until(condition, clients, timeout=5):
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        for client in clients:
+            client.poll(.01)
+        if condition():
+            return True
+    return False
+
+# the server runs in its own process, pipe clients must be created before start
+@pytest.fixture
+def pserver():
+    import server
+    s = server.pypilotServer(free_port(), persistent=False)
+    yield s
+    if s.process and s.process != 'server process':
+        s.process.terminate()
+        s.process.join()
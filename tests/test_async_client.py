@@ -0,0 +1,49 @@
+import asyncio, json
+
+import pytest
+
+from async_client import AsyncPypilotClient
+
+# a server that records the lines it receives and replies with reply(line)
+async def fake_server(reply):
+    lines = []
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            lines.append(line.decode())
+            for msg in reply(line.decode()):
+                writer.write(msg.encode())
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1], lines
+
+def test_get_timeout_removes_its_watch():
+    async def run():
+        server, port, lines = await fake_server(lambda line : [])
+        client = AsyncPypilotClient('127.0.0.1:%d' % port)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.get('test.missing', .3)
+        assert client.getters == {}
+        await asyncio.sleep(.1)
+        await client.close()
+        server.close()
+        return lines
+    lines = [line.split('=', 1) for line in asyncio.run(run())]
+    assert [(name, json.loads(data)) for name, data in lines] == \
+        [('watch', {'test.missing': True}), ('watch', {'test.missing': False})]
+
+def test_get_long_values_line():
+    values = dict(('test.value%d' % i, {'type': 'Value'}) for i in range(5000))
+    def reply(line):
+        if line.startswith('watch={"values"'):
+            return ['values=' + json.dumps(values) + '\n']
+        return []
+    async def run():
+        server, port, lines = await fake_server(reply)
+        client = AsyncPypilotClient('127.0.0.1:%d' % port)
+        result = await client.list_values(5)
+        await client.close()
+        server.close()
+        return result
+    assert asyncio.run(run()) == values
@@ -0,0 +1,91 @@
+import socket, time
+
+import bufferedsocket
+from bufferedsocket import LineBufferedNonBlockingSocket
+
+def connection_pair():
+    a, b = socket.socketpair()
+    b.settimeout(1)
+    connection = LineBufferedNonBlockingSocket(a, 'test')
+    connection.coalesce = True
+    return connection, b
+
+def received(peer, size):
+    data = b''
+    while len(data) < size:
+        data += peer.recv(65536)
+    return data.decode()
+
+def test_coalesced_updates_stay_in_order():
+    connection, peer = connection_pair()
+    connection.write('a=1\n', True)
+    connection.write('b=1\n', True)
+    connection.write('a=2\n', True)
+    connection.write('error=bad request\n')
+    connection.write('a=3\n', True)
+    connection.flush()
+    expected = 'a=2\nb=1\nerror=bad request\na=3\n'
+    assert received(peer, len(expected)) == expected
+    assert connection.coalesced == 1
+
+def test_control_replies_are_not_coalesced():
+    connection, peer = connection_pair()
+    connection.write('x=1\n', True, b'x=1\n')
+    connection.write('x=1\n', False, b'x=1\n') # get reply
+    connection.write('get=["x"]\n')
+    connection.write('x=1\n', False, b'x=1\n')
+    connection.write('get=["x"]\n')
+    connection.flush()
+    expected = 'x=1\nx=1\nget=["x"]\nx=1\nget=["x"]\n'
+    assert received(peer, len(expected)) == expected
+    assert connection.coalesced == 0
+
+def test_pending_is_bounded(monkeypatch):
+    monkeypatch.setattr(bufferedsocket, 'max_pending', 2)
+    connection, peer = connection_pair()
+    for name in 'abc':
+        connection.write(name + '=1\n', True)
+    connection.write('a=2\n', True) # still replaced
+    assert connection.dropped == 1
+    assert list(connection.pending) == ['a', 'b']
+
+def test_output_overflow_closes(monkeypatch):
+    monkeypatch.setattr(bufferedsocket, 'max_out_size', 100)
+    connection, peer = connection_pair()
+    connection.write('values={"a": "' + 'x'*200 + '"}\n')
+    assert not connection.socket
+
+def test_coalesced_output_is_bounded(monkeypatch):
+    monkeypatch.setattr(bufferedsocket, 'max_out_size', 100)
+    connection, peer = connection_pair()
+    for i in range(10):
+        connection.write('value%d=%s\n' % (i, 'x'*20), True)
+    connection.flush()
+    assert not connection.socket and connection.out_size == 0
+
+def test_closed_connection_discards_output():
+    connection, peer = connection_pair()
+    connection.close()
+    for i in range(1000):
+        connection.write('a=%d\n' % i, True)
+        connection.write('values={"a": "' + 'x'*100 + '"}\n')
+        connection.flush()
+    assert connection.out_size == 0 and not connection.out_buffer and not connection.pending
+
+def test_partial_sends_resume():
+    connection, peer = connection_pair()
+    peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    lines = ['value%d=%s\n' % (i, 'x'*100) for i in range(500)] # under max_out_size
+    for line in lines:
+        connection.write(line)
+    expected = ''.join(lines)
+    data = b''
+    t0 = time.monotonic()
+    while len(data) < len(expected) and time.monotonic() - t0 < 5:
+        connection.flush()
+        try:
+            data += peer.recv(65536)
+        except socket.timeout:
+            pass
+    assert data.decode() == expected
+    assert not connection.out_buffer and connection.out_size == 0
@@ -0,0 +1,90 @@
+import re, socket, threading, time
+
+from client import pypilotClient
+from values import Value
+
+from conftest import poll_until
+
+# a server from before the get and session requests, it answers watches
+# with the value and records the lines it receives
+def old_server(values, lines):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    def run():
+        while True:
+            connection = listener.accept()[0]
+            for line in connection.makefile():
+                lines.append(line)
+                name, data = line.rstrip().split('=', 1)
+                if name == 'watch':
+                    for vname in values:
+                        if '"%s"' % vname in data and not 'false' in data:
+                            connection.sendall(('%s=%s\n' % (vname, values[vname])).encode())
+                else:
+                    connection.sendall(('error=invalid unknown value: %s\n' % name).encode())
+            connection.close()
+    threading.Thread(target=run, daemon=True).start()
+    return listener.getsockname()[1]
+
+def test_get_falls_back_to_watching_on_old_servers():
+    port = old_server({'test.a': 1, 'test.b': '"x"'}, [])
+    client = pypilotClient('127.0.0.1:%d' % port)
+    assert client.connect()
+    assert poll_until(lambda : client.connection, [client])
+    assert client.get(['test.a', 'test.b'], 5) is None
+    assert client.get_watched(['test.a', 'test.b'], 5) == {'test.a': 1, 'test.b': 'x'}
+
+def test_session_is_not_sent_again_to_old_servers(capsys):
+    lines = []
+    port = old_server({'test.a': 1}, lines)
+    client = pypilotClient('127.0.0.1:%d' % port)
+    client.watch('test.a')
+    assert client.connect()
+    assert poll_until(lambda : not client.session_supported, [client])
+    assert poll_until(lambda : client.receive(), [client])
+
+    client.disconnect()
+    del lines[:]
+    assert poll_until(lambda : client.connection and lines, [client])
+    assert poll_until(lambda : client.receive(), [client]) # watched again
+    assert not [line for line in lines if line.startswith('session=')]
+    assert not 'server error' in capsys.readouterr().out
+
+def test_only_timestamp_clients_get_receive_times(pserver):
+    owner = pypilotClient(pserver)
+    a = owner.register(Value('test.a', 1))
+    pserver.poll()
+    def connect():
+        try:
+            return socket.create_connection(('127.0.0.1', pserver.port))
+        except ConnectionRefusedError:
+            return False # server process is starting
+    assert poll_until(connect, [owner])
+    peers = {}
+    for name, request in [('stamped', b'timestamps=true\n'), ('plain', b'')]:
+        peers[name] = connect()
+        peers[name].sendall(request + b'watch={"test.a": true}\n')
+    traced = pypilotClient('127.0.0.1:%d' % pserver.port, use_timestamps=True)
+    traced.watch('test.a')
+    assert traced.connect()
+    assert poll_until(lambda : traced.receive(), [owner, traced])
+
+    t0 = time.monotonic()
+    a.set(2)
+    assert poll_until(lambda : traced.receive() == {'test.a': 2}, [owner, traced])
+    lines = {}
+    for name, peer in peers.items():
+        peer.settimeout(1)
+        data = b''
+        while data.count(b'test.a') < 2:
+            data += peer.recv(4096)
+        lines[name] = data.decode().split('\n')[:-1]
+        peer.close()
+
+    assert lines['plain'] == ['test.a=1', 'test.a=2']
+    assert lines['stamped'][0].startswith('timestamps=')
+    updates = [re.match(r'test\.a@(\d+\.\d{6})=(\d)$', line) for line in lines['stamped'][1:]]
+    assert [update.group(2) for update in updates] == ['1', '2']
+    assert t0 <= float(updates[1].group(1)) < time.monotonic() # server and clients share the clock
+    assert traced.traces['test.a'].latency.count == 2
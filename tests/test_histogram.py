@@ -0,0 +1,89 @@
+import os, subprocess, sys
+
+import histogram
+from histogram import Histogram, RollingHistogram
+
+def test_percentile_is_the_bucket_upper_bound():
+    h = Histogram([1, 2, 3, 4])
+    assert h.percentile(.5) is None and h.summary() == {'count': 0}
+    for x in [.5, 1.5, 1.7, 2.5, 3.5]:
+        h.add(x)
+    assert h.counts == [1, 2, 1, 1, 0]
+    assert h.percentile(.2) == 1
+    assert h.percentile(.5) == 2
+    assert h.percentile(.6) == 2
+    assert h.percentile(.8) == 3
+    assert h.percentile(1) == 3.5 # no more than the largest sample
+    assert h.summary(1) == {'count': 5, 'p50': 2, 'p95': 3.5, 'p99': 3.5, 'max': 3.5}
+
+def test_overflow_bucket():
+    h = Histogram([1, 2])
+    for x in [.5, 5, 7]:
+        h.add(x)
+    assert h.counts == [1, 0, 2]
+    assert h.percentile(.3) == 1
+    assert h.percentile(.5) == 7 # above the last bound only the max is known
+    assert h.summary(1)['p99'] == 7
+
+def test_default_bounds_are_within_the_spacing():
+    h = Histogram()
+    samples = [i*1e-4 for i in range(1, 1001)] # .1 to 100 milliseconds
+    for x in samples:
+        h.add(x)
+    for p in [.5, .95, .99]:
+        exact = samples[int(p*len(samples)) - 1]
+        assert exact <= h.percentile(p) <= exact * 2**.25
+    h.add(100) # beyond 10 seconds
+    assert h.counts[-1] == 1 and h.summary()['max'] == 100000
+
+def test_rolling_histogram_drops_old_samples():
+    h = RollingHistogram(10, [1, 2])
+    t = h.time
+    h.add(.5)
+    h.rotate(t + 5)
+    h.add(1.5)
+    assert h.summary(1)['count'] == 2
+    h.rotate(t + 11) # first half is previous
+    h.add(1.5)
+    assert h.summary(1)['count'] == 3
+    h.rotate(t + 22)
+    assert h.summary(1) == {'count': 1, 'p50': 1.5, 'p95': 1.5, 'p99': 1.5, 'max': 1.5}
+
+pypilot_dir = os.path.dirname(os.path.abspath(histogram.__file__))
+
+# autopilot replaces sys.stdout when imported so it is checked in its own process
+def test_loop_timings_published_each_second():
+    script = '''
+import sys
+sys.path[:0] = %r
+from autopilot import LoopTimings
+
+class Recorder(object): # stands in for the autopilot registering the value
+    def register(self, _type, name, initial):
+        self.published = []
+        return self
+
+    def set(self, value):
+        self.published.append(value)
+
+ap = Recorder()
+timings = LoopTimings(ap)
+period = .1
+t = timings.publish_time
+for i in range(25):
+    # server (with .02 receive wait) sensors wait imu pilot servo calibration
+    times = [t, t + .03, t + .04, t + .09, t + .095, t + .1, t + .105, t + .11]
+    timings.update(times, period, t + .09, rdt=.02)
+    t += period
+assert len(ap.published) == 2 # after 1 and 2 seconds
+published = ap.published[-1]
+assert 9.5 <= published['server'][0] <= 12.5 # milliseconds, receive wait not counted
+assert published['server'][3] <= 12.5
+assert published['iteration'][3] <= 40 * 2**.25 # less the imu and receive waits
+assert published['iteration'][4] == 0 and not 'wait' in timings.overruns
+assert published['jitter'][3] < 1
+print('published', len(ap.published))
+''' % [pypilot_dir, os.path.dirname(pypilot_dir)]
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'published 2' in result.stdout
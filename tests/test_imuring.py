@@ -0,0 +1,62 @@
+import multiprocessing
+
+from imuring import IMURing, ring_seq
+
+def sample(i):
+    x = float(i)
+    return {'timestamp': x, 'accel': (x, x, x), 'gyro': (x, x, x), 'compass': (x, x, x),
+            'fusionQPose': (x, x, x, x), 'accel.residuals': (x, x, x)}
+
+def consistent(data):
+    t = data['timestamp']
+    fields = ['accel', 'gyro', 'compass', 'fusionQPose', 'accel.residuals']
+    return all(v == t for name in fields for v in data[name])
+
+def writer(ring, count):
+    for i in range(count):
+        ring.write(sample(i))
+
+def run_writer(method, ring, count):
+    process = multiprocessing.get_context(method).Process(target=writer, args=(ring, count))
+    process.start()
+    return process
+
+def test_reader_never_sees_torn_samples():
+    ring = IMURing()
+    count = 200000
+    process = run_writer('fork', ring, count)
+    last = -1
+    while process.is_alive() or ring.written() != ring.count:
+        data = ring.read()
+        if data:
+            assert consistent(data)
+            assert data['timestamp'] > last
+            last = data['timestamp']
+    process.join()
+    assert ring.written() == count
+    assert last == count - 1
+
+def test_batch_counts_overwritten_samples():
+    ring = IMURing(size=8)
+    process = run_writer('fork', ring, 20)
+    process.join()
+    batch = ring.read_batch()
+    assert [data['timestamp'] for data in batch] == list(range(13, 20))
+    assert all(map(consistent, batch))
+    assert ring.overruns == 13
+    assert ring.read_batch() == [] and not ring.read()
+
+def test_slot_being_written_is_skipped():
+    ring = IMURing()
+    ring.write(sample(0))
+    ring_seq.pack_into(ring.mem, ring.slot(0), 1) # writer is in the slot
+    assert ring.read() is False
+    assert ring.count == 1
+
+def test_spawned_writer_wakes_reader():
+    ring = IMURing()
+    process = run_writer('spawn', ring, 10)
+    assert ring.wait(10)
+    process.join()
+    data = ring.read()
+    assert data['timestamp'] == 9 and consistent(data)
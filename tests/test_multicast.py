@@ -0,0 +1,69 @@
+import socket, struct
+
+import pytest
+
+import multicast
+from multicast import MulticastPublisher, MulticastReceiver
+
+from conftest import free_port, poll_until
+
+group = '239.192.23.99'
+
+# publisher and receiver on the loopback interface so no network is needed
+@pytest.fixture
+def pair():
+    port = free_port()
+    try:
+        receiver = MulticastReceiver(group, port)
+    except OSError as e:
+        pytest.skip('multicast unavailable: %s' % e)
+    mreq = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('127.0.0.1'))
+    try:
+        receiver.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    except OSError:
+        pass # loopback is the default interface and already joined
+    publisher = MulticastPublisher(group, port)
+    publisher.open()
+    publisher.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton('127.0.0.1'))
+    publisher.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    yield publisher, receiver
+    publisher.close()
+    receiver.close()
+
+class Receive(object): # polled by poll_until
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.received = []
+
+    def poll(self, timeout):
+        self.received += self.receiver.receive()
+
+def test_publish_receive(pair):
+    publisher, receiver = pair
+    publisher.write('imu.heading=123.4\n')
+    publisher.write('ap.mode="gps"\n', True, b'ap.mode="gps"\n')
+    publisher.write('error=invalid unknown value: x\n') # not sent
+    publisher.flush()
+    receive = Receive(receiver)
+    assert poll_until(lambda : len(receive.received) == 2, [receive])
+    assert receive.received == [('imu.heading', 123.4), ('ap.mode', 'gps')]
+    assert publisher.msgs_out == 2 and publisher.datagrams == 1
+
+def test_datagrams_fit_the_mtu_and_count_losses(pair):
+    publisher, receiver = pair
+    lines = ['imu.value%d=%s\n' % (i, '1'*50) for i in range(100)]
+    for line in lines:
+        publisher.write(line)
+    publisher.flush()
+    receive = Receive(receiver)
+    assert poll_until(lambda : len(receive.received) == len(lines), [receive])
+    assert [name for name, value in receive.received] == ['imu.value%d' % i for i in range(100)]
+    assert receiver.datagrams == publisher.datagrams > 1
+    assert publisher.bytes_out <= publisher.datagrams * multicast.multicast_mtu
+    assert receiver.lost == 0
+
+    publisher.seq += 2 # two datagrams lost
+    publisher.write('imu.heading=1\n')
+    publisher.flush()
+    assert poll_until(lambda : receiver.lost, [receive])
+    assert receiver.lost == 2
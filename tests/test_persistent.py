@@ -0,0 +1,41 @@
+import os
+
+from server import read_config_lines, PersistentWriter, journal_max_size
+
+def load(filename):
+    data = {None: {}, 'default': {}}
+    read_config_lines(filename, open(filename), data)
+    journal = filename + '.journal'
+    if os.path.exists(journal):
+        read_config_lines(journal, open(journal), data, True)
+    return data
+
+def write(filename, text):
+    f = open(filename, 'w')
+    f.write(text)
+    f.close()
+
+def test_journal_replay_ignores_torn_last_line(tmp_path):
+    filename = str(tmp_path / 'pypilot.conf')
+    write(filename, 'ap.a=1\nap.b=1\n[profile="default"]\nap.gain=1\n')
+    # killed while appending the last record
+    write(filename + '.journal', '[profile=null]\nap.a=2\nap.b=\n[profile="default"]\nap.gain=2\n[profile=null]\nap.a=3')
+    data = load(filename)
+    assert data[None] == {'ap.a': 'ap.a=2\n'}
+    assert data['default'] == {'ap.gain': 'ap.gain=2\n'}
+
+def test_store_after_torn_journal_compacts(tmp_path):
+    filename = str(tmp_path / 'pypilot.conf')
+    write(filename, 'ap.a=1\n')
+    write(filename + '.journal', '[profile=null]\nap.a=2\nap.b=3')
+    writer = PersistentWriter(filename, load(filename))
+    writer.store({None: {'ap.c': 'ap.c=4\n'}})
+    writer.flush()
+    # rewritten rather than appended after the torn record
+    assert not os.path.exists(filename + '.journal')
+    assert load(filename)[None] == {'ap.a': 'ap.a=2\n', 'ap.c': 'ap.c=4\n'}
+
+    writer.store({None: {'ap.a': 'ap.a=5\n', 'ap.c': None}})
+    writer.flush()
+    assert os.path.getsize(filename + '.journal') < journal_max_size
+    assert load(filename)[None] == {'ap.a': 'ap.a=5\n'}
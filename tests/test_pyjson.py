@@ -0,0 +1,51 @@
+import json, math
+
+import pytest
+
+import pyjson
+
+# every json library pypilot may pick must read and write what python json does
+@pytest.fixture(params=list(pyjson.codecs))
+def codec(request):
+    try:
+        return pyjson.codecs[request.param]()
+    except Exception as e:
+        pytest.skip('%s unavailable: %s' % (request.param, e))
+
+values = [1, -2.5, 123.4567, 'compass', True, None, [0.0123, -0.0456, 1.0012],
+          {'ap.heading': 0.5, 'ap.mode': {'choices': ['compass', 'gps']}}]
+
+def test_same_values_as_json(codec):
+    loads, dumps, loads_bytes, dumps_bytes = codec
+    for value in values:
+        assert json.loads(dumps(value)) == value
+        assert json.loads(dumps_bytes(value).decode()) == value
+        assert loads(json.dumps(value)) == value
+        assert loads_bytes(json.dumps(value).encode()) == value
+
+def test_nan_and_infinity_round_trip(codec):
+    loads, dumps, loads_bytes, dumps_bytes = codec
+    value = {'imu.heading': float('nan'), 'servo.position': [float('inf'), -float('inf'), 1.5]}
+    for data in [dumps(value), dumps_bytes(value).decode()]:
+        assert 'NaN' in data and '-Infinity' in data and not 'null' in data
+        assert math.isnan(json.loads(data)['imu.heading'])
+    for data in [dumps(value), json.dumps(value)]:
+        result = loads(data)
+        assert math.isnan(result['imu.heading'])
+        assert result['servo.position'] == value['servo.position']
+        result = loads_bytes(data.encode())
+        assert result['servo.position'] == value['servo.position']
+
+def test_float_subclass(codec):
+    class Float(float): # like numpy.float64 from the gps filter
+        pass
+    loads, dumps, loads_bytes, dumps_bytes = codec
+    value = {'gps.speed': Float(6.25), 'gps.fix': [Float(-1.5), 2]}
+    assert json.loads(dumps(value)) == json.loads(json.dumps(value))
+    assert json.loads(dumps_bytes(value)) == {'gps.speed': 6.25, 'gps.fix': [-1.5, 2]}
+
+def test_non_str_keys(codec):
+    loads, dumps, loads_bytes, dumps_bytes = codec
+    value = {1: 'a', 2.5: 'b', None: 'c'}
+    assert loads(dumps(value)) == json.loads(json.dumps(value))
+    assert loads_bytes(dumps_bytes(value)) == {'1': 'a', '2.5': 'b', 'null': 'c'}
@@ -0,0 +1,34 @@
+import server
+from client import pypilotClient
+from relay import pypilotRelay
+from values import Value, Property
+
+from conftest import free_port, poll_until
+
+def test_relay_round_trip(monkeypatch):
+    monkeypatch.setattr(server, 'use_multiprocessing', False) # the relay also sets it
+    upstream = server.pypilotServer(free_port(), persistent=False)
+    owner = pypilotClient(upstream)
+    a = owner.register(Value('test.a', 1))
+    w = owner.register(Property('test.w', 0))
+    upstream.poll()
+    relay = pypilotRelay('127.0.0.1:%d' % upstream.port, free_port())
+    relay.poll()
+
+    clients = [pypilotClient('127.0.0.1:%d' % relay.server.port) for i in range(2)]
+    polled = [owner, upstream, relay] + clients
+    received = [{} for client in clients]
+    def receive(name, value):
+        for client, r in zip(clients, received):
+            r.update(client.receive())
+        return all(r.get(name) == value for r in received)
+    for client in clients:
+        client.watch('test.a')
+    assert poll_until(lambda : receive('test.a', 1), polled)
+    a.set(2)
+    assert poll_until(lambda : receive('test.a', 2), polled)
+
+    clients[0].set('test.w', 5) # sets go upstream to the owner
+    assert poll_until(lambda : w.value == 5, polled)
+    assert len(upstream.sockets) == 1 # only the relay, however many clients
+    assert len(relay.server.sockets) == 2
@@ -0,0 +1,65 @@
+import math, os, subprocess, sys
+
+import pyjson
+from replay import *
+
+pypilot_dir = os.path.dirname(os.path.abspath(pyjson.__file__))
+
+# a recording of the boat swinging about the heading command
+def make_log(filename, iterations=300):
+    f = open_log(filename, 'wb')
+    f.write(log_magic)
+    def write_json(kind, t, data):
+        data = pyjson.dumps_bytes(data)
+        f.write(record_header.pack(kind, t) + record_length.pack(len(data)) + data)
+    t = 1000
+    write_json(VALUE, t, ['ap.heading_command', 90])
+    write_json(VALUE, t, ['ap.enabled', True])
+    for i in range(iterations):
+        t += .1
+        f.write(record_header.pack(TICK, t))
+        heading = math.radians(90 + 10*math.sin(i/20))
+        q = [math.cos(heading/2), 0, 0, math.sin(heading/2)]
+        gyro = [0, 0, .5*math.cos(i/20)]
+        f.write(record_header.pack(IMU, t) + imu_sample.pack(t, 0, 0, 1, *gyro, 30, 0, 0, *q, 0, 0, 0, False))
+        if i == 150:
+            write_json(VALUE, t, ['ap.heading_command', 100])
+    f.close()
+
+def run(*args, cwd):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(pypilot_dir))
+    return subprocess.run([sys.executable] + list(args), cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+def test_replay_is_deterministic(tmp_path):
+    log = str(tmp_path / 'sail.log.gz')
+    make_log(log)
+    outputs = []
+    for i in range(2):
+        output = str(tmp_path / ('output%d' % i))
+        result = run(os.path.join(pypilot_dir, 'replay.py'), '-o', output, log, cwd=tmp_path)
+        assert result.returncode == 0, result.stdout + result.stderr
+        outputs.append(open(output).read())
+    lines = outputs[0].splitlines()
+    assert len(lines) == 300
+    assert outputs[0] == outputs[1]
+    assert pyjson.loads(lines[-1])['ap.heading_command'] == 100
+    assert any(pyjson.loads(line)['servo.command'] for line in lines)
+
+def test_replay_restores_the_clock(tmp_path):
+    log = str(tmp_path / 'sail.log')
+    make_log(log, 20)
+    script = '''
+import sys, time
+sys.path.insert(0, %r)
+import replay
+monotonic, sleep = time.monotonic, time.sleep
+player = replay.Player(%r)
+assert time.monotonic is monotonic and time.sleep is sleep
+start = player.clock
+while player.step():
+    assert time.monotonic is monotonic and time.sleep is sleep
+print(round(player.clock - start, 3))
+''' % (pypilot_dir, log)
+    result = run('-c', script, cwd=tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.splitlines()[-1] == '2.0'
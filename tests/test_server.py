@@ -0,0 +1,179 @@
+import json, socket, time
+
+import server
+from client import pypilotClient
+from values import Value, Property
+
+from conftest import free_port, poll_until
+
+# server polled in this process by the test
+def local_server(monkeypatch):
+    monkeypatch.setattr(server, 'use_multiprocessing', False)
+    return server.pypilotServer(free_port(), persistent=False)
+
+def test_socket_not_reading_is_closed(monkeypatch):
+    monkeypatch.setattr(server, 'writable_timeout', .2)
+    pserver = local_server(monkeypatch)
+    owner = pypilotClient(pserver)
+    big = owner.register(Value('test.big', ''))
+    pserver.poll()
+
+    peer = socket.socket()
+    peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    peer.connect(('127.0.0.1', pserver.port))
+    peer.sendall(b'watch={"test.big": true}\n')
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < 5:
+        big.set('x'*20000 + str(time.monotonic()))
+        owner.poll()
+        pserver.poll()
+        if not pserver.sockets:
+            break
+    assert not pserver.sockets # closed although the peer never read
+    peer.close()
+
+def connected_client(pserver, clients):
+    client = pypilotClient('127.0.0.1:%d' % pserver.port)
+    assert client.connect()
+    assert poll_until(lambda : client.connection, clients + [client])
+    return client
+
+# values received while the owner and server are polled
+def collect(client, others, duration=.3):
+    received = {}
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < duration:
+        for other in others:
+            other.poll()
+        for name, value in client.receive(.01).items():
+            received.setdefault(name, []).append(value)
+    return received
+
+def test_prefix_watch_add_remove(monkeypatch):
+    pserver = local_server(monkeypatch)
+    owner = pypilotClient(pserver)
+    a = owner.register(Value('imu.a', 0))
+    b = owner.register(Value('imu.b', 0))
+    c = owner.register(Value('ap.c', 0))
+    pserver.poll()
+    client = connected_client(pserver, [owner, pserver])
+    client.watch('imu.*')
+    collect(client, [owner, pserver])
+
+    for value in [a, b, c]:
+        value.set(1)
+    received = collect(client, [owner, pserver])
+    assert received == {'imu.a': [1], 'imu.b': [1]}
+
+    # a watch by name outlives removing the prefix
+    client.watch('imu.a')
+    collect(client, [owner, pserver])
+    client.watch('imu.*', False)
+    collect(client, [owner, pserver])
+    for value in [a, b, c]:
+        value.set(2)
+    received = collect(client, [owner, pserver])
+    assert received == {'imu.a': [2]}
+
+def test_concurrent_gets_are_all_answered(monkeypatch):
+    pserver = local_server(monkeypatch)
+    owner = pypilotClient(pserver)
+    a = owner.register(Value('test.a', 1))
+    pserver.poll()
+    poll_until(lambda : 'test.a' in pserver.values.values, [owner, pserver])
+    peer = socket.socket()
+    peer.connect(('127.0.0.1', pserver.port))
+    peer.settimeout(.01)
+    peer.sendall(b'get=["test.a"]\nget=["test.a"]\nget=["test.*"]\n')
+    data = b''
+    t0 = time.monotonic()
+    while data.count(b'get=') < 3 and time.monotonic() - t0 < 5:
+        owner.poll()
+        pserver.poll()
+        try:
+            data += peer.recv(65536)
+        except socket.timeout:
+            pass
+    lines = data.decode().split('\n')
+    assert lines.count('get=["test.a"]') == 2 and lines.count('get=["test.*"]') == 1
+    assert lines.count('test.a=1') == 3
+    peer.close()
+
+def test_reconnect_resumes_session(monkeypatch):
+    pserver = local_server(monkeypatch)
+    owner = pypilotClient(pserver)
+    a = owner.register(Value('test.a', 1))
+    b = owner.register(Value('test.b', 1))
+    pserver.poll()
+    client = connected_client(pserver, [owner, pserver])
+    client.watch('test.a')
+    client.watch('test.b')
+    assert collect(client, [owner, pserver]) == {'test.a': [1], 'test.b': [1]}
+    time.sleep(1.1) # older than data that may have been in flight when disconnected
+    a.set(1.5)
+    assert collect(client, [owner, pserver]) == {'test.a': [1.5]}
+
+    client.disconnect()
+    a.set(2) # changed while disconnected
+    received = collect(client, [owner, pserver], 1)
+    assert client.connection and client.connect_stats['resumed'] == 1
+    assert received == {'test.a': [2]} # only the value that changed
+
+    a.set(3) # the watches were kept
+    b.set(3)
+    assert collect(client, [owner, pserver]) == {'test.a': [3], 'test.b': [3]}
+
+def test_reconnect_without_session_watches_again(monkeypatch):
+    pserver = local_server(monkeypatch)
+    owner = pypilotClient(pserver)
+    a = owner.register(Value('test.a', 1))
+    pserver.poll()
+    client = connected_client(pserver, [owner, pserver])
+    client.watch('test.a')
+    assert collect(client, [owner, pserver]) == {'test.a': [1]}
+
+    client.disconnect()
+    client.session = 'forgotten' # eg: the server restarted
+    collect(client, [owner, pserver], 1)
+    assert client.connection and client.connect_stats['resumed'] == 0
+    a.set(2)
+    assert collect(client, [owner, pserver]) == {'test.a': [2]}
+
+def test_profile_switch_sends_one_batch(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'use_multiprocessing', False)
+    monkeypatch.setattr(server, 'configfilepath', str(tmp_path) + '/')
+    pserver = server.pypilotServer(free_port()) # profiles are persistent
+    owner = pypilotClient(pserver)
+    gains = [owner.register(Property('ap.gain%d' % i, 1, profiled=True)) for i in range(20)]
+    pserver.poll()
+    poll_until(lambda : 'ap.gain19' in pserver.values.values, [owner, pserver])
+    peer = socket.socket()
+    peer.connect(('127.0.0.1', pserver.port))
+    peer.settimeout(.01)
+    def exchange(request=b'', duration=.3):
+        peer.sendall(request)
+        data = b''
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < duration:
+            owner.poll()
+            pserver.poll()
+            try:
+                data += peer.recv(65536)
+            except socket.timeout:
+                pass
+        return data.decode().split('\n')[:-1]
+    names = ['ap.gain%d' % i for i in range(20)]
+    exchange(('watch=' + json.dumps(dict((name, True) for name in names + ['profile'])) + '\n').encode())
+
+    assert exchange(b'profile="tack"\n') == ['profile="tack"'] # copied from default
+    for gain in gains:
+        gain.set(2)
+    assert sorted(exchange()) == sorted(name + '=2' for name in names)
+
+    # the values of the profile are sent together before the profile itself,
+    # the owner accepting each one is not sent to watchers again
+    lines = exchange(b'profile="default"\n')
+    assert lines == [name + '=1' for name in names] + ['profile="default"']
+    assert all(gain.value == 1 for gain in gains)
+    assert exchange() == []
+    peer.close()
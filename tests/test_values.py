@@ -0,0 +1,40 @@
+from values import Value, SensorValue, StringValue
+
+def test_message_is_cached_until_set():
+    value = SensorValue('test.sensor', 1.0)
+    msg = value.get_cached_msg()
+    assert msg == 'test.sensor=1.0000\n'
+    assert value.get_cached_msg() is msg
+    value.set(2.0)
+    assert value.get_cached_msg() == 'test.sensor=2.0000\n'
+
+class CountValue(StringValue): # get_msg that changes each time it is called
+    def __init__(self, name):
+        self.count = 0
+        super(CountValue, self).__init__(name, '')
+
+    def get_msg(self):
+        self.count += 1
+        return '"%d"' % self.count
+
+class DirectValue(Value): # sets value without Value.set
+    def set(self, value):
+        self.value = value
+
+def test_subclasses_changing_the_message_are_not_cached():
+    value = CountValue('test.count')
+    assert value.get_cached_msg() != value.get_cached_msg()
+
+    value = DirectValue('test.direct', 1)
+    value.get_cached_msg()
+    value.set(2)
+    assert value.get_cached_msg() == 'test.direct=2\n'
+
+def test_subclass_may_declare_caching():
+    class Rounded(SensorValue):
+        cache_msg = True
+        def get_msg(self):
+            return '%.1f' % self.value
+    assert Rounded.cache_msg and not DirectValue.cache_msg and not CountValue.cache_msg
+    value = Rounded('test.rounded', 1.23)
+    assert value.get_cached_msg() is value.get_cached_msg()